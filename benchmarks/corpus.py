@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import random
+from tqdm import tqdm
+
+
+PAGE_WIDTH = 612.0
+PAGE_HEIGHT = 792.0
+WORDS_PER_LINE = 12
+PDF_FONT_SIZE = 6
+CORPUS_META = "corpus.json"
+CORPUS_ARGS = (
+    "n_docs", "min_pages", "max_pages", "words_per_page", "abstract_len", "noise", "missing_rate", "seed"
+)
+
+HTML_HEADER = (
+    '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" '
+    '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml">\n<head>\n<title></title>\n</head>\n<body>\n<doc>\n'
+)
+HTML_FOOTER = "</doc>\n</body>\n</html>\n"
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyzéèàçñãõ"
+
+
+def make_vocab(rng, size=5000):
+    return [
+        "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 12))) for _ in range(size)
+    ]
+
+
+def word_bbox(i):
+    """ Float bbox of the i-th word of a page, laid out in lines of WORDS_PER_LINE words """
+    x = 50 + (i % WORDS_PER_LINE) * 42.37
+    y = 60 + (i // WORDS_PER_LINE) * 11.71
+    return x, y, x + 31.49, y + 9.56
+
+
+def add_noise(rng, text, num_edits):
+    """ Apply `num_edits` random character substitutions, insertions and deletions """
+    chars = list(text)
+    for _ in range(num_edits):
+        if not chars:
+            break
+        pos = rng.randrange(len(chars))
+        op = rng.choice(("sub", "ins", "del"))
+        if op == "sub":
+            chars[pos] = rng.choice(ALPHABET)
+        elif op == "ins":
+            chars.insert(pos, rng.choice(ALPHABET))
+        else:
+            del chars[pos]
+    return "".join(chars)
+
+
+def page_to_html(words):
+    lines = [
+        f'<page width="{PAGE_WIDTH:.6f}" height="{PAGE_HEIGHT:.6f}">',
+        "<flow>",
+        '<block xMin="50.000000" yMin="60.000000" xMax="560.000000" yMax="740.000000">',
+    ]
+    for line_start in range(0, len(words), WORDS_PER_LINE):
+        x0, y0, _, _ = word_bbox(line_start)
+        lines.append(f'<line xMin="{x0:.6f}" yMin="{y0:.6f}" xMax="560.000000" yMax="{y0 + 9.56:.6f}">')
+        for i in range(line_start, min(line_start + WORDS_PER_LINE, len(words))):
+            xmin, ymin, xmax, ymax = word_bbox(i)
+            lines.append(
+                f'<word xMin="{xmin:.6f}" yMin="{ymin:.6f}" xMax="{xmax:.6f}" yMax="{ymax:.6f}">{words[i]}</word>'
+            )
+        lines.append("</line>")
+    lines += ["</block>", "</flow>", "</page>"]
+    return "\n".join(lines) + "\n"
+
+
+def pages_to_txt(pages):
+    """ Token file of the pages, as `parse_html` writes it from the HTML of `page_to_html`
+        (except for the few words `extract_text_from_tree` loses when a <word> tag straddles
+        two read buffers)
+    """
+    width, height = round(PAGE_WIDTH), round(PAGE_HEIGHT)
+    lines = []
+    for page_num, words in enumerate(pages, start=1):
+        for i, word in enumerate(words):
+            bbox = [round(b) for b in word_bbox(i)]
+            lines.append(
+                "\t".join([word] + [str(b) for b in bbox] + [str(width), str(height), str(page_num)]) + "\n"
+            )
+    return "".join(lines)
+
+
+def _pdf_string(word):
+    data = word.encode("cp1252")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def pages_to_pdf(pages):
+    """ Minimal PDF drawing the words of each page in Helvetica, in the lines of `page_to_html`.
+        Words are separated by spaces, so their horizontal positions differ from the HTML.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None, # page tree, once the pages are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_refs = []
+    for words in pages:
+        content = [b"BT", f"/F1 {PDF_FONT_SIZE} Tf".encode()]
+        for line_start in range(0, len(words), WORDS_PER_LINE):
+            xmin, _, _, ymax = word_bbox(line_start)
+            line = " ".join(words[line_start: line_start + WORDS_PER_LINE])
+            content.append(
+                f"1 0 0 1 {xmin:.2f} {PAGE_HEIGHT - ymax + 1:.2f} Tm ".encode() + _pdf_string(line) + b" Tj"
+            )
+        content.append(b"ET")
+        stream = b"\n".join(content)
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] " % (PAGE_WIDTH, PAGE_HEIGHT)
+            + b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        page_refs.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(page_refs) + b"] /Count %d >>" % len(pages)
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for num, obj in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % num + obj + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return data
+
+
+def generate_doc(rng, vocab, args):
+    """ Generate the pages of a document and plant its abstract
+
+    Returns:
+        tuple: (pages, abstract written in the abstract file, page number of the abstract or None)
+    """
+    num_pages = rng.randint(args.min_pages, args.max_pages)
+    pages = [
+        [rng.choice(vocab) for _ in range(max(1, int(rng.gauss(args.words_per_page, args.words_per_page / 5))))]
+        for _ in range(num_pages)
+    ]
+    abstract = [rng.choice(vocab) for _ in range(args.abstract_len)]
+
+    abstract_page = None
+    if rng.random() >= args.missing_rate:
+        # mostly on the first page, sometimes on the second or the last one
+        abstract_page = rng.choices(
+            [1, min(2, num_pages), num_pages], weights=[0.8, 0.1, 0.1]
+        )[0]
+        page = pages[abstract_page - 1]
+        start = rng.randint(0, max(0, len(page) - args.abstract_len) // 4)
+        page[start: start + len(abstract)] = abstract
+
+    noisy_abstract = add_noise(rng, " ".join(abstract), args.noise)
+    return pages, noisy_abstract, abstract_page
+
+
+def generate_corpus(args):
+    """ Write synthetic PDF files, their pdftotext HTML files and token .txt files, and an abstract JSONL """
+    rng = random.Random(args.seed)
+    vocab = make_vocab(rng)
+
+    html_dir = os.path.join(args.output_dir, "html")
+    txt_dir = os.path.join(args.output_dir, "txt")
+    pdf_dir = os.path.join(args.output_dir, "pdf")
+    os.makedirs(html_dir, exist_ok=True)
+    os.makedirs(txt_dir, exist_ok=True)
+    os.makedirs(pdf_dir, exist_ok=True)
+
+    planted = {}
+    with open(os.path.join(args.output_dir, "abstracts.jsonl"), "w", encoding="utf-8") as fw:
+        for i in tqdm(range(args.n_docs), desc=f"Generating corpus in {args.output_dir}"):
+            doc_id = f"doc{i:06d}"
+            pages, abstract, abstract_page = generate_doc(rng, vocab, args)
+            planted[doc_id] = abstract_page
+
+            with open(os.path.join(html_dir, doc_id + ".html"), "w", encoding="utf-8") as f:
+                f.write(HTML_HEADER + "".join(page_to_html(page) for page in pages) + HTML_FOOTER)
+            with open(os.path.join(txt_dir, doc_id + ".txt"), "w", encoding="utf-8") as f:
+                f.write(pages_to_txt(pages))
+            with open(os.path.join(pdf_dir, doc_id + ".pdf"), "wb") as f:
+                f.write(pages_to_pdf(pages))
+            json.dump({"id": doc_id, "abstract": abstract}, fw, ensure_ascii=False)
+            fw.write("\n")
+
+    meta = {key: getattr(args, key) for key in CORPUS_ARGS}
+    meta["planted_pages"] = planted
+    with open(os.path.join(args.output_dir, CORPUS_META), "w") as f:
+        json.dump(meta, f)
+
+
+def add_corpus_args(parser):
+    parser.add_argument(
+        "--n_docs",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "--min_pages",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--max_pages",
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        "--words_per_page",
+        type=int,
+        default=400,
+    )
+    parser.add_argument(
+        "--abstract_len",
+        type=int,
+        default=150,
+        help="Number of words of each abstract."
+    )
+    parser.add_argument(
+        "--noise",
+        type=int,
+        default=5,
+        help="Number of character edits applied to each abstract."
+    )
+    parser.add_argument(
+        "--missing_rate",
+        type=float,
+        default=0.1,
+        help="Fraction of documents that do not contain their abstract."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+    )
+    add_corpus_args(parser)
+
+    args = parser.parse_args()
+
+    generate_corpus(args)
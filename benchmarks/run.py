@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import statistics
+import tempfile
+import time
+import tracemalloc
+from benchmarks.corpus import CORPUS_META, add_corpus_args, generate_corpus
+from src.parse_html import extract_text_from_tree, extract_text_from_pdf
+from src.remove_abstract import find_abstract_span, find_word_idx_for_span
+from src.state_store import StateStore, DONE
+from src.utils import get_doc_content, remove_processed_from_id_list
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """ Register a benchmark. The decorated function takes the corpus directory and
+        returns (run, num_docs, num_words), `run` being the timed callable, or None if
+        the benchmark cannot run (missing tool or corpus folder).
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _list(corpus_dir, folder, ext):
+    folder = os.path.join(corpus_dir, folder)
+    return [
+        os.path.join(folder, fname) for fname in sorted(os.listdir(folder)) if fname.endswith(ext)
+    ]
+
+
+def _load_abstracts(corpus_dir):
+    with open(os.path.join(corpus_dir, "abstracts.jsonl"), "r", encoding="utf-8") as f:
+        return {item["id"]: item["abstract"] for item in map(json.loads, f)}
+
+
+def _load_pages(txt_path):
+    pages = {}
+    with open(txt_path, "r", encoding="utf-8") as f:
+        for line in f:
+            content = line.split("\t")
+            pages.setdefault(int(content[-1]), []).append(content[0])
+    return pages
+
+
+def _num_words(txt_paths):
+    total = 0
+    for path in txt_paths:
+        with open(path, "rb") as f:
+            total += sum(1 for _ in f)
+    return total
+
+
+@benchmark("parse_html.extract_text_from_tree")
+def bench_extract_text_from_tree(corpus_dir):
+    html_paths = _list(corpus_dir, "html", ".html")
+    num_words = _num_words(_list(corpus_dir, "txt", ".txt"))
+
+    def run():
+        for path in html_paths:
+            extract_text_from_tree(path)
+
+    return run, len(html_paths), num_words
+
+
+@benchmark("parse_html.extract_text_from_tree.legacy")
+def bench_extract_text_from_tree_legacy(corpus_dir):
+    html_paths = _list(corpus_dir, "html", ".html")
+    num_words = _num_words(_list(corpus_dir, "txt", ".txt"))
+
+    def run():
+        for path in html_paths:
+            extract_text_from_tree(path, parser="legacy")
+
+    return run, len(html_paths), num_words
+
+
+def _pdf_benchmark(corpus_dir, backend):
+    pdf_dir = os.path.join(corpus_dir, "pdf")
+    if not os.path.isdir(pdf_dir): # corpus generated before PDFs were added
+        return None
+    fnames = sorted(fname for fname in os.listdir(pdf_dir) if fname.endswith(".pdf"))
+    num_words = _num_words(_list(corpus_dir, "txt", ".txt"))
+
+    def run():
+        for fname in fnames:
+            extract_text_from_pdf(None, pdf_dir, fname, backend=backend)
+
+    return run, len(fnames), num_words
+
+
+@benchmark("parse_html.extract_text_from_pdf.pdftotext")
+def bench_extract_text_from_pdf_pdftotext(corpus_dir):
+    # one pdftotext process per PDF, parsed from its standard output
+    if shutil.which("pdftotext") is None:
+        return None
+    return _pdf_benchmark(corpus_dir, "pdftotext")
+
+
+@benchmark("parse_html.extract_text_from_pdf.pdfminer")
+def bench_extract_text_from_pdf_pdfminer(corpus_dir):
+    return _pdf_benchmark(corpus_dir, "pdfminer")
+
+
+@benchmark("utils.get_doc_content")
+def bench_get_doc_content(corpus_dir):
+    txt_paths = _list(corpus_dir, "txt", ".txt")
+
+    def run():
+        for path in txt_paths:
+            get_doc_content(path)
+
+    return run, len(txt_paths), _num_words(txt_paths)
+
+
+def _first_page_inputs(corpus_dir):
+    """ (text of the first page, abstract) of each document, as searched first by remove_abstract """
+    abstracts = _load_abstracts(corpus_dir)
+    inputs = []
+    for path in _list(corpus_dir, "txt", ".txt"):
+        doc_id = os.path.basename(path)[:-len(".txt")]
+        pages = _load_pages(path)
+        inputs.append((" ".join(pages[min(pages)]), abstracts[doc_id]))
+    return inputs
+
+
+@benchmark("remove_abstract.find_abstract_span")
+def bench_find_abstract_span(corpus_dir):
+    inputs = _first_page_inputs(corpus_dir)
+
+    def run():
+        for text, abstract in inputs:
+            find_abstract_span(text, abstract)
+
+    return run, len(inputs), sum(len(text.split()) for text, _ in inputs)
+
+
+@benchmark("remove_abstract.find_abstract_span.not_found")
+def bench_find_abstract_span_not_found(corpus_dir):
+    # abstract of the next document: most searched pages do not contain the abstract
+    inputs = _first_page_inputs(corpus_dir)
+    inputs = [(text, inputs[(i + 1) % len(inputs)][1]) for i, (text, _) in enumerate(inputs)]
+
+    def run():
+        for text, abstract in inputs:
+            find_abstract_span(text, abstract)
+
+    return run, len(inputs), sum(len(text.split()) for text, _ in inputs)
+
+
+@benchmark("remove_abstract.find_word_idx_for_span")
+def bench_find_word_idx_for_span(corpus_dir):
+    inputs = []
+    for text, abstract in _first_page_inputs(corpus_dir):
+        # span of a slice of words in the middle of the page
+        words = text.split()
+        start = len(" ".join(words[: len(words) // 4])) + 1
+        end = len(" ".join(words[: len(words) // 2]))
+        inputs.append((text, start, end))
+
+    def run():
+        for text, start, end in inputs:
+            find_word_idx_for_span(text, start, end)
+
+    return run, len(inputs), sum(len(text.split()) for text, _, _ in inputs)
+
+
+@benchmark("utils.remove_processed_from_id_list")
+def bench_remove_processed_from_id_list(corpus_dir, num_ids=100000):
+    tmp_dir = tempfile.mkdtemp(prefix="bench-")
+    state_store = StateStore(os.path.join(tmp_dir, "state.db"), stage="bench")
+    id_list = [f"id{i:08d}" for i in range(num_ids)]
+    for doc_id in id_list[::2]: # half of the IDs have been processed
+        state_store.record(doc_id, DONE)
+    state_store.flush()
+
+    def run():
+        remove_processed_from_id_list(id_list, state_store)
+
+    run.cleanup = lambda: (state_store.close(), shutil.rmtree(tmp_dir))
+    return run, num_ids, 0
+
+
+def time_benchmark(run, repeat):
+    """ Run `repeat` times, then once more under tracemalloc to get the peak Python heap usage """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def run_benchmarks(args):
+    names = args.only or list(BENCHMARKS)
+    with open(os.path.join(args.corpus_dir, CORPUS_META), "r") as f:
+        corpus_meta = json.load(f)
+    corpus_meta.pop("planted_pages", None)
+
+    results = {}
+    for name in names:
+        setup = BENCHMARKS[name](args.corpus_dir)
+        if setup is None:
+            print(f"{name:45s} skipped")
+            continue
+        run, num_docs, num_words = setup
+        try:
+            times, peak = time_benchmark(run, args.repeat)
+        finally:
+            if hasattr(run, "cleanup"):
+                run.cleanup()
+        best = min(times)
+        results[name] = {
+            "num_docs": num_docs,
+            "num_words": num_words,
+            "times": times,
+            "best_s": best,
+            "median_s": statistics.median(times),
+            "docs_per_s": num_docs / best if best > 0 else None,
+            "words_per_s": num_words / best if best > 0 and num_words else None,
+            "peak_mem_mb": peak / 2 ** 20,
+        }
+        print(
+            f"{name:45s} best {best:8.3f}s  median {results[name]['median_s']:8.3f}s  "
+            f"{results[name]['docs_per_s']:12.1f} docs/s  peak {results[name]['peak_mem_mb']:8.1f} MB"
+        )
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+            "corpus": corpus_meta,
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline_path):
+    """ Print the speedup of each benchmark relative to a previous results file """
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    if baseline["meta"]["corpus"] != results["meta"]["corpus"]:
+        print("Warning: the baseline was run on a different corpus.")
+
+    print(f"\nCompared to {baseline_path} ({baseline['meta']['revision']}):")
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]
+        speedup = before["best_s"] / result["best_s"] if result["best_s"] > 0 else float("inf")
+        print(
+            f"{name:45s} {before['best_s']:8.3f}s -> {result['best_s']:8.3f}s  x{speedup:.2f}  "
+            f"peak {before['peak_mem_mb']:.1f} -> {result['peak_mem_mb']:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--corpus_dir",
+        type=str,
+        required=True,
+        help="Synthetic corpus, generated with the options below if it does not exist."
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default=None,
+        help="Write the results to this JSON file."
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="Results JSON file of a previous run to compare to."
+    )
+    parser.add_argument(
+        "--only",
+        type=str,
+        nargs="+",
+        default=None,
+        choices=list(BENCHMARKS),
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+    )
+    add_corpus_args(parser)
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(os.path.join(args.corpus_dir, CORPUS_META)):
+        args.output_dir = args.corpus_dir
+        generate_corpus(args)
+
+    results = run_benchmarks(args)
+
+    if args.output_path is not None:
+        with open(args.output_path, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        compare(results, args.compare)
@@ -1,6 +1,12 @@
 from . import (
+    abstract_index,
     convert_pdf_to_html,
     convert_pdf_to_image,
+    downloader,
+    metrics,
     parse_html,
+    pipeline,
+    state_store,
+    token_format,
     utils,
 )
\ No newline at end of file
@@ -0,0 +1,137 @@
+import json
+import mmap
+import os
+
+
+INDEX_EXT = ".idx"
+
+
+class AbstractIndex:
+    """ Random access over an abstract JSONL file
+
+    Maps each document ID to the byte offset and length of its line. The index is
+    persisted next to the JSONL (`<abstract_path>.idx`) and only rebuilt when the
+    JSONL size or modification time changes. Lookups seek into an mmap of the JSONL
+    and decode a single line. If an ID appears several times, the first line is kept.
+
+    Args:
+        abstract_path (string): Path to the abstract JSONL file
+        index_path (string): Path to the persisted index, defaults to `<abstract_path>.idx`
+    """
+
+    def __init__(self, abstract_path, index_path=None):
+        self.abstract_path = abstract_path
+        self.index_path = index_path or abstract_path + INDEX_EXT
+        self._mmap = None
+        self._file = None
+        self.signature = None
+        self.offsets = self._load_or_build()
+
+    def _signature(self):
+        stat = os.stat(self.abstract_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load_or_build(self):
+        size, mtime_ns = self._signature()
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+                if index["size"] == size and index["mtime_ns"] == mtime_ns:
+                    self.signature = (size, mtime_ns)
+                    return index["offsets"]
+            except (ValueError, KeyError):
+                pass # corrupted index, rebuild
+        return self.build()
+
+    def build(self):
+        """ Scan the JSONL once and persist the id -> (offset, length) index """
+        size, mtime_ns = self._signature()
+        offsets = {}
+        offset = 0
+        with open(self.abstract_path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    doc_id = json.loads(line)["id"]
+                    if doc_id not in offsets:
+                        offsets[doc_id] = (offset, len(line))
+                offset += len(line)
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": size, "mtime_ns": mtime_ns, "offsets": offsets}, f)
+        os.replace(tmp_path, self.index_path)
+
+        self.close()
+        self.signature = (size, mtime_ns)
+        return offsets
+
+    @property
+    def mmap(self):
+        if self._mmap is None:
+            self._file = open(self.abstract_path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def __contains__(self, doc_id):
+        return doc_id in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def ids(self):
+        """ Document IDs, in file order """
+        return sorted(self.offsets, key=lambda doc_id: self.offsets[doc_id][0])
+
+    def get(self, doc_id, default=None):
+        """ Decode the item of a document, or return `default` if not in the file """
+        if doc_id not in self.offsets:
+            return default
+        offset, length = self.offsets[doc_id]
+        return json.loads(self.mmap[offset: offset + length])
+
+    def ordered(self, doc_ids):
+        """ IDs of `doc_ids` that are in the file, in file order """
+        return sorted(
+            (doc_id for doc_id in set(doc_ids) if doc_id in self.offsets),
+            key=lambda doc_id: self.offsets[doc_id][0]
+        )
+
+    def items(self, doc_ids=None):
+        """ Yield (doc_id, item) pairs in file order, restricted to `doc_ids` if given """
+        doc_ids = self.ids() if doc_ids is None else self.ordered(doc_ids)
+        for doc_id in doc_ids:
+            yield doc_id, self.get(doc_id)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+        self._mmap = None
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # mmaps cannot be pickled, they are reopened lazily in worker processes
+        state = self.__dict__.copy()
+        state["_mmap"] = None
+        state["_file"] = None
+        return state
+
+
+_open_indexes = {}
+
+def get_abstract_index(abstract_path):
+    """ Get the index of an abstract file, reusing it across calls while the file is unchanged """
+    index = _open_indexes.get(abstract_path)
+    if index is None or index._signature() != index.signature:
+        if index is not None:
+            index.close()
+        index = AbstractIndex(abstract_path)
+        _open_indexes[abstract_path] = index
+    return index
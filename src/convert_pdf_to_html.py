@@ -1,27 +1,138 @@
 from sys import prefix
-from typing import Optional, Union
+from typing import Optional, Tuple, Union
 import subprocess
 from pathlib import Path
 import os
 import shutil
+import uuid
 import argparse
 from tqdm import tqdm
 from src.utils import remove_processed_from_id_list
-from multiprocessing import Process
-import PyPDF2
+from src.state_store import StateStore, DONE, FAILED, SCANNED, TIMEOUT, OOM
+from src.limits import Watchdog, popen_limited, failure_status, add_limit_args
+from src.dedup import content_keys_from_catalog, plan_dedup, record_copies, link_file, add_dedup_args
+from src import metrics
+from functools import partial
+from multiprocessing import Pool
 from PyPDF2 import PdfFileReader
+from src.pdf_catalog import (
+    SCANNED_CHECK_PAGES, PdfReadError, is_scanned_pdf, get_pdf_catalog, add_catalog_args
+)
+
+STAGE = "pdf_to_html"
+
+
+def check_catalog_entry(entry, max_pages, scanned_check_pages=0, first_page=1):
+    """ `check_pdf` from the catalog entry of a PDF, without opening it
+
+    Returns:
+        tuple: (status, reason) as returned by `check_pdf`, or None if the entry does not 
+               tell whether the checked pages have a text layer
+    """
+    if entry.broken:
+        return FAILED, "invalid_pdf"
+    if max_pages > 0 and entry.num_pages > max_pages: 
+        return FAILED, "too_many_pages"
+    if scanned_check_pages > 0:
+        if first_page != 1 or scanned_check_pages != entry.text_check_pages:
+            return None
+        if not entry.has_text:
+            return SCANNED, "no_text_layer"
+    return None, None
+
+
+def check_pdf(filepath, max_pages, scanned_check_pages=0, first_page=1, pdf_catalog=None):
+    """ Cheap checks before running pdftotext on a PDF
+
+    Args:
+        filepath (string): Path to the PDF
+        max_pages (int): Maximum number of pages (-1 for no limit)
+        scanned_check_pages (int): Number of pages checked for a text layer (0 to disable the check)
+        first_page (int): First page converted by pdftotext
+        pdf_catalog (string): Path to a PDF catalog. The PDF is only opened if it has no 
+                              up-to-date entry in it.
+
+    Returns:
+        tuple: (status, reason), status being None if the PDF can be converted, FAILED 
+               if it cannot be read or has too many pages, and SCANNED if it has no text layer
+    """
+    entry = get_pdf_catalog(pdf_catalog).get(filepath) if pdf_catalog is not None else None
+    if entry is not None:
+        checked = check_catalog_entry(entry, max_pages, scanned_check_pages, first_page)
+        if checked is not None:
+            return checked
 
-def _is_valid_pdf(filepath, max_pages):
     try:
         with open(filepath, "rb") as pdf_file:
             pdf_reader = PdfFileReader(pdf_file, strict=False)
             num_pages = pdf_reader.numPages
-        if max_pages > 0 and num_pages > max_pages: 
-            return False 
-        else:
-            return True 
-    except (PyPDF2.utils.PdfReadError, OSError, ValueError, AssertionError):
-        return False 
+            if max_pages > 0 and num_pages > max_pages: 
+                return FAILED, "too_many_pages"
+            if scanned_check_pages > 0 and is_scanned_pdf(pdf_reader, first_page, scanned_check_pages):
+                return SCANNED, "no_text_layer"
+    except (PdfReadError, OSError, ValueError, AssertionError):
+        return FAILED, "invalid_pdf"
+    return None, None
+
+
+def _pdftotext_command(
+    input_dir, pdf_folder, filename, output_path, use_docker, first_page, container_name=None, max_memory=-1
+):
+    if use_docker:
+        options = ""
+        if container_name is not None:
+            options += " --name {}".format(container_name)
+        if max_memory > 0:
+            options += " --memory {}m".format(max_memory)
+        return "sudo docker run --rm{} -v {}:/pdf -v /tmp:/tmp poppler pdftotext -f {} -bbox-layout '{}' '{}'".format(
+            options,
+            os.path.abspath(input_dir),
+            first_page,
+            os.path.join(pdf_folder, filename),
+            output_path
+        )
+    return "pdftotext -f {} -bbox-layout '{}' '{}'".format(
+        first_page,
+        os.path.join(pdf_folder, filename),
+        output_path
+    )
+
+
+def _start_pdftotext(
+    input_dir, pdf_folder, filename, output_path, use_docker, first_page, timeout=-1, max_memory=-1, **kwargs
+):
+    """ Start pdftotext within the per-document limits. With docker, the memory limit is set 
+        on the container and the container is stopped on timeout.
+
+    Returns:
+        tuple: (process, watchdog), the watchdog killing the process after `timeout` seconds
+    """
+    container_name = None
+    on_timeout = None
+    if use_docker and timeout > 0:
+        container_name = "pdftotext-{}-{}".format(os.getpid(), uuid.uuid4().hex[:8])
+        on_timeout = partial(
+            subprocess.call, 
+            "sudo docker kill {}".format(container_name), 
+            shell=True, 
+            stdout=subprocess.DEVNULL, 
+            stderr=subprocess.DEVNULL
+        )
+    command = _pdftotext_command(
+        input_dir, pdf_folder, filename, output_path, use_docker, first_page, 
+        container_name, max_memory if use_docker else -1
+    )
+    process = popen_limited(command, timeout, -1 if use_docker else max_memory, **kwargs)
+    return process, Watchdog(process, timeout, on_timeout)
+
+
+def get_pdf_path(input_dir, pdf_folder, filename, use_docker):
+    if use_docker:
+        return os.path.join(
+            os.path.join(input_dir, pdf_folder), filename
+        )
+    return os.path.join(pdf_folder, filename)
+
 
 def pdf2flowhtml(
     input_dir: Union[Path, str],
@@ -32,94 +143,172 @@ def pdf2flowhtml(
     use_docker: bool,
     first_page: int,
     max_pages: int,
-) -> str:
+    scanned_check_pages: int = 0,
+    pdf_catalog: Optional[str] = None,
+    timeout: float = -1,
+    max_memory: int = -1,
+) -> Tuple[str, Optional[str]]:
+    """ Convert a PDF to an HTML file with pdftotext
 
-    if use_docker:
-        filepath = os.path.join(
-            os.path.join(input_dir, pdf_folder), filename
-        )
-    else:
-        filepath = os.path.join(pdf_folder, filename)
-    if not _is_valid_pdf(filepath, max_pages=max_pages):
-        return False
+    Returns:
+        tuple: (status, reason), see `check_pdf`. The status is DONE if the PDF has been converted, 
+               and TIMEOUT or OOM if pdftotext has been killed after `timeout` seconds or has 
+               run out of `max_memory` MB.
+    """
+    filepath = get_pdf_path(input_dir, pdf_folder, filename, use_docker)
+    status, reason = check_pdf(filepath, max_pages, scanned_check_pages, first_page, pdf_catalog)
+    if status is not None:
+        return status, reason
 
-    if use_docker:
-        command = "sudo docker run --rm -v {}:/pdf -v /tmp:/tmp poppler pdftotext -f {} -bbox-layout '{}' '{}'".format(
-            os.path.abspath(input_dir),
-            first_page,
-            os.path.join(pdf_folder, filename),
-            os.path.join(output_folder, outputfile)
-        )
-    else:
-        command = "pdftotext -f {} -bbox-layout '{}' '{}'".format(
-            first_page,
-            os.path.join(pdf_folder, filename),
-            os.path.join(output_folder, outputfile)
-        )
-    
-    try: 
-        subprocess.check_output(command, shell=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        return False
+    output_path = os.path.join(output_folder, outputfile)
+    process, watchdog = _start_pdftotext(
+        input_dir, pdf_folder, filename, output_path, use_docker, first_page, timeout, max_memory, 
+        stdout=subprocess.DEVNULL
+    )
+    with watchdog, metrics.timer("pdftotext_seconds"):
+        process.wait()
+
+    if process.returncode != 0:
+        if os.path.isfile(output_path): # partial output
+            os.remove(output_path)
+        return failure_status(process.returncode, watchdog.fired, max_memory, "pdftotext")
+    return DONE, None
+
+
+def pdf2flowhtml_stream(
+    input_dir: Union[Path, str],
+    pdf_folder: Union[Path, str],
+    filename: Union[Path, str],
+    use_docker: bool,
+    first_page: int,
+    max_pages: int,
+    scanned_check_pages: int = 0,
+    pdf_catalog: Optional[str] = None,
+    timeout: float = -1,
+    max_memory: int = -1,
+) -> Tuple[Optional[subprocess.Popen], Optional[Watchdog], Optional[str], Optional[str]]:
+    """ Start pdftotext with the HTML written to its standard output, to be parsed 
+        while it is produced
+
+    Returns:
+        tuple: (process, watchdog, status, reason), process being the pdftotext process, whose 
+               stdout is the HTML stream, or None if the PDF did not pass `check_pdf`, and watchdog
+               the `Watchdog` enforcing `timeout`, to be cancelled once the process has exited
+    """
+    filepath = get_pdf_path(input_dir, pdf_folder, filename, use_docker)
+    status, reason = check_pdf(filepath, max_pages, scanned_check_pages, first_page, pdf_catalog)
+    if status is not None:
+        return None, None, status, reason
 
+    process, watchdog = _start_pdftotext(
+        input_dir, pdf_folder, filename, "-", use_docker, first_page, timeout, max_memory, 
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    return process, watchdog, None, None
+
+
+def add_scanned_check_args(parser):
+    parser.add_argument(
+        "--scanned_check_pages",
+        type=int,
+        default=SCANNED_CHECK_PAGES,
+        help="Record PDFs with no text in their first pages as scanned, without running "\
+            "pdftotext. 0 to disable the check."
+    )
+
+
+def convert_document(filename, args):
+    """ Convert a PDF of --pdf_folder to an HTML file of --output_folder
+
+    Returns:
+        tuple: (doc_id, status, reason)
+    """
+    status, reason = pdf2flowhtml(
+        args.input_dir, 
+        args.pdf_folder, 
+        filename, 
+        args.output_folder, 
+        filename[:-4] + ".html", 
+        args.use_docker,
+        args.first_page,
+        args.max_pages,
+        args.scanned_check_pages,
+        args.pdf_catalog,
+        args.timeout,
+        args.max_memory
+    )
+    return filename[:-4], status, reason
 
-def convert(args):
+
+def _link_html(output_dir, source_id, copy_id):
+    link_file(os.path.join(output_dir, source_id + ".html"), os.path.join(output_dir, copy_id + ".html"))
+
+
+def convert(args, state_store):
     if args.use_docker:
         pdf_path = os.path.join(args.input_dir, args.pdf_folder)
+        output_dir = os.path.join(args.input_dir, args.output_folder)
     else:
         pdf_path = args.pdf_folder
+        output_dir = args.output_folder
     fnames = sorted(os.listdir(pdf_path))
     fnames = fnames[:args.n_docs] if args.n_docs > 0 else fnames 
+    all_fnames = fnames
 
     if args.resume:
         ext = ".pdf"
         fnames = [fname[:-len(ext)] for fname in fnames]
         print("Resuming conversion...")
         fnames = remove_processed_from_id_list(
-            fnames, args.converted_output_log
+            fnames, state_store, statuses=[DONE, SCANNED, TIMEOUT, OOM]
         )
-        fnames = fnames[1:]
         if not fnames:
             print(f"All documents in {pdf_path} have already been converted to HTML")
             return
         fnames = [fname + ext for fname in fnames]
-        
-
-    if args.num_processors > 0:
-        processes = []
-        partitions = [fnames[i: i+args.num_processors] for i in range(0, len(fnames), args.num_processors)]
-
-        for part in partitions:
-            for filename in tqdm(part):
-                output_fname = filename[:-4] + ".html"
-                p = Process(
-                    target=pdf2flowhtml, 
-                    args=(args.input_dir, args.pdf_folder, filename, args.output_folder, output_fname, args.use_docker, args.first_page, args.max_pages)
-                )
-                p.start()
-                processes.append(p)
-            for p in processes:
-                p.join()
-                
-    else:
-        for filename in tqdm(fnames, desc=f"Processing PDFs in {pdf_path}"):
-            output_fname = filename[:-4] + ".html"
-            if pdf2flowhtml(
-                args.input_dir, 
-                args.pdf_folder, 
-                filename, 
-                args.output_folder, 
-                output_fname, 
-                args.use_docker,
-                args.first_page,
-                args.max_pages
+
+    copies = {}
+    link_html = partial(_link_html, output_dir)
+    if args.dedup:
+        # one conversion per unique PDF, the HTML is linked to the IDs of its copies
+        keys = content_keys_from_catalog(
+            {fname[:-4]: os.path.join(pdf_path, fname) for fname in all_fnames},
+            get_pdf_catalog(args.pdf_catalog),
+            num_workers=args.num_processors
+        )
+        processed_ids = state_store.get_ids(statuses=[DONE]) if args.resume else ()
+        doc_ids, copies = plan_dedup([fname[:-4] for fname in fnames], keys, processed_ids)
+        print(f"Converting {len(doc_ids)} unique PDFs out of {len(fnames)}")
+        for source_id in set(copies) - set(doc_ids): # converted by a previous run
+            record_copies(state_store, copies.pop(source_id), source_id, DONE, None, link_html)
+        fnames = [doc_id + ".pdf" for doc_id in doc_ids]
+
+    worker = partial(convert_document, args=args)
+    desc = f"Processing PDFs in {pdf_path}"
+    if args.num_processors > 1:
+        if args.pdf_catalog is not None:
+            # longest PDFs first (unknown ones before all), so that the last jobs are short ones
+            catalog = get_pdf_catalog(args.pdf_catalog)
+            num_pages = {}
+            for filename in fnames:
+                entry = catalog.get(os.path.join(pdf_path, filename))
+                num_pages[filename] = (entry.num_pages or 0) if entry is not None else float("inf")
+            fnames = sorted(fnames, key=lambda filename: -num_pages[filename])
+        # one PDF per task: each worker starts the next pdftotext as soon as its current one 
+        # returns, so a long document does not hold the others back
+        with Pool(args.num_processors) as pool:
+            for doc_id, status, reason in tqdm(
+                pool.imap_unordered(worker, fnames), total=len(fnames), desc=desc
             ):
-                with open(args.converted_output_log, "a") as f:
-                    f.write(filename[:-4] + "\n")
-            else:
-                with open(args.failed_output_log, "a") as f:
-                    f.write(filename[:-4] + "\n")
+                state_store.record(doc_id, status, reason=reason)
+                record_copies(state_store, copies.pop(doc_id, []), doc_id, status, reason, link_html)
+            pool.close()
+            pool.join()
+    else:
+        for doc_id, status, reason in tqdm(map(worker, fnames), total=len(fnames), desc=desc):
+            state_store.record(doc_id, status, reason=reason)
+            record_copies(state_store, copies.pop(doc_id, []), doc_id, status, reason, link_html)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -148,10 +337,15 @@ if __name__ == "__main__":
         type=int,
         default=1,
     )
+    add_scanned_check_args(parser)
+    add_catalog_args(parser)
+    add_limit_args(parser)
+    add_dedup_args(parser)
     parser.add_argument(
         "--num_processors", 
         type=int,
         default=-1,
+        help="Number of pdftotext jobs run in parallel."
     )
     parser.add_argument(
         "--n_docs", 
@@ -164,14 +358,10 @@ if __name__ == "__main__":
         default=-1,
     )
     parser.add_argument(
-        "--converted_output_log",
+        "--state_db",
         type=str,
-        default="./converted_to_html.log"
-    )
-    parser.add_argument(
-        "--failed_output_log",
-        type=str,
-        default="./failed_pdf_to_html.log"
+        default="./state.db",
+        help="SQLite database recording the status of each document."
     )
     parser.add_argument(
         "--resume", 
@@ -184,11 +374,20 @@ if __name__ == "__main__":
         help="Overwrite the output directory."
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
 
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
     if args.resume and args.overwrite_output_dir:
         raise ValueError(
-            f"Cannot use --resume and --overwrite_output_dir at the same time."
+            "Cannot use --resume and --overwrite_output_dir at the same time."
+        )
+
+    if args.dedup and args.pdf_catalog is None:
+        raise ValueError(
+            "--dedup needs --pdf_catalog to look up the content hash of each PDF."
         )
 
     if args.use_docker:
@@ -196,15 +395,15 @@ if __name__ == "__main__":
     else:
         output_dir = args.output_folder
 
+    state_store = StateStore(args.state_db, stage=STAGE)
+
     if os.listdir(output_dir) and not args.resume:
         if args.overwrite_output_dir:
             print(f"Overwriting {output_dir}")
             shutil.rmtree(output_dir)
             os.makedirs(output_dir)
 
-            if os.path.isfile(args.converted_output_log):
-                print(f"Overwriting {args.converted_output_log}")
-                os.remove(args.converted_output_log)
+            state_store.clear()
 
         else:
             raise ValueError(
@@ -212,4 +411,5 @@ if __name__ == "__main__":
             )
 
 
-    convert(args)
\ No newline at end of file
+    with state_store:
+        convert(args, state_store)
\ No newline at end of file
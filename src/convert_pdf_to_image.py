@@ -1,46 +1,141 @@
 import argparse 
 import os
 import shutil
+from functools import partial
 from tqdm import tqdm 
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from src.utils import remove_processed_from_id_list, compress_dir
+from src.state_store import StateStore, DONE, FAILED, TIMEOUT, OOM
+from src.pdf_catalog import get_pdf_catalog, add_catalog_args
+from src.limits import run_limited, add_limit_args
+from src.dedup import content_keys_from_catalog, plan_dedup, record_copies, copy_image_archive, add_dedup_args
+from src import metrics
 
-def convert(args):
+STAGE = "pdf_to_img"
+
+
+class IncompleteRenderingError(RuntimeError):
+    """ pdftoppm rendered fewer pages than the PDF has """
+
+
+def render_document(pdf_path, output_dir, doc_id, first_page, dpi, output_ext=".jpg", num_pages=None):
+    """ Render the pages of a PDF and compress them to `<output_dir>/<doc_id>.tar.gz`
+
+    pdf2image does not check the exit status of pdftoppm: a pdftoppm that crashed or was killed
+    (e.g. by the memory limit) only returns the pages rendered so far. The number of rendered
+    pages is checked against `num_pages` (read with pdfinfo if None), and IncompleteRenderingError
+    is raised if pages are missing.
+    """
+    if num_pages is None:
+        num_pages = pdfinfo_from_path(pdf_path)["Pages"]
+    pages = convert_from_path(pdf_path, dpi=dpi)
+    if len(pages) != num_pages:
+        raise IncompleteRenderingError(f"{pdf_path}: {len(pages)} pages rendered out of {num_pages}")
+    pages = pages[first_page-1:]
+
+    output_folder = os.path.join(output_dir, doc_id)
+    os.makedirs(output_folder)
+    for i, p in enumerate(pages):
+        p.save(os.path.join(output_folder, doc_id + "-" + str(i+1) + output_ext))
+
+    # compress output images
+    tar_path = os.path.join(output_dir, doc_id + ".tar.gz")
+    compress_dir(tar_path, output_folder)
+    shutil.rmtree(output_folder)
+
+
+def _render_limited(max_memory, *args):
+    """ `render_document` in a child process under `max_memory`: missing pages mean that
+        pdftoppm has been killed, almost always by the memory limit (see `failure_status`)
+    """
+    try:
+        render_document(*args)
+    except IncompleteRenderingError:
+        if max_memory > 0:
+            raise MemoryError
+        raise
+
+
+def _remove_partial_output(output_dir, doc_id):
+    output_folder = os.path.join(output_dir, doc_id)
+    if os.path.isdir(output_folder):
+        shutil.rmtree(output_folder)
+    tar_path = os.path.join(output_dir, doc_id + ".tar.gz")
+    if os.path.isfile(tar_path):
+        os.remove(tar_path)
+
+
+def _copy_archive(output_dir, source_id, copy_id):
+    copy_image_archive(
+        os.path.join(output_dir, source_id + ".tar.gz"), 
+        os.path.join(output_dir, copy_id + ".tar.gz"), 
+        source_id, 
+        copy_id
+    )
+
+
+def convert(args, state_store):
     fnames = sorted(os.listdir(args.input_dir))
     fnames = fnames[:args.n_docs] if args.n_docs > 0 else fnames 
+    all_fnames = fnames
 
     input_ext = ".pdf"
-    output_ext = ".jpg"
 
     if args.resume:
         fnames = [fname[:-len(input_ext)] for fname in fnames]
         print("Resuming conversion...")
-        fnames = remove_processed_from_id_list(fnames, args.converted_output_log)
+        fnames = remove_processed_from_id_list(fnames, state_store, statuses=[DONE, TIMEOUT, OOM])
         if not fnames:
             print(f"All documents in {args.input_dir} have already been converted to image")
             return
         fnames = [fname + input_ext for fname in fnames]
 
+    catalog = get_pdf_catalog(args.pdf_catalog) if args.pdf_catalog is not None else None
+    limited = args.timeout > 0 or args.max_memory > 0
+
+    copies = {}
+    copy_archive = partial(_copy_archive, args.output_dir)
+    if args.dedup:
+        # one rendering per unique PDF, the archive is copied (with renamed members) to its copies
+        keys = content_keys_from_catalog(
+            {fname[:-len(input_ext)]: os.path.join(args.input_dir, fname) for fname in all_fnames}, catalog
+        )
+        processed_ids = state_store.get_ids(statuses=[DONE]) if args.resume else ()
+        doc_ids, copies = plan_dedup([fname[:-len(input_ext)] for fname in fnames], keys, processed_ids)
+        print(f"Converting {len(doc_ids)} unique PDFs out of {len(fnames)}")
+        for source_id in set(copies) - set(doc_ids): # converted by a previous run
+            record_copies(state_store, copies.pop(source_id), source_id, DONE, None, copy_archive)
+        fnames = [doc_id + input_ext for doc_id in doc_ids]
+
     for fname in tqdm(fnames):
         doc_id = fname[:-len(input_ext)]
         pdf_path = os.path.join(args.input_dir, fname)
-        output_folder = os.path.join(args.output_dir, doc_id)
-
-        # convert
-        os.makedirs(output_folder)
-        pages = convert_from_path(pdf_path, dpi=args.dpi)
-        pages = pages[args.first_page-1:]
-        for i, p in enumerate(pages):
-            p.save(os.path.join(output_folder, doc_id + "-" + str(i+1) + output_ext))
-
-        # compress output images
-        tar_path = os.path.join(args.output_dir, doc_id + ".tar.gz")
-        compress_dir(tar_path, output_folder)
-        shutil.rmtree(output_folder)
 
-        with open(args.converted_output_log, "a") as f:
-            f.write(doc_id + "\n")
-       
+        entry = catalog.get(pdf_path) if catalog is not None else None
+        num_pages = entry.num_pages if entry is not None else None
+        if entry is not None and entry.broken:
+            status, reason = FAILED, "invalid_pdf"
+        elif not limited:
+            try:
+                render_document(
+                    pdf_path, args.output_dir, doc_id, args.first_page, args.dpi, num_pages=num_pages
+                )
+                status, reason = DONE, None
+            except IncompleteRenderingError:
+                status, reason = FAILED, "incomplete_rendering"
+        else:
+            # render in a child process, killed with pdftoppm when it exceeds the limits
+            status, reason = run_limited(
+                _render_limited, 
+                (args.max_memory, pdf_path, args.output_dir, doc_id, args.first_page, args.dpi, ".jpg", num_pages),
+                timeout=args.timeout,
+                max_memory=args.max_memory,
+                reason="pdf2image"
+            )
+        if status != DONE:
+            _remove_partial_output(args.output_dir, doc_id)
+        state_store.record(doc_id, status, reason=reason)
+        record_copies(state_store, copies.pop(doc_id, []), doc_id, status, reason, copy_archive)
 
 
 if __name__ == "__main__":
@@ -70,10 +165,14 @@ if __name__ == "__main__":
         type=int,
         default=100,
     )
+    add_catalog_args(parser)
+    add_limit_args(parser)
+    add_dedup_args(parser)
     parser.add_argument(
-        "--converted_output_log",
+        "--state_db",
         type=str,
-        default="./converted_to_img.log"
+        default="./state.db",
+        help="SQLite database recording the status of each document."
     )
     parser.add_argument(
         "--resume", 
@@ -86,25 +185,36 @@ if __name__ == "__main__":
         help="Overwrite the output directory."
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
 
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
     if args.resume and args.overwrite_output_dir:
         raise ValueError(
-            f"Cannot use --resume and --overwrite_output_dir at the same time."
+            "Cannot use --resume and --overwrite_output_dir at the same time."
         )
 
+    if args.dedup and args.pdf_catalog is None:
+        raise ValueError(
+            "--dedup needs --pdf_catalog to look up the content hash of each PDF."
+        )
+
+    state_store = StateStore(args.state_db, stage=STAGE)
+
     if os.listdir(args.output_dir) and not args.resume:
         if args.overwrite_output_dir:
             print(f"Overwriting {args.output_dir}")
             shutil.rmtree(args.output_dir)
             os.makedirs(args.output_dir)
 
-            print(f"Overwriting {args.converted_output_log}")
-            os.remove(args.converted_output_log)
+            state_store.clear()
         else:
             raise ValueError(
                 f"Output directory ({args.output_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
             )
 
 
-    convert(args)
\ No newline at end of file
+    with state_store:
+        convert(args, state_store)
\ No newline at end of file
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tarfile
+from src.state_store import DONE
+
+
+DUPLICATE = "duplicate" # reason of a document whose outputs are linked from a copy
+
+
+def content_keys_from_catalog(pdf_paths, catalog, num_workers=1):
+    """ Key each PDF by the SHA-256 of its content, reading only the PDFs that are
+        not (or no longer) in the catalog
+
+    Args:
+        pdf_paths (dict): Path to the PDF of each document ID
+        catalog (PdfCatalog): Catalog updated with the PDFs
+        num_workers (int): Number of processes reading PDFs in parallel
+
+    Returns:
+        dict: Content key of each document ID
+    """
+    catalog.update(list(pdf_paths.values()), num_workers=num_workers)
+    keys = {}
+    for doc_id, pdf_path in pdf_paths.items():
+        entry = catalog.get(pdf_path)
+        keys[doc_id] = entry.sha256 if entry is not None else pdf_path
+    return keys
+
+
+def content_keys_from_inodes(paths):
+    """ Key each file by its inode, so that files hardlinked by a previous stage share a key
+
+    Args:
+        paths (dict): Path to the file of each document ID
+
+    Returns:
+        dict: Content key of each document ID
+    """
+    keys = {}
+    for doc_id, path in paths.items():
+        stat = os.stat(path)
+        keys[doc_id] = (stat.st_dev, stat.st_ino)
+    return keys
+
+
+def plan_dedup(doc_ids, keys, processed_ids=()):
+    """ Pick one document to process per content key
+
+    Args:
+        doc_ids (list): IDs of the documents to process, in processing order
+        keys (dict): Content key of each document of `doc_ids` and `processed_ids`
+        processed_ids (iterable): IDs of documents processed by a previous run, whose
+                                  outputs can be linked to their copies
+
+    Returns:
+        tuple: (to_process, copies), to_process being the IDs to process and copies
+               mapping the ID of each source document (to process, or processed before)
+               to the IDs of its copies among `doc_ids`
+    """
+    sources = {}
+    for doc_id in processed_ids:
+        if doc_id in keys:
+            sources.setdefault(keys[doc_id], doc_id)
+
+    to_process = []
+    copies = {}
+    for doc_id in doc_ids:
+        source_id = sources.get(keys[doc_id])
+        if source_id is None:
+            sources[keys[doc_id]] = doc_id
+            to_process.append(doc_id)
+        else:
+            copies.setdefault(source_id, []).append(doc_id)
+    return to_process, copies
+
+
+def record_copies(state_store, copy_ids, source_id, status, reason, link_outputs):
+    """ Give the copies of a document its outcome: its outputs are linked to them if it has
+        been processed, and they are recorded with its status otherwise
+
+    Args:
+        state_store (StateStore): Store recording the status of each document
+        copy_ids (list): IDs of the copies
+        source_id (string): ID of the processed document
+        status (string): Status of the processed document
+        reason (string): Reason of the status
+        link_outputs (callable): Called with (source_id, copy_id) to give its outputs to a copy
+    """
+    for copy_id in copy_ids:
+        if status == DONE:
+            link_outputs(source_id, copy_id)
+            state_store.record(copy_id, DONE, reason=DUPLICATE)
+        else:
+            state_store.record(copy_id, status, reason=reason)
+
+
+def link_file(src_path, dst_path):
+    """ Hardlink a file, or copy it if it cannot be linked (e.g. on another file system) """
+    if os.path.lexists(dst_path):
+        os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+
+
+def copy_image_archive(src_path, dst_path, src_id, dst_id):
+    """ Copy an archive of page images (`<doc_id>/<doc_id>-<page_num>.jpg` members) to
+        another document ID, renaming its members without decoding the images
+    """
+    with tarfile.open(src_path, "r:gz") as tar_in, tarfile.open(dst_path, "w:gz") as tar_out:
+        for member in tar_in:
+            fileobj = tar_in.extractfile(member) if member.isfile() else None
+            dirname, basename = os.path.split(member.name)
+            if dirname == src_id:
+                dirname = dst_id
+            if basename == src_id:
+                basename = dst_id
+            elif basename.startswith(src_id + "-"):
+                basename = dst_id + basename[len(src_id):]
+            member.name = os.path.join(dirname, basename)
+            tar_out.addfile(member, fileobj)
+
+
+def add_dedup_args(parser):
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Process each unique input once (PDFs by the SHA-256 recorded in --pdf_catalog, which is "\
+            "updated first, HTML files by inode) and link its outputs to the IDs of its copies, recorded as done "\
+            "with the 'duplicate' reason."
+    )
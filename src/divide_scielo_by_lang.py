@@ -4,31 +4,32 @@ import os
 import argparse
 from tqdm import tqdm
 import shutil 
-import json
+from src.abstract_index import get_abstract_index
 
 def divide(args):
     num_es = 0
     num_pt = 0
-    num_lines = sum(1 for line in open(args.abstract_file,'r'))
-    with open(args.abstract_file, "r") as f:
-        for line in tqdm(f, total=num_lines):
-            item = json.loads(line)
-            if item["pdf_lang"] in ["es", "pt"] and not os.path.exists(os.path.join(args.input_folder, item["id"] + ".pdf")):
-                continue 
-            if item["pdf_lang"] == "es":
-                lang = "es"
-                num_es += 1
-            elif item["pdf_lang"] == "pt":
-                lang = "pt"
-                num_pt += 1
-            if item["pdf_lang"] in ["es", "pt"]:
-                shutil.move(
-                    os.path.join(args.input_folder, item["id"] + ".pdf"),
-                    os.path.join(
-                        os.path.join(args.input_folder, lang), 
-                        item["id"] + ".pdf"
-                    )
+    # only decode the records of PDFs that are in the input folder
+    pdf_ids = {
+        fname[:-len(".pdf")] for fname in os.listdir(args.input_folder) if fname.endswith(".pdf")
+    }
+    abstract_index = get_abstract_index(args.abstract_file)
+    num_items = sum(1 for doc_id in pdf_ids if doc_id in abstract_index)
+    for _, item in tqdm(abstract_index.items(pdf_ids), total=num_items):
+        if item["pdf_lang"] == "es":
+            lang = "es"
+            num_es += 1
+        elif item["pdf_lang"] == "pt":
+            lang = "pt"
+            num_pt += 1
+        if item["pdf_lang"] in ["es", "pt"]:
+            shutil.move(
+                os.path.join(args.input_folder, item["id"] + ".pdf"),
+                os.path.join(
+                    os.path.join(args.input_folder, lang), 
+                    item["id"] + ".pdf"
                 )
+            )
 
     print("Spanish: {}/{}".format(num_es, num_es + num_pt))
     print("Portuguese: {}/{}".format(num_pt, num_es + num_pt))
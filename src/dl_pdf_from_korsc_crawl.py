@@ -5,41 +5,42 @@ from tqdm import tqdm
 from src.utils import (
     del_file_if_exists,
     overwrite_dir_if_exists,
-    extract_pdf,
 )
-import time
-import random
+from src.downloader import Downloader
+from src import metrics
 
 def download_pdf_from_crawl(args):
     num_lines = sum(1 for line in open(args.input_file,'r'))
-    previously_downloaded_files = os.listdir(args.output_dir)
+    previously_downloaded_files = set(os.listdir(args.output_dir))
 
     if args.resume_download:
         print(f"Will skip {len(previously_downloaded_files)} documents")
 
-    with open(args.input_file, 'r') as f:
-        for line in tqdm(f, total=num_lines):
-            item = json.loads(line)
-            output_path = os.path.join(args.output_dir, item["id"] + ".pdf") 
+    with open(args.downloaded_log, "a") as downloaded_log, \
+            open(args.not_downloaded_log, "a") as not_downloaded_log:
 
-            if args.resume_download:
-                if item["id"] + ".pdf" in previously_downloaded_files:
-                    print(f"Skipping {item['id']}")
-                    continue 
+        def get_jobs():
+            with open(args.input_file, 'r') as f:
+                for line in f:
+                    item = json.loads(line)
+                    output_path = os.path.join(args.output_dir, item["id"] + ".pdf") 
 
-            if len(item["pdf_url"]) > 0 and 'abstract_ko' in item.keys():
-                if extract_pdf(item["pdf_url"], output_path):
-                    with open(args.downloaded_log, "a") as fw:
-                        fw.write(item["id"] + "\n")
+                    if args.resume_download:
+                        if item["id"] + ".pdf" in previously_downloaded_files:
+                            continue 
+
+                    if len(item["pdf_url"]) > 0 and 'abstract_ko' in item.keys():
+                        yield item["id"], item["pdf_url"], output_path
+                    else:
+                        not_downloaded_log.write(item["id"] + "\n")
+
+        # requests are spaced by `delay` seconds on average (randomized), across workers
+        with Downloader(num_workers=args.num_workers, delay=args.delay) as downloader:
+            for doc_id, downloaded in tqdm(downloader.download_many(get_jobs()), total=num_lines):
+                if downloaded:
+                    downloaded_log.write(doc_id + "\n")
                 else:
-                    with open(args.not_downloaded_log, "a") as fw:
-                        fw.write(item["id"] + "\n")
-                waiting_time = random.uniform(0.5, 1.5) * 5
-                print(f"Waiting {waiting_time} seconds")
-                time.sleep(waiting_time)
-            else:
-                with open(args.not_downloaded_log, "a") as fw:
-                    fw.write(item["id"] + "\n")
+                    not_downloaded_log.write(doc_id + "\n")
                 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -64,6 +65,18 @@ if __name__ == "__main__":
         type=str,
         required=True,
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="Number of concurrent downloads."
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=5.,
+        help="Average delay (in seconds) between two requests."
+    )
     parser.add_argument(
         "--overwrite_output_dir", 
         action="store_true", 
@@ -74,7 +87,11 @@ if __name__ == "__main__":
         action="store_true", 
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
+
+    metrics.enable(args.metrics_path, stage="dl_pdf", interval=args.metrics_interval)
    
     if os.listdir(args.output_dir) and not args.resume_download:
         if args.overwrite_output_dir:
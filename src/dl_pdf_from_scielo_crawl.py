@@ -5,39 +5,40 @@ from tqdm import tqdm
 from src.utils import (
     del_file_if_exists,
     overwrite_dir_if_exists,
-    extract_pdf,
 )
-import random 
-import time
+from src.downloader import Downloader
+from src import metrics
 
 def download_pdf_from_crawl(args):
-    if args.resume_download:
+    ids_downloaded = set()
+    if args.resume_download and os.path.isfile(args.downloaded_log):
         with open(args.downloaded_log) as f:   
-            ids_downloaded = f.readlines()
+            ids_downloaded = set(f.read().splitlines())
         
     num_lines = sum(1 for line in open(args.input_file,'r'))
-    with open(args.input_file, 'r') as f:
-        for line in tqdm(f, total=num_lines):
-            item = json.loads(line)
-            output_path = os.path.join(args.output_dir, item["id"] + ".pdf") 
-            if item["id"] in ids_downloaded:
-                print("Skipping publication ", item["id"])
-                continue 
-            if "pdf_url" in item and item["pdf_url"] is not None:
-                if extract_pdf(item["pdf_url"], output_path):
-                    with open(args.downloaded_log, "a") as fw:
-                        fw.write(item["id"] + "\n")
-                else:
-                    with open(args.not_downloaded_log, "a") as fw:
-                        fw.write(item["id"] + "\n")
-                waiting_time = random.uniform(0.5, 1.5) * 5
-                print(f"Waiting {waiting_time} seconds")
-                time.sleep(waiting_time)
 
-            else:
-                with open(args.not_downloaded_log, "a") as fw:
-                    fw.write(item["id"] + "\n")
-                
+    with open(args.downloaded_log, "a") as downloaded_log, \
+            open(args.not_downloaded_log, "a") as not_downloaded_log:
+
+        def get_jobs():
+            with open(args.input_file, 'r') as f:
+                for line in f:
+                    item = json.loads(line)
+                    output_path = os.path.join(args.output_dir, item["id"] + ".pdf") 
+                    if item["id"] in ids_downloaded:
+                        continue 
+                    if "pdf_url" in item and item["pdf_url"] is not None:
+                        yield item["id"], item["pdf_url"], output_path
+                    else:
+                        not_downloaded_log.write(item["id"] + "\n")
+
+        # requests are spaced by `delay` seconds on average (randomized), across workers
+        with Downloader(num_workers=args.num_workers, delay=args.delay) as downloader:
+            for doc_id, downloaded in tqdm(downloader.download_many(get_jobs()), total=num_lines):
+                if downloaded:
+                    downloaded_log.write(doc_id + "\n")
+                else:
+                    not_downloaded_log.write(doc_id + "\n")
             
 
 if __name__ == "__main__":
@@ -63,6 +64,18 @@ if __name__ == "__main__":
         type=str,
         required=True,
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="Number of concurrent downloads."
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=5.,
+        help="Average delay (in seconds) between two requests."
+    )
     parser.add_argument(
         "--overwrite_output_dir", 
         action="store_true", 
@@ -73,7 +86,11 @@ if __name__ == "__main__":
         action="store_true", 
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
+
+    metrics.enable(args.metrics_path, stage="dl_pdf", interval=args.metrics_interval)
    
     if os.listdir(args.output_dir) and not args.resume_download:
         if args.overwrite_output_dir:
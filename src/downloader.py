@@ -0,0 +1,182 @@
+import os
+import random
+import shutil
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src import metrics
+
+
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/61.0.3163.79 "
+    "Safari/537.36"
+)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 1 << 16
+
+
+class Downloader:
+    """ Pooled HTTP download engine
+
+    A single `requests.Session` keeps connections alive and reuses them across
+    downloads. Transient errors (connection errors, timeouts, 429 and 5xx responses)
+    are retried with exponential backoff. Files are streamed to a temporary file
+    that is atomically renamed once complete, so an interrupted download never
+    leaves a truncated PDF behind. FTP links, which requests does not handle, go
+    through urllib with the same retry policy.
+
+    Args:
+        num_workers (int): Maximum number of concurrent downloads in `download_many`
+        max_retries (int): Number of retries on transient errors
+        backoff_factor (float): Backoff between retries is backoff_factor * 2 ** (retry - 1) seconds
+        timeout (float): Connect and read timeout in seconds
+        delay (float): Average minimum interval between the start of two requests
+                       (randomized between 0.5 and 1.5 times), to stay polite with servers
+    """
+
+    def __init__(self, num_workers=4, max_retries=3, backoff_factor=1.0, timeout=60, delay=0.0):
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.delay = delay
+        self._next_request_time = 0.0
+        self._lock = threading.Lock()
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry, pool_connections=num_workers, pool_maxsize=num_workers
+        )
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _wait_turn(self):
+        if self.delay <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_request_time)
+            self._next_request_time = start + random.uniform(0.5, 1.5) * self.delay
+        time.sleep(start - now)
+
+    def get(self, url):
+        """ Fetch a (small) resource, e.g. an API response
+
+        Returns:
+            bytes: Content of the response
+
+        Raises:
+            requests.HTTPError: if the server still answers with an error after retries
+        """
+        self._wait_turn()
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        metrics.inc("bytes_downloaded_total", len(response.content))
+        return response.content
+
+    def _fetch_ftp(self, url, tmp_path):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    with open(tmp_path, "wb") as fw:
+                        shutil.copyfileobj(response, fw, CHUNK_SIZE)
+                return True
+            except OSError:
+                if attempt == self.max_retries:
+                    return False
+                time.sleep(self.backoff_factor * 2 ** attempt)
+
+    def _fetch_http(self, url, tmp_path):
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    return False
+                with open(tmp_path, "wb") as fw:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        fw.write(chunk)
+            return True
+        except (requests.RequestException, OSError):
+            return False
+
+    def download(self, url, output_path):
+        """ Download a file
+
+        Args:
+            url (string): link to the file
+            output_path (string): Path to the output file
+
+        Returns:
+            bool: True if the download was successful, False otherwise
+        """
+        tmp_path = output_path + ".part"
+        self._wait_turn()
+        with metrics.timer("download_seconds"):
+            if url.startswith("ftp://"):
+                success = self._fetch_ftp(url, tmp_path)
+            else:
+                success = self._fetch_http(url, tmp_path)
+
+        if success and os.path.getsize(tmp_path) > 0:
+            metrics.inc("bytes_downloaded_total", os.path.getsize(tmp_path))
+            os.replace(tmp_path, output_path)
+            return True
+        metrics.inc("downloads_failed_total")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    def download_many(self, jobs):
+        """ Download files concurrently, with at most `num_workers` downloads in flight
+
+        Args:
+            jobs (iterable): (key, url, output_path) tuples. Consumed lazily.
+
+        Yields:
+            tuple: (key, success) for each job, in completion order
+        """
+        jobs = iter(jobs)
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            in_flight = {}
+            while True:
+                for key, url, output_path in jobs:
+                    in_flight[executor.submit(self.download, url, output_path)] = key
+                    if len(in_flight) >= 2 * self.num_workers:
+                        break
+                if not in_flight:
+                    return
+                future = next(as_completed(in_flight))
+                yield in_flight.pop(future), future.result()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_default_downloader = None
+
+def get_downloader():
+    """ Process-wide downloader shared by `utils.extract_pdf` """
+    global _default_downloader
+    if _default_downloader is None:
+        _default_downloader = Downloader()
+    return _default_downloader
@@ -11,9 +11,12 @@ from pylatexenc.latex2text import LatexNodes2Text
 from src.utils import (
     del_file_if_exists,
     get_ids_from_arxiv_or_pubmed, 
-    remove_processed_from_id_list,
     overwrite_dir_if_exists
 )
+from src.state_store import StateStore, DONE, FAILED
+from src import metrics
+
+STAGE = "download_arxiv"
 
 
 def matches_first_id_scheme(id):
@@ -88,22 +91,24 @@ def extract_pdf(arxiv_id, pdf_output_path):
         return True 
     return False
 
-def extract(args):
-    id_list = get_ids_from_arxiv_or_pubmed(args.input_file, args.n_docs)
-
+def extract(args, state_store):
+    processed = set()
     if args.resume:
         print("Resuming extraction...")
-        id_list = remove_processed_from_id_list(
-            id_list, args.downloaded_output_log, failed_log=args.failed_output_log
-        )
+        processed = state_store.get_ids()
 
-        if not id_list:
-            print(f"All articles in {args.input_file} have already been extracted")
-            return 
+    # the IDs are looked up while scanning the metadata file, only the set of them is held
+    remaining_ids = {
+        arxiv_id for arxiv_id in get_ids_from_arxiv_or_pubmed(args.input_file, args.n_docs)
+        if arxiv_id not in processed
+    }
+    if not remaining_ids:
+        print(f"All articles in {args.input_file} have already been extracted")
+        return 
 
-    print(f"Extracting {len(id_list)} articles from arXiv, using IDs in {args.input_file}")
+    num_total = len(remaining_ids)
+    print(f"Extracting {num_total} articles from arXiv, using IDs in {args.input_file}")
 
-    remaining_ids = id_list.copy()
     num_fails = 0
 
     with open(args.metadata_file, "r") as f:
@@ -111,7 +116,7 @@ def extract(args):
             metadata = json.loads(line)
             arxiv_id = metadata["id"].replace("/", "")
             
-            if arxiv_id in id_list:
+            if arxiv_id in remaining_ids:
                 pdf_output_path = os.path.join(args.pdf_output_dir, arxiv_id + ".pdf")
                 pdf_extracted = extract_pdf(arxiv_id, pdf_output_path)
 
@@ -132,12 +137,11 @@ def extract(args):
                             outfile
                         )
                         outfile.write('\n')
-                    with open(args.downloaded_output_log, "a") as f:
-                        f.write(arxiv_id + "\n")
+                    state_store.record(arxiv_id, DONE)
                 else:
                     num_fails += 1
-                    with open(args.failed_output_log, "a") as f:
-                        f.write(arxiv_id + "\n")
+                    reason = "abstract" if pdf_extracted else "pdf"
+                    state_store.record(arxiv_id, FAILED, reason=reason)
                 
                 remaining_ids.remove(arxiv_id)
 
@@ -146,11 +150,10 @@ def extract(args):
 
     for arxiv_id in remaining_ids: # articles whose abstracts have not been found
         num_fails += 1
-        with open(args.failed_output_log, "a") as f:
-            f.write(arxiv_id + "\n")
+        state_store.record(arxiv_id, FAILED, reason="no_metadata")
 
 
-    print(f"Extracted abstract and PDF for {len(id_list) - num_fails}/{len(id_list)} articles.")
+    print(f"Extracted abstract and PDF for {num_total - num_fails}/{num_total} articles.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -178,14 +181,10 @@ if __name__ == "__main__":
         required=True,
     )
     parser.add_argument(
-        "--downloaded_output_log",
+        "--state_db",
         type=str,
-        default="./downloaded.log"
-    )
-    parser.add_argument(
-        "--failed_output_log",
-        type=str,
-        default="./failed_to_download.log"
+        default="./state.db",
+        help="SQLite database recording the status of each document."
     )
     parser.add_argument(
         "--n_docs",
@@ -203,19 +202,24 @@ if __name__ == "__main__":
         help="Overwrite the output directory."
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
 
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
     if args.resume and args.overwrite_output_dir:
         raise ValueError(
             f"Cannot use --resume and --overwrite_output_dir at the same time."
         )
 
+    state_store = StateStore(args.state_db, stage=STAGE)
+
     if (os.listdir(args.pdf_output_dir) or os.path.exists(args.abstract_output_path)) and not args.resume:
         if args.overwrite_output_dir: 
             overwrite_dir_if_exists(args.pdf_output_dir)
             del_file_if_exists(args.abstract_output_path)
-            del_file_if_exists(args.downloaded_output_log)
-            del_file_if_exists(args.failed_output_log)
+            state_store.clear()
         else:
             if os.listdir(args.pdf_output_dir):
                 raise ValueError(
@@ -226,4 +230,5 @@ if __name__ == "__main__":
                     f"Output file ({args.abstract_output_path}) already exists and is not empty. Use --overwrite_output_dir to overcome."
                 )
 
-    extract(args)
+    with state_store:
+        extract(args, state_store)
@@ -1,48 +1,30 @@
 import argparse 
 import os 
-import time 
 from tqdm import tqdm
-import subprocess
-import urllib.request
 import json
 from src.utils import (
     del_file_if_exists,
     overwrite_dir_if_exists,
-    extract_pdf
 )
+from src.downloader import Downloader
+from src.state_store import StateStore, DONE, FAILED
+from src import metrics
 import langdetect
 from langdetect import DetectorFactory
 
 DetectorFactory.seed = 0
 
+STAGE = "download_hal"
 
-def get_last_idx(downloaded_log, failed_log):
-    """ Get last index processed
 
-    Args:
-        downloaded_log (string): Path to log containing IDs of downloaded documents
-        failed_log (string): Path to log containing IDs of documents that could 
-                             not be downloaded
-
-    Returns:
-        int: Last index processed
-    """
-    with open(downloaded_log, "r") as f:
-        lines = f.read().splitlines()
-        last_downloaded_idx = lines[-1].split("\t")[0]
-
-    with open(failed_log, "r") as f:
-        lines = f.read().splitlines()
-        last_failed_idx = lines[-1].split("\t")[0]
-
-    return max(int(last_downloaded_idx), int(last_failed_idx))
-
-def extract(args):
+def extract(args, state_store, downloader):
+    processed = set()
     if args.resume:
         print("Resuming download...")
-        start_idx = get_last_idx(args.downloaded_output_log, args.failed_output_log) + 1
-    else:
-        start_idx = 0
+        # records are not a contiguous prefix of the API rows (selection failures are recorded
+        # before the downloads, which complete out of order): query every row again and skip
+        # the documents already processed
+        processed = state_store.get_ids()
 
     url = "https://api.archives-ouvertes.fr/search/" \
         "?q=*:*&" \
@@ -50,17 +32,20 @@ def extract(args):
         "indent=True&" \
         f"fl=docid,files_s,{args.lang}_abstract_s,docType_s&" \
         f"fq=language_s:{args.lang}+submitType_s:file+docType_s:(ART%20OR%20COMM)&" \
-        f"start={start_idx}&rows={args.n_docs - start_idx}"  
+        f"start=0&rows={args.n_docs}"  
     
     print(f"Extracting documents from url {url}")
 
-    response = urllib.request.urlopen(url).read().decode()
+    response = downloader.get(url).decode()
     data = json.loads(response)
-    start_idx = int(data["response"]["start"])
+    docs = [item for item in data["response"]["docs"] if str(item["docid"]) not in processed]
     num_fails = 0
 
-    for i, item in enumerate(tqdm(data["response"]["docs"])):
-        successful_extraction = False 
+    abstracts = {}
+    jobs = []
+    for item in tqdm(docs, desc="Selecting documents"):
+        abstract_text = None
+        failure_reason = "no_abstract_or_file"
         docid = str(item["docid"])
         if args.lang + "_abstract_s" in item and "files_s" in item:
             abstract_text = item[args.lang + "_abstract_s"][0].replace("\n", " ")  
@@ -70,34 +55,34 @@ def extract(args):
                     lang_abstract = langdetect.detect(abstract_text)
                     if lang_abstract != "fr":
                         abstract_text = None
+                        failure_reason = "abstract_lang"
                 except langdetect.lang_detect_exception.LangDetectException:
                     abstract_text = None 
+                    failure_reason = "abstract_lang"
 
-            if abstract_text is not None:    
-                pdf_output_path = os.path.join(args.pdf_output_dir, docid + ".pdf")        
-
-                pdf_url = item["files_s"][0]
-                pdf_extracted = extract_pdf(pdf_url, pdf_output_path)
-
-                if pdf_extracted:
-                    successful_extraction = True
-
-        if not successful_extraction:
-            num_fails += 1
-            with open(args.failed_output_log, "a") as f:
-                f.write(str(start_idx + i) + "\t" + docid + "\n")
+        if abstract_text is not None:    
+            pdf_output_path = os.path.join(args.pdf_output_dir, docid + ".pdf")        
+            abstracts[docid] = abstract_text
+            jobs.append((docid, item["files_s"][0], pdf_output_path))
         else:
-            with open(args.abstract_output_path, "a") as fw:
+            num_fails += 1
+            state_store.record(docid, FAILED, reason=failure_reason)
+
+    with state_store.open_output(args.abstract_output_path) as fw:
+        for docid, pdf_extracted in tqdm(
+            downloader.download_many(jobs), total=len(jobs), desc="Downloading PDFs"
+        ):
+            if pdf_extracted:
                 json.dump(
-                    {"id": docid, "abstract": abstract_text}, fw, ensure_ascii=False
+                    {"id": docid, "abstract": abstracts[docid]}, fw, ensure_ascii=False
                 )
                 fw.write('\n')
-            with open(args.downloaded_output_log, "a") as f:
-                f.write(str(start_idx + i) + "\t" + docid + "\n")
-        
-        # time.sleep(1)
+                state_store.record(docid, DONE)
+            else:
+                num_fails += 1
+                state_store.record(docid, FAILED, reason="pdf")
 
-    num_total = len(data["response"]["docs"])
+    num_total = len(docs)
     print(f"Extracted abstract and PDF for {num_total - num_fails}/{num_total} articles.")
 
 if __name__ == "__main__":
@@ -119,20 +104,22 @@ if __name__ == "__main__":
         required=True,
     )
     parser.add_argument(
-        "--downloaded_output_log",
+        "--state_db",
         type=str,
-        default="./downloaded.log"
-    )
-    parser.add_argument(
-        "--failed_output_log",
-        type=str,
-        default="./failed_to_download.log"
+        default="./state.db",
+        help="SQLite database recording the status of each document."
     )
     parser.add_argument(
         "--n_docs",
         type=int,
         default=30,
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=4,
+        help="Number of concurrent PDF downloads."
+    )
     parser.add_argument(
         "--resume",
         action="store_true", 
@@ -144,19 +131,24 @@ if __name__ == "__main__":
         help="Overwrite the output directory."
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
 
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
     if args.resume and args.overwrite_output_dir:
         raise ValueError(
             f"Cannot use --resume and --overwrite_output_dir at the same time."
         )
 
+    state_store = StateStore(args.state_db, stage=STAGE)
+
     if (os.listdir(args.pdf_output_dir) or os.path.exists(args.abstract_output_path)) and not args.resume:
         if args.overwrite_output_dir:
             overwrite_dir_if_exists(args.pdf_output_dir)
             del_file_if_exists(args.abstract_output_path)
-            del_file_if_exists(args.downloaded_output_log)
-            del_file_if_exists(args.failed_output_log)            
+            state_store.clear()
         else:
             if os.listdir(args.pdf_output_dir):
                 raise ValueError(
@@ -168,6 +160,7 @@ if __name__ == "__main__":
                 )
 
 
-    extract(args)
+    with state_store, Downloader(num_workers=args.num_workers) as downloader:
+        extract(args, state_store, downloader)
 
 
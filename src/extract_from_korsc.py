@@ -4,6 +4,8 @@ from scrapy.crawler import CrawlerProcess
 import argparse
 import os 
 from src.utils import del_file_if_exists
+from src.state_store import StateStore, DONE
+from src import metrics
 import json
 import random
 import langdetect
@@ -11,6 +13,8 @@ from langdetect import DetectorFactory
 
 DetectorFactory.seed = 0
 
+STAGE = "crawl_korsc"
+
 class KoreaScienceSpider(scrapy.Spider):
     name = "koreascience_spider"
     custom_settings = {
@@ -35,11 +39,12 @@ class KoreaScienceSpider(scrapy.Spider):
     def start_requests(self):
         ids_crawled = None 
         if self.resume_crawl:
-            ids_crawled = []
-            with open(self.output_file) as f:
-                for line in f:
-                    item = json.loads(line)
-                    ids_crawled.append(item["id"])
+            if self.state_store.count() == 0 and os.path.exists(self.output_file):
+                # crawl started before the state store existed
+                with open(self.output_file) as f:
+                    for line in f:
+                        self.state_store.record(json.loads(line)["id"], DONE)
+            ids_crawled = self.state_store.get_ids()
             print("Resuming crawl from {}... Skipping {} publications".format(
                 self.start_url,
                 len(ids_crawled),
@@ -155,10 +160,14 @@ class KoreaScienceSpider(scrapy.Spider):
         item["publication_date"] = publication_date
         item["doi"] = response.xpath(DOI_SELECTOR).extract_first()
 
+        self.state_store.record(item["id"], DONE)
         return item
 
+    def closed(self, reason):
+        self.state_store.flush()
+
 
-def crawl_koreascience(args):
+def crawl_koreascience(args, state_store):
     process = CrawlerProcess(settings={
         "FEEDS": {
             args.output_file: {"format": "jsonlines"}
@@ -170,7 +179,8 @@ def crawl_koreascience(args):
         start_url=args.start_url, 
         stop_page=args.stop_page,
         resume_crawl=args.resume_crawl,
-        output_file=args.output_file
+        output_file=args.output_file,
+        state_store=state_store,
     )
     process.start()
 
@@ -201,20 +211,34 @@ if __name__ == "__main__":
         "--resume_crawl", 
         action="store_true", 
     )
+    parser.add_argument(
+        "--state_db",
+        type=str,
+        default="./state.db",
+        help="SQLite database recording the crawled publications."
+    )
+
+    metrics.add_metrics_args(parser)
 
     args = parser.parse_args()
 
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
     if args.resume_crawl and args.overwrite_output:
         raise ValueError(
             f"Cannot use --resume and --overwrite_output at the same time."
         )
 
+    state_store = StateStore(args.state_db, stage=STAGE)
+
     if os.path.exists(args.output_file) and not args.resume_crawl:
         if args.overwrite_output:
             del_file_if_exists(args.output_file)
+            state_store.clear()
         else:
             raise ValueError(
                 f"Output file ({args.output_file}) already exists and is not empty. Use --overwrite_output to overcome."
             )
 
-    crawl_koreascience(args)
\ No newline at end of file
+    with state_store:
+        crawl_koreascience(args, state_store)
\ No newline at end of file
@@ -1,35 +1,39 @@
 import argparse 
 import os 
-import subprocess
 import tarfile 
 import json
 from tqdm import tqdm
 import xml.etree.ElementTree as ET
-import urllib.request
 import logging
 from pylatexenc.latex2text import LatexNodes2Text 
 from src.utils import (
     del_file_if_exists,
     get_ids_from_arxiv_or_pubmed, 
-    remove_processed_from_id_list,
-    del_file_if_exists,
     overwrite_dir_if_exists,
     extract_pdf
 )
+from src.state_store import StateStore, DONE, FAILED
+from src.downloader import Downloader
+from src import metrics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import zlib
 
 logging.disable(logging.CRITICAL)
 
-def extract_abstract(url):
+STAGE = "download_pubmed"
+
+def extract_abstract(url, downloader):
     """ Extract abstract using the BioC API
 
     Args:
         url (string): URL of article abstract in BioC XML format
+        downloader (Downloader): Download engine
 
     Returns:
         string: Abstract text 
     """
-    response = urllib.request.urlopen(url).read()
+    response = downloader.get(url)
     tree = ET.fromstring(response)
     abstract_nodes = tree.findall(".//passage[infon = 'ABSTRACT']/text")
     if not abstract_nodes:
@@ -38,19 +42,20 @@ def extract_abstract(url):
         abstract_text = " ".join(a.text for a in abstract_nodes)
         return abstract_text
 
-def extract_pdf_from_tar_url(url, output_path, tar_path):
+def extract_pdf_from_tar_url(url, output_path, tar_path, downloader):
     """ Extract PDF from tar archive 
 
     Args:
         url (string): FTP link to tar archive containing PDF
         output_path (string): Path to output PDF file
         tar_path (string): Path to tar archive
+        downloader (Downloader): Download engine
 
     Returns:
         bool: True if extraction was successful, False otherwise
     """
-    command = f"wget -q -O {tar_path} {url}"
-    subprocess.call(command, shell=True)
+    if not downloader.download(url, tar_path):
+        return False
 
     tar = tarfile.open(tar_path)
     try:
@@ -66,16 +71,17 @@ def extract_pdf_from_tar_url(url, output_path, tar_path):
         return True 
     return False 
 
-def find_ftp_url(oa_url):
+def find_ftp_url(oa_url, downloader):
     """ Extract FTP URL from PMC OA URL (https://www.ncbi.nlm.nih.gov/pmc/tools/ftp/)
 
     Args:
         oa_url (string): OA URL providing the article location on the FTP site 
+        downloader (Downloader): Download engine
 
     Returns:
         string: link to the article (PDF or tar) location on the FTP site
     """
-    response = urllib.request.urlopen(oa_url).read()
+    response = downloader.get(oa_url)
     tree = ET.fromstring(response)
 
     links = tree.findall(".//link")    
@@ -87,65 +93,101 @@ def find_ftp_url(oa_url):
         return None
 
 
-def extract(args):
-    id_list = get_ids_from_arxiv_or_pubmed(args.input_file, args.n_docs)
+def extract_document(pmcid, args, downloader):
+    """ Extract the PDF and abstract of an article
+
+    Args:
+        pmcid (string): PMC identifier
+        args (Namespace): Script arguments
+        downloader (Downloader): Download engine
+
+    Returns:
+        tuple: (abstract text, None) if extraction was successful, (None, failure reason) otherwise
+    """
+    oa_url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi?id={pmcid}"
+    ftp_url = find_ftp_url(oa_url, downloader)
+    output_path = os.path.join(args.pdf_output_dir, pmcid + ".pdf")
+
+    if not ftp_url:
+        pdf_extracted = False
+    elif ".pdf" in ftp_url:
+        pdf_extracted = extract_pdf(ftp_url, output_path, downloader=downloader) 
+    else:
+        tar_path = os.path.join(args.extract_output_dir, pmcid + ".tar.gz")
+
+        pdf_extracted = extract_pdf_from_tar_url(ftp_url, output_path, tar_path, downloader)
+
+    if not pdf_extracted:
+        return None, "pdf" if ftp_url else "no_oa_link"
+
+    abstract_text = extract_abstract(
+        f"https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_xml/{pmcid}/unicode",
+        downloader
+    )
+    if not abstract_text: 
+        os.remove(output_path) # pdf has been extracted, delete it
+        return None, "abstract"
+
+    return LatexNodes2Text().latex_to_text(abstract_text.replace("\n", " ")), None
+
+
+def extract_many(pmcids, args, downloader):
+    """ Extract documents concurrently, with at most 2 * num_workers documents in flight
+
+    Args:
+        pmcids (iterable): PMC identifiers. Consumed lazily.
+        args (Namespace): Script arguments
+        downloader (Downloader): Download engine
+
+    Yields:
+        tuple: (pmcid, (abstract text, failure reason)) for each document, in input order
+    """
+    with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+        in_flight = deque()
+        for pmcid in pmcids:
+            in_flight.append((pmcid, executor.submit(extract_document, pmcid, args, downloader)))
+            if len(in_flight) >= 2 * args.num_workers:
+                pmcid, future = in_flight.popleft()
+                yield pmcid, future.result()
+        while in_flight:
+            pmcid, future = in_flight.popleft()
+            yield pmcid, future.result()
 
+
+def extract(args, state_store, downloader):
+    processed = set()
     if args.resume:
         print("Resuming extraction...")
-        id_list = remove_processed_from_id_list(
-            id_list, args.downloaded_output_log, args.failed_output_log
-        )
-
-        if not id_list:
-            print(f"All articles in {args.input_file} have already been extracted")
-            return 
+        processed = state_store.get_ids()
 
-    print(f"Extracting {len(id_list)} articles from PubMed, using IDs in {args.input_file}")
+    print(f"Extracting articles from PubMed, using IDs in {args.input_file}")
+    pmcids = (
+        pmcid for pmcid in get_ids_from_arxiv_or_pubmed(args.input_file, args.n_docs) 
+        if pmcid not in processed
+    )
+    num_total = 0
     num_fails = 0
     
-    for pmcid in tqdm(id_list):
-        failed_extraction = False
-
-        oa_url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi?id={pmcid}"
-        ftp_url = find_ftp_url(oa_url)
-        output_path = os.path.join(args.pdf_output_dir, pmcid + ".pdf")
-
-        if not ftp_url:
-            pdf_extracted = False
-        elif ".pdf" in ftp_url:
-            pdf_extracted = extract_pdf(ftp_url, output_path) 
-        else:
-            tar_path = os.path.join(args.extract_output_dir, pmcid + ".tar.gz")
-
-            pdf_extracted = extract_pdf_from_tar_url(ftp_url, output_path, tar_path)
-
-        if pdf_extracted:
-            abstract_text = extract_abstract(
-                f"https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_xml/{pmcid}/unicode"
-            )
-            if abstract_text: 
-                abstract_text = LatexNodes2Text().latex_to_text(abstract_text.replace("\n", " "))
-                with open(args.abstract_output_path, "a") as outfile:
-                    json.dump(
-                        {"id": pmcid, "abstract": abstract_text}, 
-                        outfile
-                    )
-                    outfile.write('\n')
+    with state_store.open_output(args.abstract_output_path) as outfile:
+        for pmcid, (abstract_text, failure_reason) in tqdm(
+            extract_many(pmcids, args, downloader), total=args.n_docs if args.n_docs > 0 else None
+        ):
+            num_total += 1
+            if abstract_text is None:
+                num_fails += 1
+                state_store.record(pmcid, FAILED, reason=failure_reason)
             else:
-                failed_extraction = True 
-                os.remove(output_path) # pdf has been extracted, delete it
-        else:
-            failed_extraction = True
-
-        if failed_extraction:
-            num_fails += 1
-            with open(args.failed_output_log, "a") as f:
-                f.write(pmcid + "\n")
-        else:
-            with open(args.downloaded_output_log, "a") as f:
-                f.write(pmcid + "\n")
+                json.dump(
+                    {"id": pmcid, "abstract": abstract_text}, 
+                    outfile
+                )
+                outfile.write('\n')
+                state_store.record(pmcid, DONE)
         
-    print(f"Extracted abstract and PDF for {len(id_list) - num_fails}/{len(id_list)} articles.")
+    if num_total == 0:
+        print(f"All articles in {args.input_file} have already been extracted")
+        return
+    print(f"Extracted abstract and PDF for {num_total - num_fails}/{num_total} articles.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -172,20 +214,22 @@ if __name__ == "__main__":
         default="./tmp",
     )
     parser.add_argument(
-        "--downloaded_output_log",
+        "--state_db",
         type=str,
-        default="./downloaded.log"
-    )
-    parser.add_argument(
-        "--failed_output_log",
-        type=str,
-        default="./failed_to_download.log"
+        default="./state.db",
+        help="SQLite database recording the status of each document."
     )
     parser.add_argument(
         "--n_docs",
         type=int,
         default=5,
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=4,
+        help="Number of articles extracted concurrently."
+    )
     parser.add_argument(
         "--resume",
         action="store_true", 
@@ -197,13 +241,19 @@ if __name__ == "__main__":
         help="Overwrite the output directory."
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
 
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
     if args.resume and args.overwrite_output_dir:
         raise ValueError(
             f"Cannot use --resume and --overwrite_output_dir at the same time."
         )
 
+    state_store = StateStore(args.state_db, stage=STAGE)
+
     if (
         os.listdir(args.pdf_output_dir) or os.path.exists(args.abstract_output_path) or os.path.exists(args.extract_output_dir)
     ) and not args.resume:
@@ -211,8 +261,7 @@ if __name__ == "__main__":
             overwrite_dir_if_exists(args.pdf_output_dir)
             overwrite_dir_if_exists(args.extract_output_dir)
             del_file_if_exists(args.abstract_output_path)
-            del_file_if_exists(args.downloaded_output_log)
-            del_file_if_exists(args.failed_output_log)
+            state_store.clear()
         else:
             if os.listdir(args.pdf_output_dir):
                 raise ValueError(
@@ -227,4 +276,5 @@ if __name__ == "__main__":
                     f"Output directory ({args.extract_output_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
                 )
 
-    extract(args)
\ No newline at end of file
+    with state_store, Downloader(num_workers=args.num_workers) as downloader:
+        extract(args, state_store, downloader)
\ No newline at end of file
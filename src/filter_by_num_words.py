@@ -1,20 +1,19 @@
 import argparse 
 import os 
 from tqdm import tqdm
-import shutil
 from pathlib import Path
+from src.token_format import count_words, copy_doc
 
 def filter_out(args):
-    input_files = list(Path(args.input_dir).rglob("*.txt"))
+    input_files = list(Path(args.input_dir).rglob("*.txt")) + list(Path(args.input_dir).rglob("*.tok"))
 
     for input_path in tqdm(input_files):
         filename = os.path.basename(os.path.normpath(input_path))
         output_path = os.path.join(args.output_dir, filename)
-        with open(input_path, 'r') as input_file:
-            doc_length = sum(1 for line in input_file)
-            if doc_length >= args.lower_bound:
-                if args.upper_bound < 0 or doc_length <= args.upper_bound:
-                    shutil.copy(input_path, output_path)
+        doc_length = count_words(str(input_path))
+        if doc_length >= args.lower_bound:
+            if args.upper_bound < 0 or doc_length <= args.upper_bound:
+                copy_doc(str(input_path), output_path)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,10 @@
 from tqdm import tqdm 
-import json 
 import argparse
 import os
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
+from src.abstract_index import get_abstract_index
 
 def get_abs_length(
     abstract_file, 
@@ -12,21 +12,21 @@ def get_abs_length(
     input_folder=None, 
     file_extension=None,
 ):
+    abstract_index = get_abstract_index(abstract_file)
+    valid_ids = None
     if input_folder is not None and file_extension is not None:
         input_files = list(Path(input_folder).rglob(f"*.{file_extension}"))
-        valid_ids = [os.path.basename(os.path.normpath(fname))[:-(len(file_extension)+1)] for fname in input_files]
+        valid_ids = {os.path.basename(os.path.normpath(fname))[:-(len(file_extension)+1)] for fname in input_files}
 
     all_abs_length = []
     len_valid = 0
 
-    num_lines = sum(1 for line in open(abstract_file,'r'))
-    with open(abstract_file, 'r', encoding='utf-8') as f:
-        for line in tqdm(f, total=num_lines):
-            item = json.loads(line)
-            if input_folder is None or (item["id"] in valid_ids and abstract_key in item.keys()):
-                abstract_length = len(item[abstract_key].split())
-                all_abs_length.append(abstract_length)
-                len_valid += 1
+    num_items = len(abstract_index) if valid_ids is None else len(valid_ids)
+    for _, item in tqdm(abstract_index.items(valid_ids), total=num_items):
+        if input_folder is None or abstract_key in item.keys():
+            abstract_length = len(item[abstract_key].split())
+            all_abs_length.append(abstract_length)
+            len_valid += 1
 
     return all_abs_length
 
@@ -3,14 +3,22 @@ import argparse
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 import numpy as np
-import PyPDF2
 from PyPDF2 import PdfFileReader
 from pathlib import Path
+from src.token_format import count_pages
+from src.pdf_catalog import PdfReadError, get_pdf_catalog, add_catalog_args
 
-def count_num_pages_from_pdf(input_folder):
+def count_num_pages_from_pdf(input_folder, pdf_catalog=None, num_workers=1):
     # input_files = os.listdir(input_folder)
     input_files = list(Path(input_folder).rglob("*.pdf"))
 
+    if pdf_catalog is not None:
+        # only new and modified PDFs are read, the others are looked up
+        catalog = get_pdf_catalog(pdf_catalog)
+        catalog.update(input_files, num_workers=num_workers)
+        entries = [catalog.get(fpath) for fpath in input_files]
+        return [entry.num_pages for entry in entries if entry is not None and not entry.broken]
+
     all_num_pages = []
 
     for fpath in tqdm(input_files):
@@ -19,7 +27,7 @@ def count_num_pages_from_pdf(input_folder):
             with open(fpath, 'rb') as pdf_file:
                 pdf_reader = PdfFileReader(pdf_file, strict=False)
                 all_num_pages.append(pdf_reader.numPages)
-        except (PyPDF2.utils.PdfReadError, OSError, KeyError, ValueError, TypeError, AssertionError):
+        except (PdfReadError, OSError, KeyError, ValueError, TypeError, AssertionError):
             continue 
 
     return all_num_pages
@@ -31,17 +39,14 @@ def count_num_pages_from_txt(input_folder):
     all_num_pages = []
 
     for fpath in tqdm(input_files):
-        # with open(os.path.join(input_folder, fpath), "r") as f:
-        with open(fpath, 'r') as f:
-            lines = f.readlines()
-        last_page = int(lines[-1].split("\t")[-1])
-        all_num_pages.append(last_page)
+        # read from the page index if the file has one
+        all_num_pages.append(count_pages(str(fpath)))
 
     return all_num_pages
 
 def get_stats(args):
     if args.file_extension == "pdf":
-        all_num_pages = count_num_pages_from_pdf(args.input_folder)
+        all_num_pages = count_num_pages_from_pdf(args.input_folder, args.pdf_catalog, args.num_workers)
     elif args.file_extension == "txt":
         all_num_pages = count_num_pages_from_txt(args.input_folder)
     else:
@@ -81,6 +86,13 @@ if __name__ == "__main__":
         type=str,
         required=True,
     )
+    add_catalog_args(parser)
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="With --pdf_catalog, number of processes reading new PDFs in parallel."
+    )
     parser.add_argument(
         "--plot_hist", 
         action="store_true", 
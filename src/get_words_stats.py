@@ -4,18 +4,16 @@ from tqdm import tqdm
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
+from src.token_format import count_words
 
 def count_num_words(input_folder):
     # input_files = os.listdir(input_folder)
-    input_files = list(Path(input_folder).rglob("*.txt"))
+    input_files = list(Path(input_folder).rglob("*.txt")) + list(Path(input_folder).rglob("*.tok"))
 
     all_num_words = []
 
     for fpath in tqdm(input_files):
-        # with open(os.path.join(input_folder, fpath), "r") as f:
-        with open(fpath, 'r') as f:
-            lines = f.readlines()
-        all_num_words.append(len(lines))
+        all_num_words.append(count_words(str(fpath)))
 
     return all_num_words
 
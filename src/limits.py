@@ -0,0 +1,148 @@
+import os
+import resource
+import signal
+import subprocess
+import threading
+from functools import partial
+from multiprocessing import get_context
+from src.state_store import DONE, FAILED, TIMEOUT, OOM
+
+
+OOM_EXIT_CODE = 3 # exit code of a child process that raised MemoryError
+DOCKER_OOM_EXIT_CODE = 137 # container killed by the OOM killer
+
+
+def _set_memory_limit(max_memory):
+    max_bytes = max_memory * 2 ** 20
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def popen_limited(command, timeout=-1, max_memory=-1, **kwargs):
+    """ Start a shell command whose address space is limited to `max_memory` MB (-1 for no limit)
+
+    With a timeout, the command is started in its own process group, so that `Watchdog`
+    kills it with all its children. The shell is replaced by the command (`exec`), so that
+    a command killed by a signal has a negative return code.
+    """
+    preexec_fn = partial(_set_memory_limit, max_memory) if max_memory > 0 else None
+    return subprocess.Popen(
+        "exec " + command, shell=True, start_new_session=timeout > 0, preexec_fn=preexec_fn, **kwargs
+    )
+
+
+def kill_group(process):
+    """ Kill a process started in its own process group, and its children """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError: # not a group leader (yet), or already gone
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+
+class Watchdog:
+    """ Kill a process (and its process group) once it has run for `timeout` seconds
+
+    Used as a context manager around the wait for the process. `fired` tells whether
+    the process has been killed.
+
+    Args:
+        process (Popen): Process started by `popen_limited` with the same timeout
+        timeout (float): Wall-clock limit in seconds, no limit if <= 0
+        on_timeout (callable): Called after killing the process (e.g. to stop a container)
+    """
+
+    def __init__(self, process, timeout, on_timeout=None):
+        self.process = process
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.fired = False
+        self._timer = None
+        if timeout > 0:
+            self._timer = threading.Timer(timeout, self._kill)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _kill(self):
+        if self.process.poll() is not None:
+            return
+        self.fired = True
+        kill_group(self.process)
+        if self.on_timeout is not None:
+            self.on_timeout()
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cancel()
+
+
+def failure_status(returncode, timed_out, max_memory, reason):
+    """ Status of a process that did not exit with 0
+
+    A process killed by a signal other than the watchdog's under a memory limit has
+    almost always failed to allocate (pdftotext and pdftoppm abort on allocation failures).
+
+    Returns:
+        tuple: (status, reason), status being TIMEOUT, OOM or FAILED
+    """
+    if timed_out:
+        return TIMEOUT, reason
+    if max_memory > 0 and (returncode < 0 or returncode in (OOM_EXIT_CODE, DOCKER_OOM_EXIT_CODE)):
+        return OOM, reason
+    return FAILED, reason
+
+
+def _run_child(target, args, max_memory):
+    os.setsid() # own process group, killed with the subprocesses it starts
+    if max_memory > 0:
+        _set_memory_limit(max_memory)
+    try:
+        target(*args)
+    except MemoryError:
+        os._exit(OOM_EXIT_CODE)
+
+
+def run_limited(target, args=(), timeout=-1, max_memory=-1, reason=None):
+    """ Run `target(*args)` in a forked process with a wall-clock and a memory limit
+
+    The limits also apply to the subprocesses it starts (the memory limit is inherited
+    and the whole process group is killed on timeout).
+
+    Returns:
+        tuple: (status, reason), status being DONE if `target` returned, and TIMEOUT, OOM
+               or FAILED (if it raised an exception) otherwise
+    """
+    process = get_context("fork").Process(target=_run_child, args=(target, args, max_memory))
+    process.start()
+    process.join(timeout if timeout > 0 else None)
+    if process.is_alive():
+        kill_group(process)
+        process.join()
+        return TIMEOUT, reason
+    if process.exitcode == 0:
+        return DONE, None
+    return failure_status(process.exitcode, False, max_memory, reason)
+
+
+def add_limit_args(parser):
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=-1,
+        help="Wall-clock limit in seconds per document. Documents taking longer are killed "\
+            "and recorded with the 'timeout' status. -1 for no limit."
+    )
+    parser.add_argument(
+        "--max_memory",
+        type=int,
+        default=-1,
+        help="Memory limit in MB per document. Documents exceeding it are recorded with the "\
+            "'oom' status. -1 for no limit."
+    )
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+
+MATCHER_VERSION = 1 # bump when a change of the matcher invalidates cached results
+MAX_ENTRIES = 1000000
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class MatchCache:
+    """ Persistent cache of abstract matching results backed by SQLite
+
+    Entries are keyed by a hash of the (normalized) page text, a hash of the
+    (normalized) abstract and the matcher parameters, and hold the word indices
+    of the match, or a confirmed miss. Reruns with other settings only compute
+    the (page, abstract, parameters) triples they have not seen. Once the cache
+    holds more than `max_entries` entries, the least recently used ones are evicted.
+    Like the state store, writes are buffered and each process opens its own
+    connection, so workers can share the cache.
+
+    Args:
+        db_path (string): Path to the SQLite database
+        max_entries (int): Maximum number of entries kept
+        batch_size (int): Number of buffered writes committed at once
+    """
+
+    def __init__(self, db_path, max_entries=MAX_ENTRIES, batch_size=500):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self._puts = []
+        self._touches = []
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            if self._pid is not None and self._pid != os.getpid():
+                # forked: the connection and pending writes belong to the parent
+                self._puts = []
+                self._touches = []
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS abstract_match ("
+                "page_hash BLOB NOT NULL, "
+                "abstract_hash BLOB NOT NULL, "
+                "params TEXT NOT NULL, "
+                "start_idx INTEGER, "
+                "stop_idx INTEGER, "
+                "last_used REAL NOT NULL, "
+                "PRIMARY KEY (page_hash, abstract_hash, params))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS abstract_match_last_used ON abstract_match (last_used)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def params(max_l_dist):
+        return f"v{MATCHER_VERSION}:max_l_dist={max_l_dist}"
+
+    def get(self, page_hash, abstract_hash, params):
+        """ Look up a match
+
+        Returns:
+            tuple: (found, indices), found being False if the entry is not cached, and
+                   indices the (start, stop) word indices, or None for a cached miss
+        """
+        row = self.conn.execute(
+            "SELECT start_idx, stop_idx FROM abstract_match "
+            "WHERE page_hash = ? AND abstract_hash = ? AND params = ?",
+            (page_hash, abstract_hash, params),
+        ).fetchone()
+        if row is None:
+            return False, None
+        self._touches.append((time.time(), page_hash, abstract_hash, params))
+        self._maybe_flush()
+        return True, (row if row[0] is not None else None)
+
+    def put(self, page_hash, abstract_hash, params, indices):
+        """ Buffer the result of a search, `indices` being None for a miss """
+        start_idx, stop_idx = indices if indices is not None else (None, None)
+        self._puts.append((page_hash, abstract_hash, params, start_idx, stop_idx, time.time()))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._puts) + len(self._touches) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._puts and not self._touches:
+            return
+        conn = self.conn
+        conn.executemany(
+            "INSERT OR REPLACE INTO abstract_match "
+            "(page_hash, abstract_hash, params, start_idx, stop_idx, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            self._puts,
+        )
+        conn.executemany(
+            "UPDATE abstract_match SET last_used = ? "
+            "WHERE page_hash = ? AND abstract_hash = ? AND params = ?",
+            self._touches,
+        )
+        if self._puts:
+            self._evict(conn)
+        conn.commit()
+        self._puts = []
+        self._touches = []
+
+    def _evict(self, conn):
+        num_entries = conn.execute("SELECT COUNT(*) FROM abstract_match").fetchone()[0]
+        if num_entries > self.max_entries:
+            conn.execute(
+                "DELETE FROM abstract_match WHERE rowid IN ("
+                "SELECT rowid FROM abstract_match ORDER BY last_used LIMIT ?)",
+                (num_entries - self.max_entries,),
+            )
+
+    def __len__(self):
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM abstract_match").fetchone()[0]
+
+    def close(self):
+        if self._pid is None or self._pid == os.getpid():
+            self.flush()
+            if self._conn is not None:
+                self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # connections are reopened in worker processes
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        state["_puts"] = []
+        state["_touches"] = []
+        return state
+
+
+_open_caches = {}
+
+def get_match_cache(db_path, max_entries=MAX_ENTRIES):
+    """ Get the cache stored at `db_path`, opened once per process """
+    cache = _open_caches.get(db_path)
+    if cache is None:
+        cache = MatchCache(db_path, max_entries=max_entries)
+        _open_caches[db_path] = cache
+    return cache
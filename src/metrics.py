@@ -0,0 +1,212 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from multiprocessing.util import Finalize
+
+
+PREFIX = "loralay_"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, float("inf"))
+
+_registry = None
+_null_timer = nullcontext()
+
+
+def _escape_label_value(value):
+    """ Escape a label value for the Prometheus text format (backslash, double quote and newline) """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    """ Counters and latency histograms of a process, dumped periodically to a file
+
+    The output format depends on the extension of the file: Prometheus textfile
+    format for `.prom`, JSON otherwise. Files are replaced atomically, so they can
+    be scraped at any time. Worker processes forked from the process that enabled
+    the metrics get their own registry, dumped to `<path stem>.<pid><ext>`.
+
+    Args:
+        path (string): Output file
+        stage (string): Stage name, added as a label to every metric
+        interval (float): Minimum number of seconds between two dumps
+    """
+
+    def __init__(self, path, stage=None, interval=30.0):
+        self.path = path
+        self.stage = stage
+        self.interval = interval
+        self.pid = os.getpid()
+        self.start_time = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._next_dump = time.monotonic() + interval
+
+    def for_child(self):
+        stem, ext = os.path.splitext(self.path)
+        registry = Registry(f"{stem}.{os.getpid()}{ext}", self.stage, self.interval)
+        # pool workers do not run atexit handlers, but they run multiprocessing finalizers
+        Finalize(registry, registry.dump, exitpriority=10)
+        return registry
+
+    def _key(self, name, labels):
+        if self.stage is not None:
+            labels = dict(labels, stage=self.stage)
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value, labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._maybe_dump()
+
+    def observe(self, name, value, labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {"count": 0, "sum": 0.0, "buckets": [0] * len(DEFAULT_BUCKETS)}
+            hist["count"] += 1
+            hist["sum"] += value
+            hist["buckets"][bisect_left(DEFAULT_BUCKETS, value)] += 1
+        self._maybe_dump()
+
+    def _maybe_dump(self):
+        if time.monotonic() >= self._next_dump:
+            self.dump()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "stage": self.stage,
+                "pid": self.pid,
+                "start_time": self.start_time,
+                "updated_at": time.time(),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": hist["count"],
+                        "sum": hist["sum"],
+                        "buckets": dict(zip(map(str, DEFAULT_BUCKETS), hist["buckets"])),
+                    }
+                    for (name, labels), hist in sorted(self.histograms.items())
+                ],
+            }
+
+    def to_prometheus(self):
+        def fmt_labels(labels):
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in labels.items()) + "}"
+
+        metrics = self.to_dict()
+        lines = []
+        for name in sorted({counter["name"] for counter in metrics["counters"]}):
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for counter in metrics["counters"]:
+                if counter["name"] == name:
+                    lines.append(f"{PREFIX}{name}{fmt_labels(counter['labels'])} {counter['value']}")
+        for name in sorted({hist["name"] for hist in metrics["histograms"]}):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for hist in metrics["histograms"]:
+                if hist["name"] != name:
+                    continue
+                cumulative = 0
+                for le, count in zip(DEFAULT_BUCKETS, hist["buckets"].values()):
+                    cumulative += count
+                    le = "+Inf" if le == float("inf") else str(le)
+                    lines.append(f"{PREFIX}{name}_bucket{fmt_labels(dict(hist['labels'], le=le))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{fmt_labels(hist['labels'])} {hist['sum']}")
+                lines.append(f"{PREFIX}{name}_count{fmt_labels(hist['labels'])} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        self._next_dump = time.monotonic() + self.interval
+        if self.path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=1)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+
+def enable(path, stage=None, interval=30.0):
+    """ Start collecting metrics in this process (and its forked workers). Does nothing if
+        `path` is None, in which case every hook below returns immediately.
+    """
+    global _registry
+    if path is None:
+        return
+    _registry = Registry(path, stage=stage, interval=interval)
+    atexit.register(_registry.dump)
+
+
+def _current():
+    global _registry
+    if _registry.pid != os.getpid():
+        _registry = _registry.for_child()
+    return _registry
+
+
+def inc(name, value=1, **labels):
+    """ Increment a counter """
+    if _registry is None:
+        return
+    _current().inc(name, value, labels)
+
+
+def observe(name, value, **labels):
+    """ Record a value (usually a duration in seconds) in a histogram """
+    if _registry is None:
+        return
+    _current().observe(name, value, labels)
+
+
+class _Timer:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def timer(name, **labels):
+    """ Context manager recording its wall time in a histogram """
+    if _registry is None:
+        return _null_timer
+    return _Timer(name, labels)
+
+
+def enabled():
+    return _registry is not None
+
+
+def add_metrics_args(parser):
+    parser.add_argument(
+        "--metrics_path",
+        type=str,
+        default=None,
+        help="Periodically dump counters and latency histograms to this file "\
+            "(Prometheus textfile format if it ends with .prom, JSON otherwise)."
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        type=float,
+        default=30.0,
+        help="Seconds between two metrics dumps."
+    )
@@ -1,31 +1,71 @@
 import os
+import sys
 import shutil
 import argparse
 from tqdm import tqdm
-from lxml.etree import iterparse
+from lxml.etree import iterparse, XMLSyntaxError
 import re
+import numpy as np
 import logging
+import time
+from contextlib import nullcontext
+from functools import partial
+from multiprocessing import Pool
 from src.utils import remove_processed_from_id_list, compress_dir
+from src.state_store import StateStore, DONE, FAILED
+from src.token_format import TokenDoc, TxtWriter, TOK_EXT, PAGE_INDEX_EXT
+from src.convert_pdf_to_html import pdf2flowhtml_stream, add_scanned_check_args, check_pdf, get_pdf_path
+from src.pdf_catalog import get_pdf_catalog, add_catalog_args
+from src.limits import failure_status, add_limit_args
+from src.dedup import (
+    content_keys_from_catalog, content_keys_from_inodes, plan_dedup, record_copies, link_file, add_dedup_args
+)
+from src import metrics
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LAParams, LTChar, LTContainer, LTTextLine
+from pdfminer.psparser import PSException
 
 logger = logging.getLogger(__name__)
 
+STAGE = "parse"
+
 REF_MAPPING = {
-    "de": ["bibliografie","literatur", "referenzen"],
-    "es": ["referencias", "bibliografía"],
-    "fr": ["bibliographie", "références"],
-    "it": ["bibliografia"],
-    "pt": ["referências", "bibliografia"],
-    "ru": ["литература"],
+    "de": ["bibliografie","literatur", "referenzen", "literaturverzeichnis"],
+    "en": ["references", "bibliography", "reference list", "literature cited"],
+    "es": ["referencias", "bibliografía", "referencias bibliográficas"],
+    "fr": ["bibliographie", "références", "références bibliographiques"],
+    "it": ["bibliografia", "riferimenti bibliografici"],
+    "ko": ["참고문헌", "참고 문헌", "인용문헌"],
+    "pt": ["referências", "bibliografia", "referências bibliográficas"],
+    "ru": ["литература", "список литературы"],
+}
+# headings are compared without spaces, so that letter-spaced headings ("R E F E R E N C E S") match
+REF_HEADINGS = {
+    heading.replace(" ", "") for headings in REF_MAPPING.values() for heading in headings
 }
+SECTION_NUMBER = re.compile(r"^(\d+(\.\d+)*|[ivxlc]+|[a-z])[.):]?$", re.IGNORECASE)
 
 def remove_special_chars(text):
     return re.sub('[^a-zA-Z0-9*\s]', '', text)
 
 def clean_text(text):
-    text = re.sub(r"\s+", "", text)
-    text = re.sub(r"’", "'", text)
+    text = "".join(text.split()) # same whitespace characters as \s
+    text = text.replace("’", "'")
     return text
 
+def is_ref_heading(words):
+    """ Whether the words of a line form a reference section heading 
+        (e.g. "7. References", "REFERÊNCIAS", "참 고 문 헌")
+    """
+    if not words:
+        return False
+    if len(words) > 1 and SECTION_NUMBER.match(words[0]):
+        words = words[1:]
+    heading = "".join(words)
+    if len(heading) > 40:
+        return False
+    return heading.lower().rstrip(".:") in REF_HEADINGS
+
 def normalize_bbox(bbox, size):
     return (
         int(1000 * bbox[0] / size[0]),
@@ -43,17 +83,29 @@ def skip_first_page(page):
 
     return False
 
-def extract_text_from_tree(file_path, do_normalize_bbox=False, remove_ref=False):
+def _open_source(source):
+    """ Open a path, or use an already open binary stream (e.g. the output of pdftotext) as is """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        return open(source, 'rb')
+    return nullcontext(source)
+
+
+def _read_pages_legacy(source, do_normalize_bbox=False, remove_ref=False):
+    """ Original reader: visits every element twice (start and end events).
+        Words whose text is not parsed yet when their start event is handled are lost.
+    """
     doc = []
+    page_positions = []
 
     cur_page = []
+    cur_page_pos = 0
+    num_pages_read = 0
     page_width = None
     page_height = None
-    ref_page_idx = None
-    ref_start_idx_in_page = None
+    line_start = 0
 
-    with open(file_path, 'rb') as f:
-        for _, element in iterparse(f, events=("start", "end"), recover=True):
+    with _open_source(source) as f:
+        for event, element in iterparse(f, events=("start", "end"), recover=True):
             if "word" in element.tag and element.text:
                 word = clean_text(element.text) if element.text else None
                 if word:
@@ -87,90 +139,501 @@ def extract_text_from_tree(file_path, do_normalize_bbox=False, remove_ref=False)
             elif "page" in element.tag and element.attrib:
                 if len(cur_page) > 0:
                     doc.append(cur_page)
+                    page_positions.append(cur_page_pos)
                     cur_page = []
+                if event == "start":
+                    cur_page_pos = num_pages_read
+                    num_pages_read += 1
                 page_width = round(float(element.attrib["width"]))
                 page_height = round(float(element.attrib["height"]))
 
+            elif remove_ref and "line" in element.tag:
+                if event == "start":
+                    line_start = len(cur_page)
+                elif doc and is_ref_heading([elem[0] for elem in cur_page[line_start:]]):
+                    # references start here (headings on the first page are ignored)
+                    cur_page = cur_page[:line_start]
+                    break
+
             element.clear()
 
     if len(cur_page) > 0:
         doc.append(cur_page)
- 
+        page_positions.append(cur_page_pos)
+
+    return doc, page_positions
+
+
+def _make_page(words, coords, page_width, page_height, do_normalize_bbox=False):
+    """ Round, clip and order the coordinates of the words of a page at once """
+    if page_width == 0 or page_height == 0:
+        return []
+
+    bboxes = np.rint(np.array(coords, dtype=np.float64)).astype(np.int64)
+    xs = np.clip(bboxes[:, [0, 2]], 0, page_width) # set to 0 if < 0, to max if > max
+    ys = np.clip(bboxes[:, [1, 3]], 0, page_height)
+    xs.sort(axis=1) # swap if xmin > xmax
+    ys.sort(axis=1)
+    bboxes = np.stack([xs[:, 0], ys[:, 0], xs[:, 1], ys[:, 1]], axis=1)
+    if do_normalize_bbox:
+        bboxes = (1000 * bboxes / [page_width, page_height, page_width, page_height]).astype(np.int64)
+
+    return [
+        (word,) + tuple(bbox) + (page_width, page_height)
+        for word, bbox in zip(words, bboxes.tolist())
+    ]
+
+
+def _read_pages(source, do_normalize_bbox=False, remove_ref=False):
+    """ Only handles the end events of <word> and <page> elements (and <line> elements
+        with `remove_ref`). Words are collected with their raw coordinates and converted 
+        page by page. Each page is cleared once read and previous pages are dropped, so 
+        memory does not grow with the document. With `remove_ref`, reading stops at the
+        reference section heading.
+
+    Returns:
+        tuple: (doc, page_positions), page_positions being the 0-based position of each page 
+               of doc among the <page> elements (pages without words are dropped)
+    """
+    doc = []
+    page_positions = []
+    num_pages_read = 0
+
+    words = []
+    coords = []
+    line_start = 0
+
+    def add_page(page_attrib):
+        if words:
+            page = _make_page(
+                words,
+                coords,
+                round(float(page_attrib["width"])),
+                round(float(page_attrib["height"])),
+                do_normalize_bbox
+            )
+            if page:
+                doc.append(page)
+                page_positions.append(num_pages_read)
+
+    tags = ("{*}word", "{*}page", "{*}line") if remove_ref else ("{*}word", "{*}page")
+    with _open_source(source) as f:
+        for _, element in iterparse(f, events=("end",), tag=tags, recover=True):
+            attrib = element.attrib
+            tag = element.tag
+            if tag.endswith("word"):
+                text = element.text
+                if text and attrib:
+                    word = clean_text(text)
+                    if word:
+                        words.append(word)
+                        coords.append((attrib["xMin"], attrib["yMin"], attrib["xMax"], attrib["yMax"]))
+            elif tag.endswith("line"):
+                if doc and is_ref_heading(words[line_start:]):
+                    # references start here (headings on the first page are ignored)
+                    del words[line_start:]
+                    del coords[line_start:]
+                    page = next(element.iterancestors("{*}page"), None)
+                    if page is not None and page.attrib:
+                        add_page(page.attrib)
+                    return doc, page_positions
+                line_start = len(words)
+            elif attrib:
+                add_page(attrib)
+                num_pages_read += 1
+                words = []
+                coords = []
+                line_start = 0
+
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+    return doc, page_positions
+
+
+PARSERS = {
+    "fast": _read_pages,
+    "legacy": _read_pages_legacy,
+}
+
+
+def extract_text_from_tree(file_path, do_normalize_bbox=False, remove_ref=False, parser="fast", first_page=1):
+    """ Extract the words of a pdftotext -bbox-layout output
+
+    Args:
+        file_path (string or file object): Path to the HTML file, or binary stream to read it from
+        do_normalize_bbox (bool): Normalize coordinates between 0 and 1000
+        remove_ref (bool): Stop reading at the reference section heading (see REF_MAPPING)
+        parser (string): Parsing backend, key of PARSERS
+        first_page (int): PDF page number of the first page of the output (pdftotext's -f)
+
+    Returns:
+        tuple: (pages, pdf_pages), pages being a list of pages, each a list of (word, xmin, ymin, 
+               xmax, ymax, page_width, page_height), and pdf_pages the PDF page number of each page. 
+               Pages without words and the HAL cover page are dropped, so pages are not numbered 
+               as in the PDF. Both are None if the document has no textual content.
+    """
+    start_time = time.perf_counter() if metrics.enabled() else None
+    doc, page_positions = PARSERS[parser](file_path, do_normalize_bbox=do_normalize_bbox, remove_ref=remove_ref)
+
+    if start_time is not None:
+        elapsed = time.perf_counter() - start_time
+        metrics.observe("parse_seconds", elapsed)
+        metrics.observe("parse_seconds_per_page", elapsed / max(1, len(doc)))
+
+    return _drop_empty(doc, [first_page + pos for pos in page_positions])
+
+
+def _drop_empty(doc, pdf_pages):
+    """ Drop the HAL cover page, and return (None, None) if no page has words """
     if len(doc) > 0 and skip_first_page(doc[0]):
         doc = doc[1:]
-        if remove_ref and ref_page_idx is not None:
-            ref_page_idx -= 1
-
-    if remove_ref and ref_page_idx is not None and ref_start_idx_in_page is not None:
-        # remove everything that follows references
-        doc = doc[: ref_page_idx+1] 
-        doc[ref_page_idx] = doc[ref_page_idx][: ref_start_idx_in_page] 
+        pdf_pages = pdf_pages[1:]
 
     if any(doc): # no textual contents -> scanned document
-        return doc 
+        return doc, pdf_pages
+
+    return None, None
+
+
+def _iter_text_lines(container):
+    for obj in container:
+        if isinstance(obj, LTTextLine):
+            yield obj
+        elif isinstance(obj, LTContainer):
+            yield from _iter_text_lines(obj)
+
+
+def _line_words(line, page_bbox):
+    """ Words of a pdfminer text line, with their (xmin, ymin, xmax, ymax) coordinates measured 
+        from the top left corner of the page, as in pdftotext's output
+    """
+    page_x0, _, _, page_y1 = page_bbox
+    words = []
+    coords = []
+    chars = []
+    for obj in list(line) + [None]:
+        if isinstance(obj, LTChar) and not obj.get_text().isspace():
+            chars.append(obj)
+            continue
+        if chars: # end of a word: a space, a gap detected by pdfminer or the end of the line
+            word = clean_text("".join(char.get_text() for char in chars))
+            if word:
+                words.append(word)
+                coords.append((
+                    min(char.x0 for char in chars) - page_x0,
+                    page_y1 - max(char.y1 for char in chars),
+                    max(char.x1 for char in chars) - page_x0,
+                    page_y1 - min(char.y0 for char in chars),
+                ))
+            chars = []
+    return words, coords
+
+
+def _read_pdf_pdfminer(pdf_path, first_page=1, do_normalize_bbox=False, remove_ref=False):
+    """ Extract the words of a PDF in-process with pdfminer, page by page, in the structure 
+        of `_read_pages`. Words are split at spaces and at the gaps found by pdfminer's 
+        layout analysis, so the reading order and word boundaries can differ from pdftotext.
+    """
+    doc = []
+    pdf_pages = []
+    laparams = LAParams(all_texts=True)
+    page_numbers = range(first_page - 1, sys.maxsize) if first_page > 1 else None # 0-based
+    for pos, layout in enumerate(extract_pages(pdf_path, page_numbers=page_numbers, laparams=laparams)):
+        words = []
+        coords = []
+        reached_ref = False
+        for line in _iter_text_lines(layout):
+            line_words, line_coords = _line_words(line, layout.bbox)
+            if remove_ref and doc and is_ref_heading(line_words):
+                # references start here (headings on the first page are ignored)
+                reached_ref = True
+                break
+            words += line_words
+            coords += line_coords
+        if words:
+            page = _make_page(
+                words, coords, round(layout.width), round(layout.height), do_normalize_bbox
+            )
+            if page:
+                doc.append(page)
+                pdf_pages.append(first_page + pos)
+        if reached_ref:
+            break
+    return doc, pdf_pages
+
+
+def extract_text_from_pdf_inprocess(pdf_path, first_page=1, do_normalize_bbox=False, remove_ref=False):
+    """ Extract the words of a PDF with pdfminer, without running pdftotext
+
+    Returns:
+        tuple: (pages, pdf_pages), as returned by `extract_text_from_tree`
+    """
+    with metrics.timer("pdfminer_seconds"):
+        doc, pdf_pages = _read_pdf_pdfminer(
+            pdf_path, first_page=first_page, do_normalize_bbox=do_normalize_bbox, remove_ref=remove_ref
+        )
+    return _drop_empty(doc, pdf_pages)
+
+
+PDF_BACKENDS = ("pdftotext", "pdfminer")
+
+
+class _TeeStream:
+    """ Binary stream copying everything read from `stream` to `copy` """
+
+    def __init__(self, stream, copy):
+        self.stream = stream
+        self.copy = copy
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.copy.write(data)
+        return data
+
+
+def extract_text_from_pdf(
+    input_dir, 
+    pdf_folder, 
+    filename, 
+    use_docker=False, 
+    first_page=1, 
+    max_pages=-1, 
+    html_path=None, 
+    do_normalize_bbox=False, 
+    remove_ref=False, 
+    parser="fast",
+    scanned_check_pages=0,
+    backend="pdftotext",
+    pdf_catalog=None,
+    timeout=-1,
+    max_memory=-1
+):
+    """ Run pdftotext and parse its HTML output from the pipe while it is produced.
+        The HTML is only written to disk if `html_path` is given. With the "pdfminer" 
+        backend, the PDF is read in-process instead, and no HTML is produced.
+
+    Returns:
+        tuple: (status, reason, doc), status being DONE if the PDF has been converted, FAILED if 
+               pdftotext failed (or the PDF is invalid) and SCANNED if the PDF has no text layer, 
+               and doc the output of `extract_text_from_tree` ((pages, pdf_pages), None if the 
+               status is not DONE)
+    """
+    if backend == "pdfminer":
+        pdf_path = get_pdf_path(input_dir, pdf_folder, filename, use_docker)
+        status, reason = check_pdf(pdf_path, max_pages, scanned_check_pages, first_page, pdf_catalog)
+        if status is not None:
+            return status, reason, None
+        try:
+            doc = extract_text_from_pdf_inprocess(
+                pdf_path, first_page=first_page, do_normalize_bbox=do_normalize_bbox, remove_ref=remove_ref
+            )
+        except (PSException, ValueError, KeyError, TypeError, AssertionError):
+            return FAILED, "pdfminer", None
+        return DONE, None, doc
+
+    process, watchdog, status, reason = pdf2flowhtml_stream(
+        input_dir, pdf_folder, filename, use_docker, first_page, max_pages, scanned_check_pages, pdf_catalog,
+        timeout, max_memory
+    )
+    if process is None:
+        return status, reason, None
+
+    html_file = open(html_path, "wb") if html_path is not None else None
+    try:
+        with watchdog, process, metrics.timer("pdftotext_seconds", mode="stream"):
+            stream = process.stdout if html_file is None else _TeeStream(process.stdout, html_file)
+            try:
+                doc = extract_text_from_tree(
+                    stream, do_normalize_bbox=do_normalize_bbox, remove_ref=remove_ref, parser=parser,
+                    first_page=first_page
+                )
+            except XMLSyntaxError: # empty output
+                doc = None, None
+            # parsing may stop early (at the references): let pdftotext finish writing
+            while stream.read(1 << 16):
+                pass
+    finally:
+        if html_file is not None:
+            html_file.close()
+
+    if process.returncode != 0:
+        if html_path is not None:
+            os.remove(html_path)
+        status, reason = failure_status(process.returncode, watchdog.fired, max_memory, "pdftotext")
+        return status, reason, None
+    return DONE, None, doc
+
+
+def add_pdf_backend_args(parser):
+    parser.add_argument(
+        "--pdf_backend",
+        type=str,
+        default="pdftotext",
+        choices=PDF_BACKENDS,
+        help="With --pdf_folder, run pdftotext on each PDF ('pdftotext'), or read the PDFs "\
+            "in-process with pdfminer ('pdfminer'), without starting a process (or a container) per file."
+    )
+
 
-    return None
+def parse_document(fname, args):
+    """ Parse an HTML file, or the output of pdftotext on a PDF file if --pdf_folder is set, 
+        and write its words to the output directory
+
+    Args:
+        fname (string): HTML or PDF file name
+        args (Namespace): Parsing arguments
+
+    Returns:
+        tuple: (doc_id, status, reason)
+    """
+    if args.pdf_folder is not None:
+        doc_id = fname[:-len(".pdf")]
+        html_path = None
+        if args.html_output_dir is not None:
+            html_path = os.path.join(args.html_output_dir, doc_id + ".html")
+        status, reason, doc = extract_text_from_pdf(
+            args.input_dir,
+            args.pdf_folder,
+            fname,
+            use_docker=args.use_docker,
+            first_page=args.first_page,
+            max_pages=args.max_pages,
+            html_path=html_path,
+            do_normalize_bbox=args.do_normalize_bbox, 
+            remove_ref=args.remove_ref, 
+            parser=args.parser,
+            scanned_check_pages=args.scanned_check_pages,
+            backend=args.pdf_backend,
+            pdf_catalog=args.pdf_catalog,
+            timeout=args.timeout,
+            max_memory=args.max_memory
+        )
+        if status != DONE:
+            return doc_id, status, reason
+    else:
+        html_path = os.path.join(args.html_dir, fname)
+        doc = extract_text_from_tree(
+            html_path, do_normalize_bbox=args.do_normalize_bbox, remove_ref=args.remove_ref, parser=args.parser,
+            first_page=args.first_page
+        )
+        doc_id = fname.replace(".html", "")
 
+    doc, pdf_pages = doc
+    if doc is None:
+        return doc_id, FAILED, "no_text"
 
-def parse(args):
-    fnames = sorted(os.listdir(args.html_dir))
+    if args.output_format == "tok":
+        TokenDoc.from_pages(doc, pdf_pages).save(os.path.join(args.output_dir, doc_id + TOK_EXT))
+        return doc_id, DONE, None
+
+    output_file = os.path.join(
+        os.path.join(args.output_dir, doc_id + ".txt")
+    )
+    with TxtWriter(output_file, pdf_pages) as fw:
+        for page_id, p in enumerate(doc):
+            for elem in p:
+                word = elem[0]
+                bbox = elem[1:5]
+                page_width, page_height = elem[5:]
+
+                bbox_str = (
+                    str(bbox[0]) 
+                    + "\t" 
+                    + str(bbox[1]) 
+                    + "\t" 
+                    + str(bbox[2]) 
+                    + "\t" 
+                    + str(bbox[3])
+                )
+
+                fw.write(
+                    word 
+                    + "\t" 
+                    + bbox_str 
+                    + "\t" 
+                    + str(page_width) 
+                    + "\t" 
+                    + str(page_height) 
+                    + "\t"
+                    + str(page_id+1)
+                    + "\n",
+                    page_id + 1
+                )
+
+    return doc_id, DONE, None
+
+
+def _link_outputs(args, source_id, copy_id):
+    output_exts = [TOK_EXT] if args.output_format == "tok" else [".txt", ".txt" + PAGE_INDEX_EXT]
+    paths = [(args.output_dir, ext) for ext in output_exts]
+    if args.html_output_dir is not None:
+        paths.append((args.html_output_dir, ".html"))
+    for output_dir, ext in paths:
+        source_path = os.path.join(output_dir, source_id + ext)
+        if os.path.isfile(source_path):
+            link_file(source_path, os.path.join(output_dir, copy_id + ext))
+
+
+def parse(args, state_store):
+    if args.pdf_folder is None:
+        input_path, ext = args.html_dir, ".html"
+        fnames = sorted(os.listdir(input_path))
+    else:
+        if args.use_docker:
+            input_path = os.path.join(args.input_dir, args.pdf_folder)
+        else:
+            input_path = args.pdf_folder
+        ext = ".pdf"
+        fnames = sorted(fname for fname in os.listdir(input_path) if fname.endswith(ext))
     fnames = fnames[:args.n_docs] if args.n_docs > 0 else fnames 
+    all_fnames = fnames
 
     if args.resume:
         print("Resuming parsing...")
-        fnames = remove_processed_from_id_list(
-            fnames, args.parsed_output_log, args.failed_output_log
-        )
+        fnames = [fname.replace(ext, "") for fname in fnames]
+        fnames = remove_processed_from_id_list(fnames, state_store)
         if not fnames:
-            print(f"All documents in {args.input_file} have already been parsed")
+            print(f"All documents in {input_path} have already been parsed")
             return
-
-    for html in tqdm(fnames, desc=f"Parsing HTMLs from {args.html_dir}"):
-        html_path = os.path.join(args.html_dir, html)
-        doc = extract_text_from_tree(
-            html_path, do_normalize_bbox=args.do_normalize_bbox, remove_ref=args.remove_ref
-        )
-        doc_id = html.replace(".html", "")
-
-        if doc is None:
-            with open(args.not_parsed_output_log, "a") as f:
-                f.write(doc_id + "\n")
+        fnames = [fname + ext for fname in fnames]
+
+    copies = {}
+    link_outputs = partial(_link_outputs, args)
+    if args.dedup:
+        # one parse per unique input, the outputs are linked to the IDs of its copies. HTML files 
+        # are unique by inode, as convert_pdf_to_html.py --dedup hardlinks the HTML of copies
+        input_paths = {fname[:-len(ext)]: os.path.join(input_path, fname) for fname in all_fnames}
+        if args.pdf_folder is None:
+            keys = content_keys_from_inodes(input_paths)
         else:
-            output_file = os.path.join(
-                os.path.join(args.output_dir, doc_id + ".txt")
+            keys = content_keys_from_catalog(
+                input_paths, get_pdf_catalog(args.pdf_catalog), num_workers=args.num_workers
             )
-            with open(output_file, "w", encoding="utf-8") as fw:
-                for page_id, p in enumerate(doc):
-                    for elem in p:
-                        word = elem[0]
-                        bbox = elem[1:5]
-                        page_width, page_height = elem[5:]
-
-                        bbox_str = (
-                            str(bbox[0]) 
-                            + "\t" 
-                            + str(bbox[1]) 
-                            + "\t" 
-                            + str(bbox[2]) 
-                            + "\t" 
-                            + str(bbox[3])
-                        )
-
-                        fw.write(
-                            word 
-                            + "\t" 
-                            + bbox_str 
-                            + "\t" 
-                            + str(page_width) 
-                            + "\t" 
-                            + str(page_height) 
-                            + "\t"
-                            + str(page_id+1)
-                            + "\n" 
-                        )
-
-            with open(args.parsed_output_log, "a") as f:
-                f.write(doc_id + "\n")
+        processed_ids = state_store.get_ids(statuses=[DONE]) if args.resume else ()
+        doc_ids, copies = plan_dedup([fname[:-len(ext)] for fname in fnames], keys, processed_ids)
+        print(f"Parsing {len(doc_ids)} unique documents out of {len(fnames)}")
+        for source_id in set(copies) - set(doc_ids): # parsed by a previous run
+            record_copies(state_store, copies.pop(source_id), source_id, DONE, None, link_outputs)
+        fnames = [doc_id + ext for doc_id in doc_ids]
+
+    worker = partial(parse_document, args=args)
+    desc = f"Parsing {ext[1:].upper()}s from {input_path}"
+    if args.num_workers > 1:
+        # imap keeps the input order, results come back by chunks of `chunksize` documents
+        with Pool(args.num_workers) as pool:
+            for doc_id, status, reason in tqdm(
+                pool.imap(worker, fnames, chunksize=args.chunksize), total=len(fnames), desc=desc
+            ):
+                state_store.record(doc_id, status, reason=reason)
+                record_copies(state_store, copies.pop(doc_id, []), doc_id, status, reason, link_outputs)
+            pool.close()
+            pool.join()
+    else:
+        for doc_id, status, reason in tqdm(map(worker, fnames), total=len(fnames), desc=desc):
+            state_store.record(doc_id, status, reason=reason)
+            record_copies(state_store, copies.pop(doc_id, []), doc_id, status, reason, link_outputs)
                     
 
 if __name__ == "__main__":
@@ -179,7 +642,46 @@ if __name__ == "__main__":
     parser.add_argument(
         "--html_dir", 
         type=str,
-        required=True,
+        default=None,
+    )
+    parser.add_argument(
+        "--pdf_folder",
+        type=str,
+        default=None,
+        help="Parse the output of pdftotext on these PDFs directly from its standard output, "\
+            "instead of HTML files from --html_dir."
+    )
+    parser.add_argument(
+        "--input_dir",
+        type=str,
+        help="With --pdf_folder and --use_docker, one folder above the one containing the PDF files."
+    )
+    parser.add_argument(
+        "--use_docker",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--first_page",
+        type=int,
+        default=1,
+        help="First PDF page to parse. With --html_dir, the --first_page given to convert_pdf_to_html, "\
+            "used to record the PDF page number of each page."
+    )
+    parser.add_argument(
+        "--max_pages",
+        type=int,
+        default=-1,
+    )
+    add_scanned_check_args(parser)
+    add_catalog_args(parser)
+    add_limit_args(parser)
+    add_dedup_args(parser)
+    add_pdf_backend_args(parser)
+    parser.add_argument(
+        "--html_output_dir",
+        type=str,
+        default=None,
+        help="With --pdf_folder, also keep the HTML files in this directory."
     )
     parser.add_argument(
         "--output_dir",
@@ -195,20 +697,42 @@ if __name__ == "__main__":
         type=int,
         default=5,
     )
+    parser.add_argument(
+        "--output_format", 
+        type=str,
+        default="txt",
+        choices=["txt", "tok"],
+        help="Tab-separated text (one word per line) or binary columnar format."
+    )
     parser.add_argument(
         "--do_normalize_bbox", 
         action="store_true", 
         help="Normalize bbox coordinates."
     )
     parser.add_argument(
-        "--parsed_output_log",
+        "--parser",
         type=str,
-        default="./parsed.log"
+        default="fast",
+        choices=list(PARSERS),
+        help="XML parsing backend. 'legacy' is the original reader, kept for comparison."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Number of processes parsing documents in parallel."
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=8,
+        help="Number of documents sent to a worker at once."
     )
     parser.add_argument(
-        "--not_parsed_output_log",
+        "--state_db",
         type=str,
-        default="./not_parsed_output_log.log"
+        default="./state.db",
+        help="SQLite database recording the status of each document."
     )
     parser.add_argument(
         "--resume", 
@@ -221,12 +745,29 @@ if __name__ == "__main__":
         help="Overwrite the output directory."
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
 
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
     if args.resume and args.overwrite_output_dir:
         raise ValueError(
-            f"Cannot use --resume and --overwrite_output_dir at the same time."
+            "Cannot use --resume and --overwrite_output_dir at the same time."
         )
+    if (args.html_dir is None) == (args.pdf_folder is None):
+        raise ValueError("Set either --html_dir or --pdf_folder.")
+    if args.pdf_backend != "pdftotext" and args.html_output_dir is not None:
+        raise ValueError("--html_output_dir requires --pdf_backend pdftotext.")
+    if args.dedup and args.pdf_folder is not None and args.pdf_catalog is None:
+        raise ValueError(
+            "--dedup with --pdf_folder needs --pdf_catalog to look up the content hash of each PDF."
+        )
+
+    if args.html_output_dir is not None:
+        os.makedirs(args.html_output_dir, exist_ok=True)
+
+    state_store = StateStore(args.state_db, stage=STAGE)
 
     if os.listdir(args.output_dir) and not args.resume:
         if args.overwrite_output_dir:
@@ -234,14 +775,11 @@ if __name__ == "__main__":
             shutil.rmtree(args.output_dir)
             os.makedirs(args.output_dir)
 
-            print(f"Overwriting {args.parsed_output_log}")
-            os.remove(args.parsed_output_log)
-
-            print(f"Overwriting {args.not_parsed_output_log}")
-            os.remove(args.not_parsed_output_log)
+            state_store.clear()
         else:
             raise ValueError(
                 f"Output directory ({args.output_dir}) already exists and is not empty. Use --overwrite_output_dir to overcome."
             )
 
-    parse(args)
\ No newline at end of file
+    with state_store:
+        parse(args, state_store)
\ No newline at end of file
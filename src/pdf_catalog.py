@@ -0,0 +1,351 @@
+import argparse
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import time
+from collections import namedtuple
+from functools import partial
+from multiprocessing import Pool
+from tqdm import tqdm
+import PyPDF2
+from PyPDF2 import PdfFileReader
+
+
+# PdfReadError moved from PyPDF2.utils to PyPDF2.errors in PyPDF2 1.28
+PdfReadError = (getattr(PyPDF2, "errors", None) or PyPDF2.utils).PdfReadError
+
+SCANNED_CHECK_PAGES = 3
+
+BEGIN_TEXT = re.compile(rb"(?<![^\s\]>)])BT(?![^\s\[</(])") # operator starting a text object
+
+PdfInfo = namedtuple(
+    "PdfInfo",
+    [
+        "path", "size", "mtime_ns", "sha256", "num_pages", "page_width", "page_height",
+        "encrypted", "broken", "has_text", "text_check_pages"
+    ]
+)
+
+
+def _has_text(resources, content, depth=0):
+    """ Whether a content stream (of a page or a form XObject) shows text, i.e. declares
+        a font and begins a text object, directly or in one of the forms it draws
+    """
+    if "/Font" in resources and BEGIN_TEXT.search(content):
+        return True
+    if "/XObject" not in resources or depth >= 3:
+        return False
+    xobjects = resources["/XObject"]
+    for name in xobjects:
+        xobject = xobjects[name]
+        if xobject.get("/Subtype") != "/Form":
+            continue
+        form_resources = xobject["/Resources"] if "/Resources" in xobject else resources
+        if _has_text(form_resources, xobject.getData(), depth + 1):
+            return True
+    return False
+
+
+def is_scanned_pdf(pdf_reader, first_page=1, num_pages=SCANNED_CHECK_PAGES):
+    """ Check the first pages of a PDF for a text layer, without rendering it
+
+    Scanned documents only draw images: none of their pages has a font and a text
+    object, so pdftotext would output empty pages.
+
+    Args:
+        pdf_reader (PdfFileReader): Opened PDF
+        first_page (int): First page converted by pdftotext (1-based)
+        num_pages (int): Number of pages to check
+
+    Returns:
+        bool: True if none of the checked pages has text, False if one has text or
+              if a page could not be decoded
+    """
+    last_page = min(first_page - 1 + num_pages, pdf_reader.numPages)
+    try:
+        for i in range(first_page - 1, last_page):
+            page = pdf_reader.getPage(i)
+            if "/Resources" not in page:
+                continue
+            contents = page.getContents()
+            if _has_text(page["/Resources"], contents.getData() if contents is not None else b""):
+                return False
+    except (PdfReadError, NotImplementedError, KeyError, ValueError, TypeError, AssertionError):
+        return False # let pdftotext decide
+    return True
+
+
+def inspect_pdf(pdf_path, text_check_pages=SCANNED_CHECK_PAGES):
+    """ Read a PDF once to get its catalog entry
+
+    Args:
+        pdf_path (string): Absolute path to the PDF
+        text_check_pages (int): Number of first pages checked for a text layer
+
+    Returns:
+        PdfInfo: Entry of the PDF. Page count, dimensions (of the first page) and text flag
+                 are None if the PDF is broken (or encrypted with a password).
+    """
+    stat = os.stat(pdf_path)
+    with open(pdf_path, "rb") as f:
+        data = f.read()
+    num_pages = page_width = page_height = has_text = None
+    encrypted = broken = False
+    try:
+        pdf_reader = PdfFileReader(io.BytesIO(data), strict=False)
+        encrypted = bool(pdf_reader.isEncrypted)
+        if encrypted and not pdf_reader.decrypt(""):
+            broken = True
+        else:
+            num_pages = pdf_reader.numPages
+            if num_pages > 0:
+                media_box = pdf_reader.getPage(0).mediaBox
+                page_width = float(media_box.getWidth())
+                page_height = float(media_box.getHeight())
+            has_text = not is_scanned_pdf(pdf_reader, 1, text_check_pages)
+    except (PdfReadError, OSError, NotImplementedError, KeyError, ValueError, TypeError, AssertionError):
+        broken = True
+        num_pages = page_width = page_height = has_text = None
+    return PdfInfo(
+        pdf_path, stat.st_size, stat.st_mtime_ns, hashlib.sha256(data).hexdigest(), num_pages,
+        page_width, page_height, encrypted, broken, has_text, text_check_pages
+    )
+
+
+class PdfCatalog:
+    """ Metadata of PDF files backed by SQLite, shared by the stages reading PDFs
+
+    Each PDF is read once to record its size, modification time, content hash, page
+    count, first page dimensions, encrypted/broken flags and whether its first pages
+    have a text layer. Entries are keyed by absolute path and are only returned while
+    the size and modification time of the file are unchanged, so `update` only reads
+    new and modified files. Like the state store, each process opens its own connection.
+
+    Args:
+        db_path (string): Path to the SQLite database
+        batch_size (int): Number of entries committed at once by `update`
+    """
+
+    def __init__(self, db_path, batch_size=500):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pdf_catalog ("
+                "path TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, "
+                "sha256 TEXT NOT NULL, "
+                "num_pages INTEGER, "
+                "page_width REAL, "
+                "page_height REAL, "
+                "encrypted INTEGER NOT NULL, "
+                "broken INTEGER NOT NULL, "
+                "has_text INTEGER, "
+                "text_check_pages INTEGER NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS pdf_catalog_sha256 ON pdf_catalog (sha256)")
+            self._conn.commit()
+        return self._conn
+
+    def _write(self, entries):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO pdf_catalog "
+            "(path, size, mtime_ns, sha256, num_pages, page_width, page_height, "
+            "encrypted, broken, has_text, text_check_pages, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [tuple(entry) + (time.time(),) for entry in entries],
+        )
+        self.conn.commit()
+
+    def update(self, pdf_paths, num_workers=1, text_check_pages=SCANNED_CHECK_PAGES):
+        """ Read the PDFs that are not in the catalog, or have changed since they were added
+
+        Args:
+            pdf_paths (list): Paths to the PDFs
+            num_workers (int): Number of processes reading PDFs in parallel
+            text_check_pages (int): Number of first pages checked for a text layer
+
+        Returns:
+            int: Number of PDFs read
+        """
+        pdf_paths = [os.path.abspath(pdf_path) for pdf_path in pdf_paths]
+        known = {
+            path: (size, mtime_ns, check_pages) for path, size, mtime_ns, check_pages in self.conn.execute(
+                "SELECT path, size, mtime_ns, text_check_pages FROM pdf_catalog"
+            )
+        }
+        to_read = []
+        for pdf_path in pdf_paths:
+            stat = os.stat(pdf_path)
+            if known.get(pdf_path) != (stat.st_size, stat.st_mtime_ns, text_check_pages):
+                to_read.append(pdf_path)
+        if not to_read:
+            return 0
+
+        worker = partial(inspect_pdf, text_check_pages=text_check_pages)
+        desc = f"Cataloging PDFs in {self.db_path}"
+        entries = []
+        if num_workers > 1:
+            with Pool(num_workers) as pool:
+                for entry in tqdm(pool.imap_unordered(worker, to_read, chunksize=4), total=len(to_read), desc=desc):
+                    entries.append(entry)
+                    if len(entries) >= self.batch_size:
+                        self._write(entries)
+                        entries = []
+                pool.close()
+                pool.join()
+        else:
+            for entry in tqdm(map(worker, to_read), total=len(to_read), desc=desc):
+                entries.append(entry)
+                if len(entries) >= self.batch_size:
+                    self._write(entries)
+                    entries = []
+        self._write(entries)
+        return len(to_read)
+
+    def remove_missing(self):
+        """ Delete the entries of files that no longer exist """
+        missing = [
+            (path,) for (path,) in self.conn.execute("SELECT path FROM pdf_catalog")
+            if not os.path.isfile(path)
+        ]
+        self.conn.executemany("DELETE FROM pdf_catalog WHERE path = ?", missing)
+        self.conn.commit()
+        return len(missing)
+
+    def get(self, pdf_path):
+        """ Entry of a PDF, or None if it is not in the catalog or has changed since """
+        pdf_path = os.path.abspath(pdf_path)
+        row = self.conn.execute(
+            "SELECT path, size, mtime_ns, sha256, num_pages, page_width, page_height, "
+            "encrypted, broken, has_text, text_check_pages FROM pdf_catalog WHERE path = ?",
+            (pdf_path,),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            stat = os.stat(pdf_path)
+        except OSError:
+            return None
+        entry = PdfInfo(*row)
+        if (entry.size, entry.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return entry._replace(
+            encrypted=bool(entry.encrypted),
+            broken=bool(entry.broken),
+            has_text=None if entry.has_text is None else bool(entry.has_text)
+        )
+
+    def summary(self):
+        return self.conn.execute(
+            "SELECT COUNT(*), SUM(broken), SUM(encrypted), SUM(has_text = 0), SUM(num_pages), "
+            "COUNT(DISTINCT sha256) FROM pdf_catalog"
+        ).fetchone()
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # connections are reopened in worker processes
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        return state
+
+
+_open_catalogs = {}
+
+def get_pdf_catalog(db_path):
+    """ Get the catalog stored at `db_path`, opened once per process """
+    catalog = _open_catalogs.get(db_path)
+    if catalog is None:
+        catalog = PdfCatalog(db_path)
+        _open_catalogs[db_path] = catalog
+    return catalog
+
+
+def list_pdfs(pdf_dir):
+    return [
+        os.path.join(pdf_dir, fname) for fname in sorted(os.listdir(pdf_dir)) if fname.endswith(".pdf")
+    ]
+
+
+def add_catalog_args(parser):
+    parser.add_argument(
+        "--pdf_catalog",
+        type=str,
+        default=None,
+        help="SQLite PDF catalog built by src/pdf_catalog.py. PDFs with an up-to-date entry are "\
+            "not opened to be checked. Not used if not set."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--pdf_dir",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--pdf_catalog",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--text_check_pages",
+        type=int,
+        default=SCANNED_CHECK_PAGES,
+        help="Number of first pages checked for a text layer."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Number of processes reading PDFs in parallel."
+    )
+    parser.add_argument(
+        "--remove_missing",
+        action="store_true",
+        help="Delete the entries of files that no longer exist."
+    )
+
+    args = parser.parse_args()
+
+    with PdfCatalog(args.pdf_catalog) as catalog:
+        num_read = catalog.update(
+            list_pdfs(args.pdf_dir), num_workers=args.num_workers, text_check_pages=args.text_check_pages
+        )
+        print(f"Read {num_read} new or modified PDFs from {args.pdf_dir}")
+        if args.remove_missing:
+            print(f"Removed {catalog.remove_missing()} entries of missing files")
+        num_pdfs, num_broken, num_encrypted, num_scanned, num_pages, num_unique = catalog.summary()
+        print(f"Catalog {args.pdf_catalog}:")
+        print(f"\tPDFs: {num_pdfs} ({num_unique} unique)")
+        print(f"\tBroken: {num_broken or 0}")
+        print(f"\tEncrypted: {num_encrypted or 0}")
+        print(f"\tWithout text layer: {num_scanned or 0}")
+        print(f"\tTotal # pages: {num_pages or 0}")
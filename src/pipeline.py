@@ -0,0 +1,304 @@
+import argparse
+import os
+import shutil
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+from tqdm import tqdm
+from src.utils import remove_processed_from_id_list
+from src.state_store import StateStore, DONE, FAILED, SKIPPED
+from src.abstract_index import get_abstract_index
+from src.token_format import TokenDoc, TXT_EXT, TOK_EXT
+from src.convert_pdf_to_html import add_scanned_check_args
+from src.pdf_catalog import add_catalog_args
+from src.limits import add_limit_args
+from src.parse_html import extract_text_from_pdf, add_pdf_backend_args
+from src.remove_abstract import get_abstracts, find_abstracts_in_pages, remove_spans
+from src import metrics
+
+STAGE = "pipeline"
+
+
+def _save(doc, output_dir, doc_id, output_format):
+    if output_format == "tok":
+        doc.save(os.path.join(output_dir, doc_id + TOK_EXT))
+    else:
+        doc.save_txt(os.path.join(output_dir, doc_id + TXT_EXT))
+
+
+def process_document(filename, args):
+    """ Take one PDF through conversion, parsing, abstract removal and length filtering
+
+    The HTML output of pdftotext is parsed from its standard output while it is
+    produced. Intermediate HTML and parsed files are only written if --html_output_dir
+    and --parsed_output_dir are set.
+
+    Args:
+        filename (string): PDF file name
+        args (Namespace): Pipeline arguments
+
+    Returns:
+        tuple: (doc_id, status, reason)
+    """
+    doc_id = filename[:-len(".pdf")]
+
+    html_path = None
+    if args.html_output_dir is not None:
+        html_path = os.path.join(args.html_output_dir, doc_id + ".html")
+    status, reason, doc = extract_text_from_pdf(
+        args.input_dir,
+        args.pdf_folder,
+        filename,
+        use_docker=args.use_docker,
+        first_page=args.first_page,
+        max_pages=args.max_pages,
+        html_path=html_path,
+        do_normalize_bbox=args.do_normalize_bbox,
+        remove_ref=args.remove_ref,
+        scanned_check_pages=args.scanned_check_pages,
+        backend=args.pdf_backend,
+        pdf_catalog=args.pdf_catalog,
+        timeout=args.timeout,
+        max_memory=args.max_memory
+    )
+    if status != DONE:
+        return doc_id, status, reason
+
+    pages, pdf_pages = doc
+    if pages is None:
+        return doc_id, FAILED, "no_text"
+
+    doc = TokenDoc.from_pages(pages, pdf_pages)
+    if args.parsed_output_dir is not None:
+        _save(doc, args.parsed_output_dir, doc_id, args.output_format)
+
+    reason = None
+    if args.abstract_path is not None:
+        item = get_abstract_index(args.abstract_path).get(doc_id)
+        if item is None: # kept as is, as in remove_abstract
+            reason = "no_abstract_record"
+        else:
+            abstracts = get_abstracts(item, args.main_lang)
+            if abstracts is None:
+                return doc_id, SKIPPED, "no_main_lang_abstract"
+            all_abstracts, main_abstract = abstracts
+            if args.abstract_thresh > 0 and len(main_abstract.split()) < args.abstract_thresh:
+                return doc_id, SKIPPED, "abstract_too_short"
+
+            offsets = np.cumsum([0] + [len(page) for page in pages]).tolist()
+            all_abstracts_start_stop_indices, _ = find_abstracts_in_pages(
+                ((page_num, page, offsets[page_num - 1]) for page_num, page in enumerate(pages, start=1)), 
+                len(pages), 
+                all_abstracts, 
+                args.max_l_dist
+            )
+            if any(indices is None for indices in all_abstracts_start_stop_indices):
+                return doc_id, FAILED, "abstract_not_found"
+
+            doc = remove_spans(doc, all_abstracts_start_stop_indices)
+
+    if doc.num_words < args.lower_bound:
+        return doc_id, SKIPPED, "too_short"
+    if args.upper_bound >= 0 and doc.num_words > args.upper_bound:
+        return doc_id, SKIPPED, "too_long"
+
+    _save(doc, args.output_dir, doc_id, args.output_format)
+    return doc_id, DONE, reason
+
+
+def run(args, state_store):
+    if args.use_docker:
+        pdf_path = os.path.join(args.input_dir, args.pdf_folder)
+    else:
+        pdf_path = args.pdf_folder
+    fnames = sorted(fname for fname in os.listdir(pdf_path) if fname.endswith(".pdf"))
+    fnames = fnames[:args.n_docs] if args.n_docs > 0 else fnames
+
+    if args.resume:
+        print("Resuming pipeline...")
+        fnames = remove_processed_from_id_list(
+            [fname[:-len(".pdf")] for fname in fnames], state_store
+        )
+        if not fnames:
+            print(f"All documents in {pdf_path} have already been processed")
+            return
+        fnames = [fname + ".pdf" for fname in fnames]
+
+    worker = partial(process_document, args=args)
+    desc = f"Processing PDFs in {pdf_path}"
+    if args.num_workers > 1:
+        with Pool(args.num_workers) as pool:
+            for doc_id, status, reason in tqdm(
+                pool.imap_unordered(worker, fnames, chunksize=4), total=len(fnames), desc=desc
+            ):
+                state_store.record(doc_id, status, reason=reason)
+            # let the workers exit normally, so that they dump their metrics
+            pool.close()
+            pool.join()
+    else:
+        for doc_id, status, reason in tqdm(map(worker, fnames), total=len(fnames), desc=desc):
+            state_store.record(doc_id, status, reason=reason)
+
+    for status, reason, n in state_store.summary():
+        print(f"\t{status}" + (f" ({reason})" if reason else "") + f": {n}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--input_dir",
+        type=str,
+        help="The input directory. If using docker, should be one "\
+            "folder above the one containing the PDF files."
+    )
+    parser.add_argument(
+        "--pdf_folder",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Output directory for the parsed documents, without abstract."
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="txt",
+        choices=["txt", "tok"],
+    )
+    parser.add_argument(
+        "--html_output_dir",
+        type=str,
+        default=None,
+        help="Keep the HTML files in this directory."
+    )
+    parser.add_argument(
+        "--parsed_output_dir",
+        type=str,
+        default=None,
+        help="Keep the parsed documents, before abstract removal, in this directory."
+    )
+    parser.add_argument(
+        "--abstract_path",
+        type=str,
+        default=None,
+        help="Abstract file. Abstracts are not removed if not set."
+    )
+    parser.add_argument(
+        "--main_lang",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--abstract_thresh",
+        type=int,
+        default=-1,
+    )
+    parser.add_argument(
+        "--max_l_dist",
+        type=int,
+        default=15,
+    )
+    parser.add_argument(
+        "--lower_bound",
+        type=int,
+        default=0,
+        help="Minimum number of words of an output document."
+    )
+    parser.add_argument(
+        "--upper_bound",
+        type=int,
+        default=-1,
+        help="Maximum number of words of an output document, -1 for no limit."
+    )
+    parser.add_argument(
+        "--use_docker",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--first_page",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--max_pages",
+        type=int,
+        default=-1,
+    )
+    add_scanned_check_args(parser)
+    add_catalog_args(parser)
+    add_limit_args(parser)
+    add_pdf_backend_args(parser)
+    parser.add_argument(
+        "--remove_ref",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--do_normalize_bbox",
+        action="store_true",
+        help="Normalize bbox coordinates."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--n_docs",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--state_db",
+        type=str,
+        default="./state.db",
+        help="SQLite database recording the status of each document."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume processing."
+    )
+    parser.add_argument(
+        "--overwrite_output_dir",
+        action="store_true",
+        help="Overwrite the output directories."
+    )
+
+    metrics.add_metrics_args(parser)
+
+    args = parser.parse_args()
+
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
+    if args.resume and args.overwrite_output_dir:
+        raise ValueError(
+            "Cannot use --resume and --overwrite_output_dir at the same time."
+        )
+    if args.pdf_backend != "pdftotext" and args.html_output_dir is not None:
+        raise ValueError("--html_output_dir requires --pdf_backend pdftotext.")
+
+    state_store = StateStore(args.state_db, stage=STAGE)
+
+    output_dirs = [args.output_dir, args.html_output_dir, args.parsed_output_dir]
+    output_dirs = [output_dir for output_dir in output_dirs if output_dir is not None]
+    for output_dir in output_dirs:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if any(os.listdir(output_dir) for output_dir in output_dirs) and not args.resume:
+        if args.overwrite_output_dir:
+            for output_dir in output_dirs:
+                print(f"Overwriting {output_dir}")
+                shutil.rmtree(output_dir)
+                os.makedirs(output_dir)
+            state_store.clear()
+        else:
+            raise ValueError(
+                f"Output directories ({', '.join(output_dirs)}) already exist and are not empty. Use --overwrite_output_dir to overcome."
+            )
+
+    with state_store:
+        run(args, state_store)
@@ -1,278 +1,480 @@
 import argparse
+import io
 import os 
 import shutil
-import natsort
 import tarfile
 import time
 from tqdm import tqdm 
 import regex as re
 from fuzzysearch import find_near_matches 
 from PIL import Image, ImageDraw
-import subprocess
-import urllib.request
-import json
+import numpy as np
+from functools import partial
+from multiprocessing import Pool
 from src.utils import (
     remove_processed_from_id_list, 
-    compress_dir, 
-    overwrite_dir_if_exists,
-    del_file_if_exists
+    overwrite_dir_if_exists
 )
+from src.state_store import StateStore, DONE, FAILED, SKIPPED
+from src.abstract_index import get_abstract_index
+from src.match_cache import MAX_ENTRIES, get_match_cache, text_hash
+from src.token_format import (
+    TokenDoc, TxtDoc, TXT_EXT, TOK_EXT, copy_doc
+)
+from src import metrics
 
 
-def find_word_idx_for_span(text, start_idx, end_idx):
-    new_splitted_text = (
-        text[:start_idx].split() 
-        + ["<IS_ABSTRACT>"] * len(text[start_idx: end_idx].split())
-        + text[end_idx:].split()
-    )
+STAGE = "remove_abstract"
+MIN_PIECE_LENGTH = 4 # below, pieces of the abstract match almost everywhere
 
-    abstract_idx = [
-        i for i, w in enumerate(new_splitted_text) if w == "<IS_ABSTRACT>"
-    ]
 
-    if len(abstract_idx) == 0:
-        return None 
+def find_word_idx_for_span(text, start_idx, end_idx):
+    return PageText(text).word_idx_for_span(start_idx, end_idx)
+
+def find_candidate_regions(text, pattern, max_l_dist):
+    """ Regions of a text that can contain a match of a pattern with at most `max_l_dist` edits
+
+    The pattern is cut into `max_l_dist + 1` pieces: a match with at most `max_l_dist` edits
+    contains one of them unchanged. Each exact occurrence of a piece gives a window around 
+    the place where the pattern would start, and overlapping windows are merged, so every 
+    match lies in one of the regions.
+
+    Args:
+        text (string): Text to search in
+        pattern (string): Pattern to search for
+        max_l_dist (int): Maximum number of edits
+
+    Returns:
+        list: Sorted (start, end) regions, or None if the pieces are too short to be selective,
+              in which case the whole text must be searched
+    """
+    piece_len = len(pattern) // (max_l_dist + 1)
+    if piece_len < MIN_PIECE_LENGTH:
+        return None
 
-    if len(abstract_idx) == len(text.split()):
+    windows = []
+    for offset in range(0, piece_len * (max_l_dist + 1), piece_len):
+        piece = pattern[offset: offset + piece_len]
+        pos = text.find(piece)
+        while pos != -1:
+            start = pos - offset
+            windows.append((max(start - max_l_dist, 0), start + len(pattern) + max_l_dist))
+            pos = text.find(piece, pos + 1)
+
+    regions = []
+    for start, end in sorted(windows):
+        if regions and start <= regions[-1][1]:
+            regions[-1][1] = max(regions[-1][1], end)
+        else:
+            regions.append([start, end])
+    return regions
+
+
+def _find_near_matches_seeded(text, pattern, max_l_dist):
+    """ Span of the first match of `pattern` with at most `max_l_dist` edits (`fuzzysearch`) """
+    regions = find_candidate_regions(text, pattern, max_l_dist)
+    if regions is None:
+        regions = [(0, len(text))]
+    for start, end in regions:
+        matches = find_near_matches(pattern, text[start: end], max_l_dist=max_l_dist)
+        if matches:
+            return matches[0].start + start, matches[0].end + start
+    return None
+
+
+def _fuzzy_search_seeded(text, pattern, max_errors):
+    """ Span of the first match of `pattern` with at most `max_errors` errors (`regex` fuzzy matching) """
+    compiled = re.compile("(?:" + re.escape(pattern) + "){e<=" + str(max_errors) + "}")
+    regions = find_candidate_regions(text, pattern, max_errors)
+    if regions is None:
+        regions = [(0, len(text))]
+    for start, end in regions:
+        match = compiled.search(text, start, end)
+        if match:
+            return match.span()
+    return None
+
+
+class PageText:
+    """ Normalized text of a page, in which the abstracts of every language are searched
+
+    The character offsets of the words are computed once, so that a matched span is 
+    mapped to word indices without splitting the text again.
+
+    Args:
+        text (string): Text of the page
+    """
+
+    def __init__(self, text):
+        self.text = text
+        words = text.split()
+        word_lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        if len(words) + int(word_lengths.sum()) - 1 == len(text): 
+            # words separated by a single character
+            self.word_ends = np.cumsum(word_lengths + 1) - 1
+        else:
+            word_ends = []
+            pos = 0
+            for word in words:
+                pos = text.find(word, pos) + len(word)
+                word_ends.append(pos)
+            self.word_ends = np.array(word_ends, dtype=np.int64)
+        self.word_starts = self.word_ends - word_lengths
+
+    @classmethod
+    def from_page(cls, page):
+        """ Lowercased text of a page given as word entries whose first field is the word """
+        return cls(" ".join([content[0] for content in page]).lower())
+
+    def word_idx_for_span(self, start_idx, end_idx):
+        """ Indices of the first and last words overlapping a character span, or None if the 
+            span covers no word or every word. A word cut by the start of the span counts
+            both before and in the span.
+        """
+        if end_idx <= start_idx:
+            return None
+        num_before = int(np.searchsorted(self.word_starts, start_idx, side="left"))
+        num_in_span = (
+            int(np.searchsorted(self.word_starts, end_idx, side="left")) 
+            - int(np.searchsorted(self.word_ends, start_idx, side="right"))
+        )
+        if num_in_span <= 0 or num_in_span == len(self.word_starts):
+            return None
+        return (num_before, num_before + num_in_span - 1)
+
+    def find_abstract(self, abstract_text, max_l_dist=15):
+        """ Word indices of the first and last words of an abstract: exact match first, then 
+            fuzzy matching, only run around the exact occurrences of pieces of the abstract
+        """
+        text = self.text
+        start_time = time.perf_counter()
+        start_idx = text.find(abstract_text)
+
+        if start_idx != -1:
+            end_idx = start_idx + len(abstract_text)
+            abstract_idx = self.word_idx_for_span(start_idx, end_idx)
+            metrics.observe("abstract_match_seconds", time.perf_counter() - start_time, method="exact")
+            return abstract_idx
+
+        span = _find_near_matches_seeded(text, abstract_text, max_l_dist)
+
+        if span:
+            abstract_idx = self.word_idx_for_span(*span)
+            metrics.observe("abstract_match_seconds", time.perf_counter() - start_time, method="fuzzy")
+            return abstract_idx
+
+        span = _fuzzy_search_seeded(text, abstract_text, 5)
+
+        if span:
+            abstract_idx = self.word_idx_for_span(*span)
+            metrics.observe("abstract_match_seconds", time.perf_counter() - start_time, method="regex")
+            return abstract_idx
+
+        metrics.observe("abstract_match_seconds", time.perf_counter() - start_time, method="not_found")
         return None
 
-    return (abstract_idx[0], abstract_idx[-1])
+    def find_abstracts(self, abstracts, max_l_dist=15, cache=None):
+        """ `find_abstract` for each (lowercased) abstract, abstracts repeated in several
+            languages being searched once. With a `MatchCache`, the results of previous 
+            runs for the same page, abstract and parameters are reused.
+        """
+        if cache is not None:
+            page_hash = text_hash(self.text)
+            params = cache.params(max_l_dist)
+        matches = {}
+        for abstract_text in abstracts:
+            if abstract_text in matches:
+                continue
+            if cache is None:
+                matches[abstract_text] = self.find_abstract(abstract_text, max_l_dist)
+                continue
+            abstract_hash = text_hash(abstract_text)
+            found, abstract_idx = cache.get(page_hash, abstract_hash, params)
+            if not found:
+                abstract_idx = self.find_abstract(abstract_text, max_l_dist)
+                cache.put(page_hash, abstract_hash, params, abstract_idx)
+            metrics.inc("abstract_match_cache_total", result="hit" if found else "miss")
+            matches[abstract_text] = abstract_idx
+        return [matches[abstract_text] for abstract_text in abstracts]
 
-def find_abstract_span(text, abstract_text, max_l_dist=15):
-    start_idx = text.find(abstract_text)
-    
-    if start_idx != -1:
-        end_idx = start_idx + len(abstract_text)
-        abstract_idx = find_word_idx_for_span(text, start_idx, end_idx)
-        return abstract_idx
-
-    matches = find_near_matches(abstract_text, text, max_l_dist=max_l_dist)
-
-    if matches:
-        start_idx = matches[0].start
-        end_idx = matches[0].end
-
-        abstract_idx = find_word_idx_for_span(text, start_idx, end_idx)
-        return abstract_idx
-
-    match = re.search("(?:" + re.escape(abstract_text) + "){e<=5}", text)
-
-    if match:
-        span = match.span()
-        start_idx = span[0]
-        end_idx = span[1] 
-
-        abstract_idx = find_word_idx_for_span(text, start_idx, end_idx)
-        return abstract_idx
-
-    return None 
-
-
-def _update_and_save_txt(in_txt_path, out_txt_path, start_stop_indices):
-    with open(out_txt_path, "w") as fw:
-        with open(in_txt_path, "r") as f:
-            for i, line in enumerate(f):
-                in_abstract = False 
-                for (start, stop) in start_stop_indices:
-                    if i >= start and i <= stop:
-                        in_abstract = True
-                        break 
-                if not in_abstract:
-                    fw.write(line)
-
-
-def _update_and_save_img(
-    doc_id, 
-    in_img_tar, 
-    page_num, 
-    start_stop_indices,
-    pdf_size,
-    bboxes,
-    out_img_folder, 
-    out_img_tar, 
-):
-    with tarfile.open(in_img_tar) as tar:
-        def is_within_directory(directory, target):
-            
-            abs_directory = os.path.abspath(directory)
-            abs_target = os.path.abspath(target)
-        
-            prefix = os.path.commonprefix([abs_directory, abs_target])
-            
-            return prefix == abs_directory
-        
-        def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-        
-            for member in tar.getmembers():
-                member_path = os.path.join(path, member.name)
-                if not is_within_directory(path, member_path):
-                    raise Exception("Attempted Path Traversal in Tar File")
-        
-            tar.extractall(path, members, numeric_owner=numeric_owner) 
-            
-        
-        safe_extract(tar, out_img_folder)
 
-    doc_out_img_folder = os.path.join(out_img_folder, doc_id)
-    image_page_path = os.path.join(
-        doc_out_img_folder,
-        f"{doc_id}-{page_num}.jpg"
-    )
-    image = Image.open(image_page_path)
-    draw = ImageDraw.Draw(image)
-    img_width, img_height = image.size
-    width, height = pdf_size
-    scale_w = img_width / width
-    scale_h = img_height / height
+def find_abstract_span(text, abstract_text, max_l_dist=15):
+    return PageText(text).find_abstract(abstract_text, max_l_dist)
+
+
+def get_abstracts(item, main_lang):
+    """ Get the abstracts of a document from its record in the abstract file
+
+    Args:
+        item (dict): Record of the document
+        main_lang (string): Main language of the dataset
+
+    Returns:
+        tuple: (list of abstracts in every language, abstract in main language),
+               or None if there is no abstract written in the main language
+    """
+    if "abstract" in item.keys(): # only one language in dataset
+        all_abstracts = [item["abstract"]]
+        main_abstract = item["abstract"]
+    elif "abstract_" + str(main_lang) in item.keys():
+        all_abstracts = [abstract for key, abstract in item.items() if key.startswith("abstract_")]
+        main_abstract = item["abstract_" + main_lang]
+    else:
+        return None
 
-    for i, box in enumerate(bboxes):
-        if i >= start_stop_indices[0] and i <= start_stop_indices[1]:
-            box = [int(b) for b in box]
-            scaled_box = [box[0] * scale_w, box[1] * scale_h, box[2] * scale_w, box[3] * scale_h]
+    all_abstracts = [abstract.replace("\n", "") for abstract in all_abstracts]
+    return all_abstracts, main_abstract
 
-            draw.rectangle(scaled_box, fill="black")
 
-    image.save(image_page_path)
-    image.close()
+def get_pages_to_search(num_pages):
+    return [1, 2, num_pages-1, num_pages] # we only look at the first two and last two pages
 
-    compress_dir(out_img_tar, doc_out_img_folder)
-    shutil.rmtree(doc_out_img_folder)
 
+def load_document(doc_path):
+    """ Read a parsed document once: memory-mapped for .tok files, with a single read for .txt files """
+    if doc_path.endswith(TOK_EXT):
+        return TokenDoc.load(doc_path)
+    return TxtDoc.load(doc_path)
 
-def count_num_pages(filepath):
-    last_line = subprocess.check_output(['tail', '-1', filepath])[:-1]
-    last_line = last_line.decode("utf-8").split("\t")
-    return int(last_line[-1])
+
+def remove_spans(doc, start_stop_indices):
+    """ Document (TokenDoc or TxtDoc) without the words of the given (start, stop) spans, stop included """
+    keep = np.ones(doc.num_words, dtype=bool)
+    for (start, stop) in start_stop_indices:
+        keep[start: stop + 1] = False
+    return doc.select(keep)
+
+
+def find_abstracts_in_pages(pages, num_pages, all_abstracts, max_l_dist=15, cache=None):
+    """ Find the span of each abstract in the first two and last two pages of a document
+
+    Args:
+        pages (iterable): (page number, page, number of words before the page) triples, where 
+                          page is a list of word entries whose first field is the word. 
+                          Consumed until every abstract is found.
+        num_pages (int): Number of pages in the document
+        all_abstracts (list): Abstracts to look for
+        max_l_dist (int): Maximum Levenshtein distance for fuzzy matching
+        cache (MatchCache): Cache of previous matching results, not used if None
+
+    Returns:
+        tuple: For each abstract, the (start, stop) word indices in the document (None if not found),
+               and the (page number, page, number of words before the page) it has been found in
+    """
+    pages_to_search = get_pages_to_search(num_pages)
+
+    all_abstracts_start_stop_indices = [None for _ in all_abstracts]
+    all_abstracts_page = [None for _ in all_abstracts]
+
+    abstracts = [abstract_text.lower() for abstract_text in all_abstracts]
+
+    for page_num, page, offset in pages:
+        if page_num in pages_to_search:
+            page_text = PageText.from_page(page)
+            page_matches = page_text.find_abstracts(abstracts, max_l_dist, cache)
+
+            for lang_idx, abstract_start_stop_indices in enumerate(page_matches):
+                if abstract_start_stop_indices is not None:
+                    all_abstracts_start_stop_indices[lang_idx] = (
+                        abstract_start_stop_indices[0] + offset,
+                        abstract_start_stop_indices[1] + offset,
+                    )
+                    all_abstracts_page[lang_idx] = (page_num, page, offset)
+
+            if all(indices is not None for indices in all_abstracts_start_stop_indices):
+                break
+
+    return all_abstracts_start_stop_indices, all_abstracts_page
+
+
+def get_abstract_boxes(all_abstracts_start_stop_indices, all_abstracts_page, pdf_page_num=None, img_first_page=1):
+    """ Group the bounding boxes of the words of each abstract by page image
+
+    Pages of the parsed document are not numbered as the images: the parser drops empty pages
+    and HAL cover pages, and the text and image stages can start at different pages. Each page 
+    is mapped to its PDF page number, then to the image rendered from that PDF page.
+
+    Args:
+        all_abstracts_start_stop_indices (list): (start, stop) word indices of each abstract
+        all_abstracts_page (list): (page number, page, number of words before the page) of each abstract
+        pdf_page_num (callable): PDF page number of a page of the parsed document (`TokenDoc.pdf_page_num`),
+                                 pages are assumed to be numbered as in the PDF if None
+        img_first_page (int): First PDF page converted to an image (--first_page of convert_pdf_to_image)
+
+    Returns:
+        dict: Image number -> ((page width, page height), list of word bounding boxes)
+    """
+    page_boxes = {}
+    for (start, stop), (page_num, page, offset) in zip(all_abstracts_start_stop_indices, all_abstracts_page):
+        if pdf_page_num is not None:
+            page_num = pdf_page_num(page_num)
+        img_num = page_num - img_first_page + 1
+        if img_num < 1:
+            continue # page not converted to an image
+        page_size = (float(page[0][5]), float(page[0][6]))
+        boxes = [[float(b) for b in content[1:5]] for content in page[start - offset: stop - offset + 1]]
+        page_boxes.setdefault(img_num, (page_size, []))[1].extend(boxes)
+    return page_boxes
+
+
+def _image_page_num(member_name):
+    """ Page number of an image named `<doc_id>/<doc_id>-<page number>.<ext>`, None for other members """
+    stem = os.path.splitext(os.path.basename(member_name))[0]
+    page_num = stem.rsplit("-", 1)[-1]
+    return int(page_num) if page_num.isdigit() else None
+
+
+def redact_images(in_img_tar, out_img_tar, page_boxes):
+    """ Copy the page images of a document, blacking out the given boxes
+
+    The archive is rewritten as a stream: members are copied as they are read, and only 
+    the images of pages with boxes are decoded, drawn on in one pass and encoded again.
+
+    Args:
+        in_img_tar (string): Images of the document (`.tar.gz`, as written by convert_pdf_to_image)
+        out_img_tar (string): Output archive
+        page_boxes (dict): Image number -> ((page width, page height), boxes), see `get_abstract_boxes`
+    """
+    with tarfile.open(in_img_tar, "r|gz") as tar_in, tarfile.open(out_img_tar, "w|gz") as tar_out:
+        for member in tar_in:
+            fileobj = tar_in.extractfile(member) if member.isfile() else None
+            page_num = _image_page_num(member.name) if fileobj is not None else None
+            if page_num not in page_boxes:
+                tar_out.addfile(member, fileobj)
+                continue
+
+            (width, height), boxes = page_boxes[page_num]
+            image = Image.open(fileobj)
+            image.load()
+            img_width, img_height = image.size
+            scale_w = img_width / width
+            scale_h = img_height / height
+            draw = ImageDraw.Draw(image)
+            for box in boxes:
+                box = [int(b) for b in box]
+                draw.rectangle(
+                    [box[0] * scale_w, box[1] * scale_h, box[2] * scale_w, box[3] * scale_h], fill="black"
+                )
+            buffer = io.BytesIO()
+            image.save(buffer, format=image.format)
+            image.close()
+
+            member.size = buffer.tell()
+            buffer.seek(0)
+            tar_out.addfile(member, buffer)
+
+
+def remove_abstracts_from_document(doc_fname, args):
+    """ Find the abstracts of a document and write it without them
+
+    Args:
+        doc_fname (string): Name of the .txt or .tok file in --text_dir, with a record in the abstract file
+        args (Namespace): remove_abstract arguments
+
+    Returns:
+        tuple: (doc_id, status, reason)
+    """
+    doc_id = os.path.splitext(doc_fname)[0]
+    item = get_abstract_index(args.abstract_path).get(doc_id)
+    doc_txt_path = os.path.join(args.text_dir, doc_fname)
+    doc_out_txt_path = os.path.join(args.output_text_dir, doc_fname)
+    if args.img_dir is not None:
+        img_tar = os.path.join(args.img_dir, doc_id + ".tar.gz")
+        doc_out_img_tar = os.path.join(args.output_img_dir, doc_id + ".tar.gz")
+
+    abstracts = get_abstracts(item, args.main_lang)
+    if abstracts is None:
+        return doc_id, SKIPPED, "no_main_lang_abstract" # no abstract written in main language, skip
+    all_abstracts, main_abstract = abstracts
+
+    if args.abstract_thresh > 0 and len(main_abstract.split()) < args.abstract_thresh:
+        print("Skipped {} (# words in abstract = {} < {})".format(
+            doc_id, len(main_abstract.split()), args.abstract_thresh
+        ))
+        return doc_id, SKIPPED, "abstract_too_short"
+
+    cache = get_match_cache(args.match_cache, args.match_cache_size) if args.match_cache else None
+
+    doc = load_document(doc_txt_path)
+    num_pages = doc.last_page_num
+    all_abstracts_start_stop_indices, all_abstracts_page = find_abstracts_in_pages(
+        doc.iter_pages(get_pages_to_search(num_pages)), 
+        num_pages, 
+        all_abstracts, 
+        args.max_l_dist,
+        cache
+    )
+    if cache is not None:
+        cache.flush() # pool workers are not closed, commit after each document
+    if any(indices is None for indices in all_abstracts_start_stop_indices):
+        return doc_id, FAILED, "abstract_not_found"
+
+    remove_spans(doc, all_abstracts_start_stop_indices).save(doc_out_txt_path)
+    if args.img_dir is not None:
+        if not os.path.isfile(img_tar):
+            return doc_id, DONE, "no_images"
+        redact_images(
+            img_tar, 
+            doc_out_img_tar, 
+            get_abstract_boxes(
+                all_abstracts_start_stop_indices, all_abstracts_page, doc.pdf_page_num, args.img_first_page
+            )
+        )
+    return doc_id, DONE, None
 
 
-def find_and_remove(args):
-    txt_fnames = sorted(os.listdir(args.text_dir))
+def find_and_remove(args, state_store):
+    txt_fnames = sorted(
+        fname for fname in os.listdir(args.text_dir) if fname.endswith((TXT_EXT, TOK_EXT))
+    )
     txt_fnames = txt_fnames[:args.n_docs] if args.n_docs > 0 else txt_fnames 
+    doc_fnames = {os.path.splitext(fname)[0]: fname for fname in txt_fnames} # .txt or .tok
 
     if args.resume_processing:
-        txt_fnames = [fname[:-len(".txt")] for fname in txt_fnames]
+        txt_fnames = list(doc_fnames.keys())
         print("Resuming processing...")
-        txt_fnames = remove_processed_from_id_list(
-            txt_fnames, args.found_output_log, args.failed_output_log
-        )
+        txt_fnames = remove_processed_from_id_list(txt_fnames, state_store)
         if not txt_fnames:
             print(f"All documents in {args.text_dir} have already been processed.")
             return 
-        txt_fnames = [fname + ".txt" for fname in txt_fnames]
-
-    input_doc_ids = [fname.replace(".txt", "") for fname in txt_fnames]
-
-    remaining_files = input_doc_ids.copy()
-
-    num_lines = sum(1 for line in open(args.abstract_path,'r'))
-
-    with open(args.abstract_path, 'r') as f:
-        for line in tqdm(f, total=num_lines, desc=f"Removing abstracts from TXTs in {args.text_dir}"):
-            item = json.loads(line)
-            doc_id = item["id"]
-
-            if doc_id not in input_doc_ids:
-                continue 
-
-            if doc_id not in remaining_files:
-                print(doc_id)
-            remaining_files.remove(doc_id)
-
-            doc_txt_path = os.path.join(args.text_dir, doc_id + ".txt")
-            doc_out_txt_path = os.path.join(args.output_text_dir, doc_id + ".txt")
-            if args.img_dir is not None:
-                img_tar = os.path.join(args.img_dir, doc_id + ".tar.gz")
-                doc_out_img_tar = os.path.join(args.output_img_dir, doc_id + ".tar.gz")
-        
-            if "abstract" in item.keys(): # only one language in dataset
-                all_abstracts = [item["abstract"]]
-                main_abstract = item["abstract"]
-            elif "abstract_" + args.main_lang in item.keys():
-                all_abstracts = [abstract for key, abstract in item.items() if key.startswith("abstract_")]
-                main_abstract = item["abstract_" + args.main_lang]
-
-            else:
-                continue # no abstract written in main language, skip
-
-            all_abstracts = [abstract.replace("\n", "") for abstract in all_abstracts]
-
-            if args.abstract_thresh > 0 and len(main_abstract.split()) < args.abstract_thresh:
-                print("Skipped {} (# words in abstract = {} < {})".format(
-                    doc_id, len(main_abstract.split()), args.abstract_thresh
-                ))
-                continue 
-
-            all_abstracts_start_stop_indices = [None for _ in all_abstracts]
-            all_abstracts_found = [False for _ in all_abstracts]
-            all_abstracts_page = [None for _ in all_abstracts]
-
-            with open(doc_txt_path, 'r') as f:
-                curr_page = []
-                curr_page_num = 1
-
-                offset = 0
-
-                num_pages = count_num_pages(doc_txt_path)
-                pages_to_search = [1, 2, num_pages-1, num_pages] # we only look at the first two and last two pages
-
-                for i, line in enumerate(f):
-                    splits = line.split("\t")
-                    page_num = int(splits[-1].rstrip())
-
-                    if page_num != curr_page_num: # new page
-                        if curr_page_num in pages_to_search: 
-                            curr_text = " ".join([content[0] for content in curr_page])
-                            
-                            for lang_idx, abstract_text in enumerate(all_abstracts):
-                                abstract_start_stop_indices = find_abstract_span(
-                                    curr_text.lower(), abstract_text.lower(), args.max_l_dist
-                                )
-                                if abstract_start_stop_indices is not None:
-                                    all_abstracts_found[lang_idx] = True 
-                                    all_abstracts_start_stop_indices[lang_idx] = (
-                                        abstract_start_stop_indices[0] + offset,
-                                        abstract_start_stop_indices[1] + offset,
-                                    )
-                                    all_abstracts_page[lang_idx] = (curr_page_num, curr_page)
-                                
-                        if all(all_abstracts_found):
-                            break 
-                        else:
-                            curr_page = [splits]
-                            offset = i
-                            curr_page_num = page_num
-                    else:
-                        curr_page.append(splits)
-
-
-                if not all(all_abstracts_found): # abstract might be in the last page
-                    curr_text = " ".join([content[0] for content in curr_page])
-                    for lang_idx, abstract_text in enumerate(all_abstracts):
-                        abstract_start_stop_indices = find_abstract_span(
-                            curr_text.lower(), abstract_text.lower(), args.max_l_dist
-                        )
-                        if abstract_start_stop_indices is not None:
-                            all_abstracts_found[lang_idx] = True
-                            all_abstracts_start_stop_indices[lang_idx] = (
-                                abstract_start_stop_indices[0] + offset,
-                                abstract_start_stop_indices[1] + offset,
-                            )
-                            all_abstracts_page[lang_idx] = (curr_page_num, curr_page)
-
-            if all(all_abstracts_found):
-                _update_and_save_txt(doc_txt_path, doc_out_txt_path, all_abstracts_start_stop_indices)
-           
-                with open(args.found_output_log, "a") as f:
-                    f.write(doc_id + "\n")
-            else:
-                with open(args.failed_output_log, "a") as f:
-                    f.write(doc_id + "\n")
-
-    for doc_id in tqdm(remaining_files):
-        shutil.copyfile(
-            os.path.join(args.text_dir, doc_id + ".txt"), 
-            os.path.join(args.output_text_dir, doc_id + ".txt")
+        txt_fnames = [doc_fnames[doc_id] for doc_id in txt_fnames]
+
+    input_doc_ids = {os.path.splitext(fname)[0] for fname in txt_fnames}
+
+    # join the input files with the abstract file, in the order of the abstract file
+    abstract_index = get_abstract_index(args.abstract_path)
+    remaining_files = {doc_id for doc_id in input_doc_ids if doc_id not in abstract_index}
+    doc_fnames_with_abstract = [
+        doc_fnames[doc_id] for doc_id in abstract_index.ordered(input_doc_ids - remaining_files)
+    ]
+
+    worker = partial(remove_abstracts_from_document, args=args)
+    desc = f"Removing abstracts from TXTs in {args.text_dir}"
+    if args.num_workers > 1:
+        # imap keeps the order of the serial mode, the state store commits by batches
+        with Pool(args.num_workers) as pool:
+            for doc_id, status, reason in tqdm(
+                pool.imap(worker, doc_fnames_with_abstract, chunksize=args.chunksize), 
+                total=len(doc_fnames_with_abstract), 
+                desc=desc
+            ):
+                state_store.record(doc_id, status, reason=reason)
+            pool.close()
+            pool.join()
+    else:
+        for doc_id, status, reason in tqdm(
+            map(worker, doc_fnames_with_abstract), total=len(doc_fnames_with_abstract), desc=desc
+        ):
+            state_store.record(doc_id, status, reason=reason)
+
+    for doc_id in tqdm(sorted(remaining_files)):
+        copy_doc(
+            os.path.join(args.text_dir, doc_fnames[doc_id]), 
+            os.path.join(args.output_text_dir, doc_fnames[doc_id])
         )
+        img_tar = os.path.join(args.img_dir, doc_id + ".tar.gz") if args.img_dir is not None else None
+        if img_tar is not None and os.path.isfile(img_tar):
+            shutil.copyfile(img_tar, os.path.join(args.output_img_dir, doc_id + ".tar.gz"))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -282,7 +484,7 @@ if __name__ == "__main__":
         default=None,
         type=str,
         required=True,
-        help="The input data dir. Should contain the txt files.",
+        help="The input data dir. Should contain the txt (or tok) files.",
     )
     parser.add_argument(
         "--abstract_path",
@@ -294,6 +496,12 @@ if __name__ == "__main__":
         default=None,
         type=str,
     )
+    parser.add_argument(
+        "--img_first_page",
+        type=int,
+        default=1,
+        help="First page converted to an image (--first_page of convert_pdf_to_image)."
+    )
     parser.add_argument(
         "--output_text_dir",
         default=None,
@@ -326,14 +534,34 @@ if __name__ == "__main__":
         default=15,
     )
     parser.add_argument(
-        "--found_output_log",
+        "--match_cache",
         type=str,
-        default="./found_abstract.log"
+        default=None,
+        help="SQLite database caching abstract matching results across runs. Not used if not set."
+    )
+    parser.add_argument(
+        "--match_cache_size",
+        type=int,
+        default=MAX_ENTRIES,
+        help="Maximum number of entries in --match_cache, the least recently used being evicted."
+    )
+    parser.add_argument(
+        "--num_workers", 
+        type=int,
+        default=1,
+        help="Number of processes removing abstracts in parallel."
+    )
+    parser.add_argument(
+        "--chunksize", 
+        type=int,
+        default=8,
+        help="Number of documents sent to a worker at once."
     )
     parser.add_argument(
-        "--failed_output_log",
+        "--state_db",
         type=str,
-        default="./no_abstract.log"
+        default="./state.db",
+        help="SQLite database recording the status of each document."
     )
     parser.add_argument(
         "--resume_processing", 
@@ -345,23 +573,28 @@ if __name__ == "__main__":
         action="store_true", 
     )
 
+    metrics.add_metrics_args(parser)
+
     args = parser.parse_args()
 
+    metrics.enable(args.metrics_path, stage=STAGE, interval=args.metrics_interval)
+
     if args.resume_processing and args.overwrite_output_dir:
         raise ValueError(
             f"Cannot use --resume_conversion and --overwrite_output_dir at the same time."
         )
 
+    state_store = StateStore(args.state_db, stage=STAGE)
+
     if (
-        (os.listdir(args.output_text_dir) or os.listdir(args.output_img_dir)) 
+        (os.listdir(args.output_text_dir) or (args.img_dir is not None and os.listdir(args.output_img_dir))) 
         and not args.resume_processing
     ):
         if args.overwrite_output_dir:
             overwrite_dir_if_exists(args.output_text_dir)
             if args.img_dir is not None: 
                 overwrite_dir_if_exists(args.output_img_dir)
-            del_file_if_exists(args.found_output_log)
-            del_file_if_exists(args.failed_output_log)
+            state_store.clear()
         else:
             if os.listdir(args.output_text_dir):
                 raise ValueError(
@@ -373,4 +606,5 @@ if __name__ == "__main__":
                 )
             
 
-    find_and_remove(args)
\ No newline at end of file
+    with state_store:
+        find_and_remove(args, state_store)
\ No newline at end of file
@@ -1,14 +1,16 @@
 import argparse 
 import os
-import shutil
-import json 
 from datetime import datetime
 from tqdm import tqdm
+from src.abstract_index import get_abstract_index
+from src.token_format import copy_doc
 
 def split(args):
-    with open(args.abstract_file, 'r') as f:
-        lines = f.readlines()
-    docs = [json.loads(line) for line in lines]
+    # only keep the fields needed for splitting, abstracts are not held in memory
+    docs = [
+        {"id": doc_id, "publication_date": item["publication_date"]}
+        for doc_id, item in get_abstract_index(args.abstract_file).items()
+    ]
 
     docs_with_date = []
     docs_without_date = [] # Documents without a publication date will be put in the train set
@@ -43,17 +45,17 @@ def split(args):
     for doc in tqdm(train_docs, desc="Creating train split"):
         input_path = os.path.join(args.input_folder, doc["id"] + ".txt")
         output_path = os.path.join(train_folder, doc["id"] + ".txt")
-        shutil.move(input_path, output_path)
+        copy_doc(input_path, output_path, move=True)
 
     for doc in tqdm(val_docs, desc="Creating validation split"):
         input_path = os.path.join(args.input_folder, doc["id"] + ".txt")
         output_path = os.path.join(val_folder, doc["id"] + ".txt")
-        shutil.move(input_path, output_path)
+        copy_doc(input_path, output_path, move=True)
         
     for doc in tqdm(test_docs, desc="Creating test split"):
         input_path = os.path.join(args.input_folder, doc["id"] + ".txt")
         output_path = os.path.join(test_folder, doc["id"] + ".txt")
-        shutil.move(input_path, output_path)
+        copy_doc(input_path, output_path, move=True)
         
 
 if __name__ == "__main__":
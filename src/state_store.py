@@ -0,0 +1,269 @@
+import argparse
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from src import metrics
+
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+SCANNED = "scanned" # PDF without a text layer
+TIMEOUT = "timeout" # killed after the per-document time limit
+OOM = "oom" # ran out of the per-document memory limit
+
+
+class StateStore:
+    """ Per-document, per-stage processing status backed by SQLite
+
+    Replaces the per-stage .log files: every stage records the outcome of each
+    document (status and optional reason) and resumes through set lookups.
+    Writes are buffered and committed in batches. The database is opened in WAL
+    mode with a busy timeout, so several processes can record into the same
+    store concurrently (each process lazily opens its own connection).
+
+    Args:
+        db_path (string): Path to the SQLite database
+        stage (string): Default stage used by `record`, `get_ids` and `clear`
+        batch_size (int): Number of buffered records committed at once
+    """
+
+    def __init__(self, db_path, stage=None, batch_size=500):
+        self.db_path = db_path
+        self.stage = stage
+        self.batch_size = batch_size
+        self._buffer = []
+        self._outputs = []
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            if self._pid is not None and self._pid != os.getpid():
+                # forked: the connection, pending records and output files belong to the parent
+                self._buffer = []
+                self._outputs = []
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS doc_status ("
+                "stage TEXT NOT NULL, "
+                "doc_id TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "reason TEXT, "
+                "updated_at REAL NOT NULL, "
+                "PRIMARY KEY (stage, doc_id))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _stage(self, stage):
+        stage = stage or self.stage
+        if stage is None:
+            raise ValueError("No stage given and no default stage set.")
+        return stage
+
+    def record(self, doc_id, status, reason=None, stage=None):
+        """ Buffer the outcome of a document, committing once the batch is full """
+        if self._pid is not None and self._pid != os.getpid():
+            self._conn = None
+            self._pid = None
+            self._buffer = []
+            self._outputs = []
+        self._buffer.append((self._stage(stage), doc_id, status, reason, time.time()))
+        metrics.inc("documents_total", status=status, reason=reason or "")
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    @contextmanager
+    def open_output(self, path, mode="a"):
+        """ Open a file written along with the records, e.g. the abstracts of the documents
+            recorded as done. The file is written to disk before each commit, so that a
+            document is never recorded as done while its output is still buffered.
+        """
+        f = open(path, mode)
+        self._outputs.append(f)
+        try:
+            yield f
+        finally:
+            self._outputs.remove(f)
+            _sync(f)
+            f.close()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        conn = self.conn
+        for f in self._outputs:
+            _sync(f)
+        conn.executemany(
+            "INSERT OR REPLACE INTO doc_status (stage, doc_id, status, reason, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            self._buffer,
+        )
+        conn.commit()
+        self._buffer = []
+
+    def get_ids(self, stage=None, statuses=None):
+        """ Get IDs of documents recorded for a stage
+
+        Args:
+            stage (string): Stage name, defaults to the store's stage
+            statuses (list): Only return documents with one of these statuses.
+                             All recorded documents are returned if None.
+
+        Returns:
+            set: Document IDs
+        """
+        self.flush()
+        query = "SELECT doc_id FROM doc_status WHERE stage = ?"
+        params = [self._stage(stage)]
+        if statuses is not None:
+            statuses = list(statuses)
+            query += " AND status IN ({})".format(",".join("?" * len(statuses)))
+            params += statuses
+        return {row[0] for row in self.conn.execute(query, params)}
+
+    def get_status(self, doc_id, stage=None):
+        self.flush()
+        row = self.conn.execute(
+            "SELECT status, reason FROM doc_status WHERE stage = ? AND doc_id = ?",
+            (self._stage(stage), doc_id),
+        ).fetchone()
+        return row
+
+    def count(self, stage=None):
+        self.flush()
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM doc_status WHERE stage = ?", (self._stage(stage),)
+        ).fetchone()[0]
+
+    def summary(self, stage=None):
+        """ Count documents per (status, reason) for a stage """
+        self.flush()
+        rows = self.conn.execute(
+            "SELECT status, reason, COUNT(*) FROM doc_status WHERE stage = ? "
+            "GROUP BY status, reason ORDER BY status, reason",
+            (self._stage(stage),),
+        )
+        return rows.fetchall()
+
+    def clear(self, stage=None):
+        """ Delete every record of a stage (used with --overwrite_output_dir) """
+        self._buffer = []
+        stage = self._stage(stage)
+        if not os.path.isfile(self.db_path):
+            return
+        print(f"Clearing stage '{stage}' in {self.db_path}")
+        self.conn.execute("DELETE FROM doc_status WHERE stage = ?", (stage,))
+        self.conn.commit()
+
+    def close(self):
+        if self._pid is None or self._pid == os.getpid():
+            self.flush()
+            if self._conn is not None:
+                self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # the store is pickled when handed to worker processes; connections are reopened there
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        state["_buffer"] = []
+        state["_outputs"] = []
+        return state
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def import_log(store, log_path, status, reason=None, stage=None):
+    """ Import IDs from a legacy .log file (one ID per line, optionally prefixed by
+        a tab-separated index) into the store
+    """
+    num_imported = 0
+    with open(log_path, "r") as f:
+        for line in f:
+            doc_id = line.rstrip("\n").split("\t")[-1]
+            if doc_id:
+                store.record(doc_id, status, reason=reason, stage=stage)
+                num_imported += 1
+    store.flush()
+    return num_imported
+
+
+def export_log(store, log_path, statuses=None, stage=None):
+    """ Write IDs recorded for a stage to a .log file, one ID per line """
+    doc_ids = sorted(store.get_ids(stage, statuses))
+    with open(log_path, "w") as f:
+        for doc_id in doc_ids:
+            f.write(doc_id + "\n")
+    return len(doc_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--state_db",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--stage",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--import_log",
+        type=str,
+        default=None,
+        help="Import IDs from a legacy .log file with status --status."
+    )
+    parser.add_argument(
+        "--export_log",
+        type=str,
+        default=None,
+        help="Export IDs with status --status (every status if not set) to a .log file."
+    )
+    parser.add_argument(
+        "--status",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--reason",
+        type=str,
+        default=None,
+    )
+
+    args = parser.parse_args()
+
+    with StateStore(args.state_db, stage=args.stage) as store:
+        if args.import_log is not None:
+            if args.status is None:
+                raise ValueError("--status is required with --import_log.")
+            n = import_log(store, args.import_log, args.status, reason=args.reason)
+            print(f"Imported {n} IDs from {args.import_log} into stage '{args.stage}'")
+        if args.export_log is not None:
+            statuses = [args.status] if args.status is not None else None
+            n = export_log(store, args.export_log, statuses=statuses)
+            print(f"Exported {n} IDs from stage '{args.stage}' to {args.export_log}")
+
+        print(f"Stage '{args.stage}' in {args.state_db}:")
+        for status, reason, n in store.summary():
+            print(f"\t{status}" + (f" ({reason})" if reason else "") + f": {n}")
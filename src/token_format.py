@@ -0,0 +1,600 @@
+import argparse
+import json
+import os
+import shutil
+import struct
+import numpy as np
+from tqdm import tqdm
+
+
+TXT_EXT = ".txt"
+TOK_EXT = ".tok"
+PAGE_INDEX_EXT = ".pages"
+
+MAGIC = b"LRLTOK02"
+MAGIC_V1 = b"LRLTOK01" # without the PDF page numbers
+# magic, number of words, number of pages, bbox item size (2 or 4 bytes), length of the word blob
+HEADER = struct.Struct("<8sIIII")
+ALIGN = 8
+NEWLINE = ord("\n")
+TAB = ord("\t")
+
+
+def _pdf_page_num(pdf_pages, page_num):
+    if pdf_pages is None or page_num > len(pdf_pages):
+        return page_num # parsed before PDF page numbers were recorded
+    return int(pdf_pages[page_num - 1])
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def line_offsets(data):
+    """ Byte offset of each line of `data`, followed by its length """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.flatnonzero(buffer == NEWLINE) + 1
+    if len(data) and data[-1] != NEWLINE: # last line without a newline
+        line_ends = np.append(line_ends, len(data))
+    return np.concatenate([[0], line_ends]).astype(np.int64)
+
+
+class TokenDoc:
+    """ Columnar representation of a parsed document
+
+    Binary layout of a `.tok` file (little-endian, every section aligned to 8 bytes):
+        header          see HEADER
+        page_dims       int32 [num_pages, 2]   (page width, page height)
+        pdf_pages       int32 [num_pages]      (PDF page number of each page, not in LRLTOK01 files)
+        bboxes          int16|int32 [num_words, 4]
+        page_idx        int16 [num_words]      (0-based page index of each word)
+        word_offsets    uint32 [num_words + 1] (offsets of each word in the blob)
+        blob            utf-8 encoded words
+
+    Files are read through `np.memmap` without any parsing; words are only decoded
+    when accessed.
+
+    Args:
+        words (list): Words of the document
+        bboxes (np.ndarray): Bounding boxes of the words, shape (num_words, 4)
+        page_idx (np.ndarray): 0-based page index of each word
+        page_dims (np.ndarray): Width and height of each page, shape (num_pages, 2)
+        pdf_pages (np.ndarray): PDF page number of each page, None if unknown (pages are then
+                                assumed to be numbered as in the PDF)
+    """
+
+    def __init__(self, words, bboxes, page_idx, page_dims, pdf_pages=None):
+        self._words = words
+        self._blob = None
+        self._word_offsets = None
+        self.bboxes = bboxes
+        self.page_idx = page_idx
+        self.page_dims = page_dims
+        self.pdf_pages = pdf_pages
+
+    @property
+    def num_words(self):
+        return len(self.page_idx)
+
+    @property
+    def num_pages(self):
+        return len(self.page_dims)
+
+    @property
+    def words(self):
+        if self._words is None:
+            blob, offsets = self._blob, self._word_offsets
+            self._words = [
+                blob[offsets[i]: offsets[i + 1]].decode("utf-8") for i in range(self.num_words)
+            ]
+        return self._words
+
+    def words_between(self, start, stop):
+        """ Words `start` to `stop`, decoding only these if the words were not accessed yet """
+        if self._words is not None:
+            return self._words[start: stop]
+        blob, offsets = self._blob, self._word_offsets
+        return [blob[offsets[i]: offsets[i + 1]].decode("utf-8") for i in range(start, stop)]
+
+    def pdf_page_num(self, page_num):
+        """ PDF page number of page `page_num` (1-based) """
+        return _pdf_page_num(self.pdf_pages, page_num)
+
+    @classmethod
+    def from_pages(cls, doc, pdf_pages=None):
+        """ Build from the output of `parse_html.extract_text_from_tree`
+            (list of pages, each a list of (word, xmin, ymin, xmax, ymax, page_width, page_height),
+            and the PDF page number of each page)
+        """
+        words = [elem[0] for page in doc for elem in page]
+        bboxes = np.array(
+            [elem[1:5] for page in doc for elem in page], dtype=np.int32
+        ).reshape(-1, 4)
+        page_idx = np.repeat(
+            np.arange(len(doc), dtype=np.int16), [len(page) for page in doc]
+        )
+        page_dims = np.array(
+            [page[0][5:7] if page else (0, 0) for page in doc], dtype=np.int32
+        ).reshape(-1, 2)
+        if pdf_pages is not None:
+            pdf_pages = np.array(pdf_pages, dtype=np.int32)
+        return cls(words, bboxes, page_idx, page_dims, pdf_pages)
+
+    @classmethod
+    def from_txt(cls, path):
+        """ Read a tab-separated token file written by `parse_html`, and the PDF page numbers
+            of its page index if it is valid
+        """
+        words = []
+        bboxes = []
+        page_numbers = []
+        page_dims = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                content = line.rstrip("\n").split("\t")
+                page_number = int(content[-1])
+                words.append(content[0])
+                bboxes.append([int(b) for b in content[1:5]])
+                page_numbers.append(page_number)
+                page_dims[page_number] = (int(content[5]), int(content[6]))
+
+        num_pages = max(page_dims) if page_dims else 0
+        # pages whose words have all been removed have no known dimensions
+        dims = np.zeros((num_pages, 2), dtype=np.int32)
+        for page_number, dim in page_dims.items():
+            dims[page_number - 1] = dim
+
+        index = PageIndex.load(path)
+        pdf_pages = None
+        if index is not None and index.pdf_pages is not None and len(index.pdf_pages) >= num_pages:
+            pdf_pages = np.array(index.pdf_pages[:num_pages], dtype=np.int32)
+
+        return cls(
+            words,
+            np.array(bboxes, dtype=np.int32).reshape(-1, 4),
+            np.array(page_numbers, dtype=np.int16) - 1,
+            dims,
+            pdf_pages,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """ Map a `.tok` file into memory """
+        buf = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, num_words, num_pages, bbox_size, blob_len = HEADER.unpack(bytes(buf[:HEADER.size]))
+        if magic not in (MAGIC, MAGIC_V1):
+            raise ValueError(f"{path} is not a token file.")
+
+        def section(offset, dtype, count):
+            nbytes = count * np.dtype(dtype).itemsize
+            return buf[offset: offset + nbytes].view(dtype), _aligned(offset + nbytes)
+
+        offset = _aligned(HEADER.size)
+        page_dims, offset = section(offset, np.int32, num_pages * 2)
+        pdf_pages = None
+        if magic == MAGIC:
+            pdf_pages, offset = section(offset, np.int32, num_pages)
+        bboxes, offset = section(offset, np.int16 if bbox_size == 2 else np.int32, num_words * 4)
+        page_idx, offset = section(offset, np.int16, num_words)
+        word_offsets, offset = section(offset, np.uint32, num_words + 1)
+
+        doc = cls(None, bboxes.reshape(-1, 4), page_idx, page_dims.reshape(-1, 2), pdf_pages)
+        doc._blob = buf[offset: offset + blob_len].tobytes()
+        doc._word_offsets = word_offsets
+        return doc
+
+    def save(self, path):
+        """ Write the document as a `.tok` file """
+        encoded = [word.encode("utf-8") for word in self.words]
+        word_offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+        np.cumsum([len(w) for w in encoded], out=word_offsets[1:])
+        blob = b"".join(encoded)
+
+        bboxes = np.asarray(self.bboxes)
+        bbox_dtype = np.int16 if bboxes.size == 0 or (
+            bboxes.min() >= np.iinfo(np.int16).min and bboxes.max() <= np.iinfo(np.int16).max
+        ) else np.int32
+
+        sections = [
+            np.ascontiguousarray(self.page_dims, dtype=np.int32),
+            np.ascontiguousarray(self.pdf_page_numbers(), dtype=np.int32),
+            np.ascontiguousarray(bboxes, dtype=bbox_dtype),
+            np.ascontiguousarray(self.page_idx, dtype=np.int16),
+            word_offsets,
+        ]
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(
+                MAGIC, self.num_words, self.num_pages, np.dtype(bbox_dtype).itemsize, len(blob)
+            ))
+            for data in sections + [blob]:
+                f.write(b"\0" * (_aligned(f.tell()) - f.tell()))
+                f.write(data.tobytes() if isinstance(data, np.ndarray) else data)
+
+    def pdf_page_numbers(self):
+        """ PDF page number of every page """
+        if self.pdf_pages is None:
+            return np.arange(1, self.num_pages + 1, dtype=np.int32)
+        return np.asarray(self.pdf_pages)
+
+    def save_txt(self, path):
+        """ Write the document in the tab-separated format, one word per line """
+        page_dims = self.page_dims.tolist()
+        pdf_pages = self.pdf_pages.tolist() if self.pdf_pages is not None else None
+        with TxtWriter(path, pdf_pages) as writer:
+            for word, bbox, page in zip(self.words, self.bboxes.tolist(), self.page_idx.tolist()):
+                page_width, page_height = page_dims[page]
+                writer.write(
+                    "\t".join([word] + [str(b) for b in bbox] + [str(page_width), str(page_height), str(page + 1)]) + "\n",
+                    page + 1
+                )
+
+    @property
+    def last_page_num(self):
+        """ Page number of the last word, as `count_pages` """
+        return int(self.page_idx[-1]) + 1 if len(self.page_idx) else 0
+
+    def iter_pages(self, page_numbers=None):
+        """ See `iter_page_lines` """
+        page_dims = self.page_dims.tolist()
+        for page in np.unique(self.page_idx).tolist():
+            if page_numbers is not None and page + 1 not in page_numbers:
+                continue
+            start, stop = np.searchsorted(self.page_idx, [page, page + 1]).tolist()
+            lines = [
+                _token_line(word, bbox, page_dims, page)
+                for word, bbox in zip(self.words_between(start, stop), self.bboxes[start: stop].tolist())
+            ]
+            yield page + 1, lines, start
+
+    def select(self, mask):
+        """ Keep the words where `mask` is True """
+        mask = np.asarray(mask, dtype=bool)
+        words = [word for word, keep in zip(self.words, mask) if keep]
+        return TokenDoc(words, self.bboxes[mask], self.page_idx[mask], self.page_dims, self.pdf_pages)
+
+    def to_doc_content(self):
+        """ Same structure as `utils.get_doc_content` on a .txt file """
+        page_dims = [[str(w), str(h)] for w, h in self.page_dims.tolist()]
+        return [
+            [word, [str(b) for b in bbox], page_dims[page][0], page_dims[page][1], str(page + 1)]
+            for word, bbox, page in zip(self.words, self.bboxes.tolist(), self.page_idx.tolist())
+        ]
+
+
+class PageIndex:
+    """ Byte offset and number of words of each page of a .txt token file
+
+    Stored as JSON next to the token file (`<doc>.txt.pages`), so that pages can be 
+    read by seeking instead of scanning the whole file. The index is ignored if the
+    size of the token file does not match.
+
+    Args:
+        page_numbers (list): Page numbers, in file order
+        offsets (list): Byte offset of the first line of each page, followed by the file size
+        num_words (list): Number of words (lines) of each page
+        pdf_pages (list): PDF page number of every page of the parsed document (pages whose
+                          words have all been removed included), None if unknown
+    """
+
+    def __init__(self, page_numbers, offsets, num_words, pdf_pages=None):
+        self.page_numbers = page_numbers
+        self.offsets = offsets
+        self.num_words = num_words
+        self.pdf_pages = pdf_pages
+
+    @property
+    def num_pages(self):
+        """ Page number of the last page, as in the last line of the token file """
+        return self.page_numbers[-1] if self.page_numbers else 0
+
+    @classmethod
+    def build(cls, path):
+        """ Scan a .txt token file """
+        with open(path, "rb") as f:
+            data = f.read()
+        return cls.from_bytes(data, line_offsets(data))
+
+    @classmethod
+    def from_bytes(cls, data, line_offsets):
+        """ Index of the content of a .txt token file, given the byte offsets of its lines """
+        if len(line_offsets) < 2:
+            return cls([], [0], [])
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        line_ends = line_offsets[1:] - (buffer[line_offsets[1:] - 1] == NEWLINE)
+        tabs = np.flatnonzero(buffer == TAB)
+        # the page number is the last field of each line
+        field_starts = tabs[np.searchsorted(tabs, line_ends) - 1] + 1
+        field_lengths = line_ends - field_starts
+        page_nums = np.zeros(len(line_ends), dtype=np.int64)
+        for i in range(int(field_lengths.max())):
+            has_digit = field_lengths > i
+            page_nums[has_digit] = page_nums[has_digit] * 10 + buffer[field_starts[has_digit] + i] - ord("0")
+
+        page_starts = np.flatnonzero(np.diff(page_nums, prepend=page_nums[0] - 1))
+        return cls(
+            page_nums[page_starts].tolist(), 
+            line_offsets[page_starts].tolist() + [len(data)], 
+            np.diff(page_starts, append=len(page_nums)).tolist()
+        )
+
+    def _add_line(self, page_num, offset):
+        if not self.page_numbers or self.page_numbers[-1] != page_num:
+            self.page_numbers.append(page_num)
+            self.offsets.append(offset)
+            self.num_words.append(0)
+        self.num_words[-1] += 1
+
+    @classmethod
+    def load(cls, path):
+        """ Load the index of a .txt token file, or return None if it is missing or outdated """
+        try:
+            with open(path + PAGE_INDEX_EXT, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index["offsets"][-1] != os.path.getsize(path):
+            return None
+        return cls(index["page_numbers"], index["offsets"], index["num_words"], index.get("pdf_pages"))
+
+    def save(self, path):
+        """ Write the index of the token file `path` """
+        index = {"page_numbers": self.page_numbers, "offsets": self.offsets, "num_words": self.num_words}
+        if self.pdf_pages is not None:
+            index["pdf_pages"] = self.pdf_pages
+        with open(path + PAGE_INDEX_EXT, "w") as f:
+            json.dump(index, f)
+
+
+class TxtDoc:
+    """ .txt token file read at once: its content, the byte offset of each line and its page index
+
+    Lines are only decoded for the pages that are accessed, and selecting lines copies 
+    contiguous runs of bytes.
+
+    Args:
+        data (bytes): Content of the file
+        line_offsets (np.ndarray): Byte offset of each line, followed by the size of the file
+        page_index (PageIndex): Pages of the file
+    """
+
+    def __init__(self, data, line_offsets, page_index):
+        self.data = data
+        self.line_offsets = line_offsets
+        self.page_index = page_index
+
+    @classmethod
+    def load(cls, path):
+        """ Read a .txt token file with a single read, using its page index if it is valid """
+        with open(path, "rb") as f:
+            data = f.read()
+        offsets = line_offsets(data)
+        page_index = PageIndex.load(path) # checked against the size of the file
+        if page_index is None:
+            page_index = PageIndex.from_bytes(data, offsets)
+        return cls(data, offsets, page_index)
+
+    @property
+    def num_words(self):
+        return len(self.line_offsets) - 1
+
+    @property
+    def last_page_num(self):
+        """ Page number of the last word, as `count_pages` """
+        return self.page_index.num_pages
+
+    def pdf_page_num(self, page_num):
+        """ PDF page number of page `page_num` (1-based) """
+        return _pdf_page_num(self.page_index.pdf_pages, page_num)
+
+    def iter_pages(self, page_numbers=None):
+        """ See `iter_page_lines` """
+        index = self.page_index
+        words_before = np.cumsum([0] + index.num_words).tolist()
+        for i, page_num in enumerate(index.page_numbers):
+            if page_numbers is not None and page_num not in page_numbers:
+                continue
+            page_data = self.data[index.offsets[i]: index.offsets[i + 1]].decode("utf-8")
+            lines = [(line + "\n").split("\t") for line in page_data.split("\n")[:-1]]
+            yield page_num, lines, words_before[i]
+
+    def select(self, mask):
+        """ Keep the lines where `mask` is True """
+        mask = np.asarray(mask, dtype=bool)
+        # runs of kept lines
+        bounds = np.flatnonzero(np.diff(mask, prepend=False, append=False))
+        offsets = self.line_offsets
+        data = b"".join(
+            self.data[offsets[start]: offsets[stop]] for start, stop in zip(bounds[::2], bounds[1::2])
+        )
+        new_offsets = np.concatenate([[0], np.cumsum(np.diff(offsets)[mask])]).astype(np.int64)
+
+        index = self.page_index
+        page_starts = np.cumsum([0] + index.num_words)[:-1].astype(np.int64)
+        kept_before = np.concatenate([[0], np.cumsum(mask)]).astype(np.int64)
+        num_words = np.diff(kept_before[np.append(page_starts, self.num_words)])
+        non_empty = num_words > 0
+        page_index = PageIndex(
+            np.asarray(index.page_numbers, dtype=np.int64)[non_empty].tolist(),
+            new_offsets[kept_before[page_starts]][non_empty].tolist() + [len(data)],
+            num_words[non_empty].tolist(),
+            index.pdf_pages
+        )
+        return TxtDoc(data, new_offsets, page_index)
+
+    def save(self, path):
+        """ Write the lines with a single write, along with the page index """
+        with open(path, "wb") as f:
+            f.write(self.data)
+        self.page_index.save(path)
+
+
+class TxtWriter:
+    """ Write a .txt token file line by line, together with its page index
+
+    Args:
+        path (string): Path to the token file
+        pdf_pages (list): PDF page number of each page, recorded in the page index
+    """
+
+    def __init__(self, path, pdf_pages=None):
+        self.path = path
+        self.file = open(path, "wb")
+        self.index = PageIndex([], [], [], pdf_pages)
+        self.offset = 0
+
+    def write(self, line, page_num):
+        """ Write a line (ending with a newline) of page `page_num` """
+        data = line.encode("utf-8")
+        self.index._add_line(page_num, self.offset)
+        self.file.write(data)
+        self.offset += len(data)
+
+    def close(self):
+        self.file.close()
+        self.index.offsets.append(self.offset)
+        self.index.save(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def copy_doc(input_path, output_path, move=False):
+    """ Copy (or move) a token file along with its page index, if any """
+    transfer = shutil.move if move else shutil.copyfile
+    transfer(input_path, output_path)
+    if os.path.isfile(input_path + PAGE_INDEX_EXT):
+        transfer(input_path + PAGE_INDEX_EXT, output_path + PAGE_INDEX_EXT)
+
+
+def load_doc(path):
+    """ Load a parsed document from either a .txt or a .tok file """
+    if path.endswith(TOK_EXT):
+        return TokenDoc.load(path)
+    return TokenDoc.from_txt(path)
+
+
+def _token_line(word, bbox, page_dims, page):
+    return [word] + [str(b) for b in bbox] + [str(d) for d in page_dims[page]] + [str(page + 1) + "\n"]
+
+
+def iter_page_lines(path, page_numbers=None):
+    """ Yield the pages of a .txt or .tok file as (page number, lines, number of words 
+        before the page), each line being split as in `iter_token_lines`. If `page_numbers`
+        is given, only these pages are read: .tok files are sliced, and .txt files are read
+        by seeking to the offsets of their page index.
+    """
+    if page_numbers is not None:
+        page_numbers = set(page_numbers)
+
+    if path.endswith(TOK_EXT):
+        yield from TokenDoc.load(path).iter_pages(page_numbers)
+        return
+
+    index = PageIndex.load(path) if page_numbers is not None else None
+    if index is None: # read every page
+        page_num, lines, num_words = None, [], 0
+        for splits in iter_token_lines(path):
+            line_page_num = int(splits[-1])
+            if line_page_num != page_num and lines:
+                if page_numbers is None or page_num in page_numbers:
+                    yield page_num, lines, num_words
+                num_words += len(lines)
+                lines = []
+            page_num = line_page_num
+            lines.append(splits)
+        if lines and (page_numbers is None or page_num in page_numbers):
+            yield page_num, lines, num_words
+        return
+
+    words_before = np.cumsum([0] + index.num_words).tolist()
+    with open(path, "rb") as f:
+        for i, page_num in enumerate(index.page_numbers):
+            if page_num not in page_numbers:
+                continue
+            f.seek(index.offsets[i])
+            data = f.read(index.offsets[i + 1] - index.offsets[i]).decode("utf-8")
+            lines = [(line + "\n").split("\t") for line in data.split("\n")[:-1]]
+            yield page_num, lines, words_before[i]
+
+
+def iter_token_lines(path):
+    """ Yield the tab-separated fields of each word of a .txt or .tok file, as
+        `line.split("\t")` would return them on a .txt file
+    """
+    if path.endswith(TOK_EXT):
+        doc = TokenDoc.load(path)
+        page_dims = doc.page_dims.tolist()
+        for word, bbox, page in zip(doc.words, doc.bboxes.tolist(), doc.page_idx.tolist()):
+            yield _token_line(word, bbox, page_dims, page)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield line.split("\t")
+
+
+def count_pages(path):
+    """ Page number of the last word of a parsed document """
+    if path.endswith(TOK_EXT):
+        return TokenDoc.load(path).last_page_num
+    index = PageIndex.load(path)
+    if index is not None:
+        return index.num_pages
+    with open(path, "rb") as f:
+        last_line = None
+        for last_line in f:
+            pass
+    return int(last_line.decode("utf-8").split("\t")[-1]) if last_line else 0
+
+
+def count_words(path):
+    """ Number of words of a parsed document, read from the header for .tok files """
+    if path.endswith(TOK_EXT):
+        with open(path, "rb") as f:
+            return HEADER.unpack(f.read(HEADER.size))[1]
+    index = PageIndex.load(path)
+    if index is not None:
+        return sum(index.num_words)
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def convert(args):
+    in_ext, out_ext = (TOK_EXT, TXT_EXT) if args.to_txt else (TXT_EXT, TOK_EXT)
+    fnames = sorted(fname for fname in os.listdir(args.input_dir) if fname.endswith(in_ext))
+
+    for fname in tqdm(fnames, desc=f"Converting {in_ext} files in {args.input_dir} to {out_ext}"):
+        doc = load_doc(os.path.join(args.input_dir, fname))
+        output_path = os.path.join(args.output_dir, fname[:-len(in_ext)] + out_ext)
+        if args.to_txt:
+            doc.save_txt(output_path)
+        else:
+            doc.save(output_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--input_dir",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--to_txt",
+        action="store_true",
+        help="Convert .tok files back to .txt files."
+    )
+
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    convert(args)
@@ -1,8 +1,12 @@
 import json
+import re
 import os 
 import tarfile
 import shutil
-import subprocess
+from itertools import islice
+from src.abstract_index import get_abstract_index
+from src.token_format import TokenDoc, TOK_EXT
+from src.downloader import get_downloader
 
 def del_file_if_exists(path_to_file):
     if os.path.isfile(path_to_file):
@@ -16,67 +20,96 @@ def overwrite_dir_if_exists(path_to_dir):
         os.makedirs(path_to_dir)
 
 
-def get_ids_from_arxiv_or_pubmed(input_file, limit):
+# article_id is the first key of each line of the arXiv/PubMed files
+ARTICLE_ID_PREFIX = re.compile(rb'^\{\s*"article_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+IDS_SIDECAR_EXT = ".ids"
+
+def _parse_article_id(line):
+    m = ARTICLE_ID_PREFIX.match(line)
+    if m is None: # unexpected layout, decode the whole line
+        return json.loads(line)["article_id"]
+    article_id = m.group(1)
+    if b"\\" in article_id:
+        return json.loads(b'"' + article_id + b'"')
+    return article_id.decode("utf-8")
+
+def get_ids_from_arxiv_or_pubmed(input_file, limit=None):
+    """ Lazily yield article IDs from an arXiv/PubMed data file
+
+    Only the `article_id` prefix of each line is parsed, and reading stops once `limit`
+    IDs have been yielded. When the whole file is read, the IDs are persisted to a
+    sidecar file (`<input_file>.ids`) that is read instead of the data file on later
+    calls, as long as the data file is unchanged.
+
+    Args:
+        input_file (string): Path to the JSONL data file
+        limit (int): Maximum number of IDs to yield, None or negative to yield every ID
+
+    Yields:
+        string: Article ID
+    """
+    if limit is not None and limit < 0:
+        limit = None
+    sidecar_path = input_file + IDS_SIDECAR_EXT
+    stat = os.stat(input_file)
+    signature = json.dumps({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+
+    if os.path.isfile(sidecar_path):
+        with open(sidecar_path, "r") as f:
+            if f.readline().rstrip("\n") == signature:
+                for line in islice(f, limit):
+                    yield line.rstrip("\n")
+                return
+
     id_list = []
-    num_processed = 0
-    with open(input_file, "r") as f:
+    with open(input_file, "rb") as f:
         for line in f:
-            item = json.loads(line)
-            id_list.append(item["article_id"])
-            num_processed += 1
-            if num_processed == limit:
-                break
-    
-    return id_list
-
-def extract_pdf(url, output_path):
+            if not line.strip():
+                continue
+            if len(id_list) == limit:
+                return # part of the file only, no sidecar
+            article_id = _parse_article_id(line)
+            id_list.append(article_id)
+            yield article_id
+
+    tmp_path = sidecar_path + ".tmp"
+    with open(tmp_path, "w") as fw:
+        fw.write(signature + "\n")
+        fw.write("".join(article_id + "\n" for article_id in id_list))
+    os.replace(tmp_path, sidecar_path)
+
+def extract_pdf(url, output_path, downloader=None):
     """ Extract PDF based on URL
 
     Args:
         url (string): link to PDF 
         output_path (string): Path to output PDF file
+        downloader (Downloader): Download engine to use, defaults to a shared one
 
     Returns:
         bool: True if extraction was successful, False otherwise
     """
-    # command = f"wget -w 3 --random-wait -q -O {output_path} {url}"
-    command = f"wget -w 3 --random-wait -O {output_path} '{url}'"
-    subprocess.call(command, shell=True)
-    
-    if os.path.exists(output_path):
-        return True
-    return False 
-
-def remove_processed_from_id_list(id_list, processed_log, failed_log=None):
+    downloader = downloader or get_downloader()
+    return downloader.download(url, output_path)
+
+def remove_processed_from_id_list(id_list, state_store, statuses=None, stage=None):
     """ Remove already processed documents and documents that could not be processed
         from list
 
     Args:
         id_list (list): List of document IDs
-        processed_log (string): Path to log containing IDs of processed documents
-        failed_log (string): Path to log containing IDs of documents that could 
-                             not be processed
+        state_store (StateStore): Store containing the status of processed documents
+        statuses (list): Only remove documents recorded with one of these statuses.
+                         Every recorded document is removed if None.
+        stage (string): Stage to look up, defaults to the store's stage
 
     Returns:
         list: List of document IDs whose PDF and abstract have not been processed yet
     """
-    if failed_log and os.path.isfile(failed_log):
-        with open(failed_log, "r") as f:
-            failed_to_process = f.read().splitlines()
-    else:
-        failed_to_process = []
-
-    if os.path.isfile(processed_log):
-        with open(processed_log, "r") as f:
-            processed = f.read().splitlines()
-    else:
-        processed = []
-
+    processed = state_store.get_ids(stage=stage, statuses=statuses)
     id_list = [
-        doc_id for doc_id in id_list if (
-            doc_id not in failed_to_process and doc_id not in processed
-        )
-    ] # remove ids whose articles could not be processed or whose have already been processed
+        doc_id for doc_id in id_list if doc_id not in processed
+    ] # remove ids whose articles could not be processed or whose have already been processed
     return id_list
 
 
@@ -88,6 +121,9 @@ def compress_dir(tar_path, output_folder):
         ) 
 
 def get_doc_content(doc_path):
+    if doc_path.endswith(TOK_EXT):
+        return TokenDoc.load(doc_path).to_doc_content()
+
     doc_content = []
     with open(doc_path, 'r') as f:
         for line in f:
@@ -101,10 +137,8 @@ def get_doc_content(doc_path):
     return doc_content
 
 def get_abstract(abstract_path, doc_id):
-    with open(abstract_path, "r", encoding="utf-8") as f:
-        for line in f:
-            item = json.loads(line)
-            if item["id"] == doc_id:
-                return item["abstract"] 
-    
+    item = get_abstract_index(abstract_path).get(doc_id)
+    if item is not None:
+        return item["abstract"]
+
     return None
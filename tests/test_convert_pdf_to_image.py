@@ -0,0 +1,52 @@
+import argparse
+import os
+import pytest
+from PIL import Image
+from src import convert_pdf_to_image
+from src.state_store import StateStore, DONE, FAILED, OOM
+
+
+NUM_PAGES = 3
+
+
+@pytest.fixture
+def rendered_pages(monkeypatch):
+    """ Stands in for pdftoppm (not installed in every environment): renders `rendered_pages[0]`
+        of the NUM_PAGES pages, as pdf2image does when pdftoppm dies
+    """
+    rendered = [NUM_PAGES]
+    monkeypatch.setattr(convert_pdf_to_image, "pdfinfo_from_path", lambda pdf_path: {"Pages": NUM_PAGES})
+    monkeypatch.setattr(
+        convert_pdf_to_image,
+        "convert_from_path",
+        lambda pdf_path, dpi: [Image.new("RGB", (20, 10), "white") for _ in range(rendered[0])]
+    )
+    return rendered
+
+
+def _convert(tmp_path, **kwargs):
+    input_dir = tmp_path / "pdf"
+    output_dir = tmp_path / "img"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    (input_dir / "doc.pdf").write_bytes(b"%PDF-1.4\n")
+    args = argparse.Namespace(
+        input_dir=str(input_dir), output_dir=str(output_dir), first_page=1, n_docs=-1, dpi=100,
+        pdf_catalog=None, timeout=-1, max_memory=-1, dedup=False, resume=False
+    )
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    with StateStore(str(tmp_path / "state.db"), stage=convert_pdf_to_image.STAGE) as state_store:
+        convert_pdf_to_image.convert(args, state_store)
+        return state_store.get_status("doc"), sorted(os.listdir(output_dir))
+
+
+@pytest.mark.parametrize("max_memory", [-1, 1024])
+def test_all_pages_rendered(tmp_path, rendered_pages, max_memory):
+    assert _convert(tmp_path, max_memory=max_memory) == ((DONE, None), ["doc.tar.gz"])
+
+
+@pytest.mark.parametrize("max_memory, status", [(-1, (FAILED, "incomplete_rendering")), (1024, (OOM, "pdf2image"))])
+def test_missing_pages_fail_the_document(tmp_path, rendered_pages, max_memory, status):
+    rendered_pages[0] = NUM_PAGES - 1
+    assert _convert(tmp_path, max_memory=max_memory) == (status, [])
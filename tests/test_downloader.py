@@ -0,0 +1,118 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from src.downloader import Downloader
+
+
+PDF_CONTENT = b"%PDF-1.4\n" + b"x" * 100000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Serves:
+        /ok.pdf: the file
+        /flaky.pdf: 503 for the first `fails` requests, then the file
+        /missing.pdf: 404
+        /truncated.pdf: announces the full file, sends half of it and closes the connection
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_file(self, content, length=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(length if length is not None else len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] = server.requests.get(self.path, 0) + 1
+            num_requests = server.requests[self.path]
+        if self.path == "/ok.pdf":
+            self._send_file(PDF_CONTENT)
+        elif self.path == "/flaky.pdf":
+            if num_requests <= server.fails:
+                self.send_error(503)
+            else:
+                self._send_file(PDF_CONTENT)
+        elif self.path == "/truncated.pdf":
+            self._send_file(PDF_CONTENT[:len(PDF_CONTENT) // 2], length=len(PDF_CONTENT))
+            self.close_connection = True
+        else:
+            self.send_error(404)
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = {}
+    server.fails = 2
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def downloader():
+    with Downloader(num_workers=4, max_retries=3, backoff_factor=0, timeout=10) as downloader:
+        yield downloader
+
+
+def test_download_renames_complete_file(http_server, downloader, tmp_path):
+    output_path = str(tmp_path / "ok.pdf")
+    assert downloader.download(http_server.url + "/ok.pdf", output_path)
+    with open(output_path, "rb") as f:
+        assert f.read() == PDF_CONTENT
+    assert os.listdir(tmp_path) == ["ok.pdf"]
+
+
+def test_download_retries_server_errors(http_server, downloader, tmp_path):
+    output_path = str(tmp_path / "flaky.pdf")
+    assert downloader.download(http_server.url + "/flaky.pdf", output_path)
+    assert http_server.requests["/flaky.pdf"] == http_server.fails + 1
+    with open(output_path, "rb") as f:
+        assert f.read() == PDF_CONTENT
+
+
+def test_download_gives_up_after_retries(http_server, downloader, tmp_path):
+    http_server.fails = 10
+    output_path = str(tmp_path / "flaky.pdf")
+    assert not downloader.download(http_server.url + "/flaky.pdf", output_path)
+    assert http_server.requests["/flaky.pdf"] == downloader.max_retries + 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_not_found(http_server, downloader, tmp_path):
+    output_path = str(tmp_path / "missing.pdf")
+    assert not downloader.download(http_server.url + "/missing.pdf", output_path)
+    assert http_server.requests["/missing.pdf"] == 1 # not retried
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_leaves_no_partial_file(http_server, downloader, tmp_path):
+    output_path = str(tmp_path / "truncated.pdf")
+    assert not downloader.download(http_server.url + "/truncated.pdf", output_path)
+    assert os.listdir(tmp_path) == [] # neither the output nor the .part file
+
+
+def test_download_many(http_server, downloader, tmp_path):
+    paths = ["/ok.pdf", "/flaky.pdf", "/missing.pdf", "/truncated.pdf"] * 5
+    jobs = [
+        (i, http_server.url + path, str(tmp_path / "{}.pdf".format(i))) for i, path in enumerate(paths)
+    ]
+    results = dict(downloader.download_many(iter(jobs)))
+
+    assert sorted(results) == list(range(len(jobs)))
+    for i, path in enumerate(paths):
+        assert results[i] == (path in ("/ok.pdf", "/flaky.pdf"))
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        "{}.pdf".format(i) for i, path in enumerate(paths) if results[i]
+    )
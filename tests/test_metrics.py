@@ -0,0 +1,12 @@
+from src.metrics import Registry
+
+
+def test_prometheus_label_values_are_escaped(tmp_path):
+    registry = Registry(str(tmp_path / "metrics.prom"), stage='stage "a"')
+    registry.inc("documents_total", 1, {"status": "failed", "reason": "C:\\path\nline"})
+    registry.dump()
+    lines = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert lines == [
+        "# TYPE loralay_documents_total counter",
+        'loralay_documents_total{reason="C:\\\\path\\nline",stage="stage \\"a\\"",status="failed"} 1',
+    ]
@@ -0,0 +1,88 @@
+import io
+import tarfile
+import numpy as np
+import pytest
+from PIL import Image
+from src.parse_html import extract_text_from_tree
+from src.remove_abstract import get_abstract_boxes, redact_images
+from src.token_format import TokenDoc, TxtDoc
+
+
+def _page(words):
+    words = "".join(
+        '<word xMin="{}" yMin="10" xMax="{}" yMax="20">{}</word>'.format(10 * i, 10 * i + 8, word)
+        for i, word in enumerate(words)
+    )
+    return '<page width="200" height="100"><flow><block><line>{}</line></block></flow></page>'.format(words)
+
+
+HAL_COVER = ["HAL", "is", "a", "multi-disciplinary", "open", "access", "archive"]
+
+# pdftotext -f 2 output: PDF pages 2 (HAL cover), 3 (empty), 4 and 5
+HTML = (
+    '<html xmlns="http://www.w3.org/1999/xhtml"><body><doc>'
+    + _page(HAL_COVER) + _page([]) + _page(["first", "page"]) + _page(["second", "page"])
+    + "</doc></body></html>"
+)
+
+
+@pytest.fixture
+def html_path(tmp_path):
+    path = tmp_path / "doc.html"
+    path.write_text(HTML)
+    return str(path)
+
+
+@pytest.mark.parametrize("parser", ["fast", "legacy"])
+def test_parsed_pages_keep_pdf_page_numbers(html_path, parser):
+    pages, pdf_pages = extract_text_from_tree(html_path, parser=parser, first_page=2)
+    assert [[elem[0] for elem in page] for page in pages] == [["first", "page"], ["second", "page"]]
+    assert pdf_pages == [4, 5]
+
+
+def test_pdf_page_numbers_round_trip(html_path, tmp_path):
+    doc = TokenDoc.from_pages(*extract_text_from_tree(html_path, first_page=2))
+    tok_path = str(tmp_path / "doc.tok")
+    txt_path = str(tmp_path / "doc.txt")
+    doc.select(np.array([False, False, True, True])).save(tok_path)
+    TokenDoc.load(tok_path).save_txt(txt_path)
+
+    for loaded in (TokenDoc.load(tok_path), TokenDoc.from_txt(txt_path), TxtDoc.load(txt_path)):
+        assert [loaded.pdf_page_num(page_num) for page_num in (1, 2)] == [4, 5]
+    # pages whose words are all removed are dropped from the index, not from the page numbers
+    selected = TxtDoc.load(txt_path).select(np.array([False, True]))
+    assert selected.pdf_page_num(2) == 5
+
+
+def test_legacy_documents_assume_pdf_page_numbers(html_path, tmp_path):
+    pages, _ = extract_text_from_tree(html_path)
+    path = str(tmp_path / "doc.tok")
+    TokenDoc.from_pages(pages).save(path)
+    assert TokenDoc.load(path).pdf_page_num(2) == 2
+
+
+def test_abstract_boxes_are_drawn_on_the_image_of_their_pdf_page(html_path, tmp_path):
+    doc = TokenDoc.from_pages(*extract_text_from_tree(html_path, first_page=2))
+    page_num, page, offset = next(iter(doc.iter_pages([2])))
+
+    # images rendered from PDF page 3 on
+    page_boxes = get_abstract_boxes([(offset, offset)], [(page_num, page, offset)], doc.pdf_page_num, 3)
+    assert list(page_boxes) == [3] # PDF page 5
+    assert page_boxes[3][1] == [[0.0, 10.0, 8.0, 20.0]]
+
+    in_tar = str(tmp_path / "doc.tar.gz")
+    out_tar = str(tmp_path / "out.tar.gz")
+    with tarfile.open(in_tar, "w:gz") as tar:
+        for img_num in (1, 2, 3):
+            buffer = io.BytesIO()
+            Image.new("RGB", (200, 100), "white").save(buffer, format="PNG")
+            member = tarfile.TarInfo("doc/doc-{}.png".format(img_num))
+            member.size = buffer.tell()
+            buffer.seek(0)
+            tar.addfile(member, buffer)
+    redact_images(in_tar, out_tar, page_boxes)
+
+    with tarfile.open(out_tar, "r:gz") as tar:
+        for img_num in (1, 2, 3):
+            image = Image.open(tar.extractfile("doc/doc-{}.png".format(img_num)))
+            assert (image.getpixel((4, 15)) == (0, 0, 0)) == (img_num == 3)
@@ -0,0 +1,50 @@
+import io
+import pytest
+from PIL import Image
+from src.pdf_catalog import PdfCatalog, inspect_pdf
+from src.convert_pdf_to_html import check_pdf
+from src.state_store import FAILED, SCANNED
+
+
+@pytest.fixture
+def pdf_data():
+    buffer = io.BytesIO()
+    Image.new("RGB", (200, 100), "white").save(buffer, format="PDF") # image only, no text layer
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def truncated_pdf(tmp_path, pdf_data):
+    path = tmp_path / "truncated.pdf"
+    path.write_bytes(pdf_data[:len(pdf_data) // 2])
+    return str(path)
+
+
+def test_inspect_pdf(tmp_path, pdf_data):
+    path = tmp_path / "scanned.pdf"
+    path.write_bytes(pdf_data)
+    entry = inspect_pdf(str(path))
+    assert not entry.broken
+    assert entry.num_pages == 1
+    assert entry.has_text is False
+
+
+def test_inspect_truncated_pdf(truncated_pdf):
+    entry = inspect_pdf(truncated_pdf)
+    assert entry.broken
+    assert entry.num_pages is None
+    assert entry.has_text is None
+
+
+def test_catalog_update_records_truncated_pdf(tmp_path, truncated_pdf):
+    catalog = PdfCatalog(str(tmp_path / "pdf_catalog.db"))
+    assert catalog.update([truncated_pdf]) == 1
+    assert catalog.get(truncated_pdf).broken
+    assert catalog.update([truncated_pdf]) == 0 # not read again
+
+
+def test_check_pdf(tmp_path, pdf_data, truncated_pdf):
+    path = tmp_path / "scanned.pdf"
+    path.write_bytes(pdf_data)
+    assert check_pdf(str(path), max_pages=-1, scanned_check_pages=1) == (SCANNED, "no_text_layer")
+    assert check_pdf(truncated_pdf, max_pages=-1) == (FAILED, "invalid_pdf")
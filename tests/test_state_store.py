@@ -0,0 +1,19 @@
+from src.state_store import StateStore, DONE
+
+
+def test_outputs_written_before_commit(tmp_path):
+    output_path = tmp_path / "abstracts.jsonl"
+    store = StateStore(str(tmp_path / "state.db"), stage="test", batch_size=2)
+    with store.open_output(str(output_path)) as f:
+        for doc_id in ("a", "b"):
+            f.write(doc_id + "\n")
+            store.record(doc_id, DONE)
+        # the batch has been committed: the lines of the documents are on disk
+        assert StateStore(store.db_path, stage="test").get_ids(statuses=[DONE]) == {"a", "b"}
+        assert output_path.read_text() == "a\nb\n"
+
+        f.write("c\n")
+        store.record("c", DONE)
+    assert output_path.read_text() == "a\nb\nc\n"
+    store.close()
+    assert store.get_ids(statuses=[DONE]) == {"a", "b", "c"}
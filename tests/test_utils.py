@@ -0,0 +1,37 @@
+import json
+import os
+import pytest
+from src.utils import get_ids_from_arxiv_or_pubmed, IDS_SIDECAR_EXT
+
+
+IDS = ["1", "2", "3", "4"]
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "metadata.jsonl"
+    path.write_text("".join(json.dumps({"article_id": article_id, "abstract": "..."}) + "\n" for article_id in IDS))
+    return str(path)
+
+
+@pytest.mark.parametrize("limit, expected", [(None, IDS), (-1, IDS), (0, []), (2, IDS[:2]), (10, IDS)])
+def test_limit(input_file, limit, expected):
+    # scanning the file, then reading the sidecar if the whole file was read
+    assert list(get_ids_from_arxiv_or_pubmed(input_file, None)) == IDS
+    assert os.path.isfile(input_file + IDS_SIDECAR_EXT)
+    assert list(get_ids_from_arxiv_or_pubmed(input_file, limit)) == expected
+    os.remove(input_file + IDS_SIDECAR_EXT)
+    assert list(get_ids_from_arxiv_or_pubmed(input_file, limit)) == expected
+
+
+@pytest.mark.parametrize("limit, sidecar", [(0, False), (2, False), (4, True), (None, True)])
+def test_sidecar_only_written_after_reading_the_whole_file(input_file, limit, sidecar):
+    list(get_ids_from_arxiv_or_pubmed(input_file, limit))
+    assert os.path.isfile(input_file + IDS_SIDECAR_EXT) == sidecar
+
+
+def test_sidecar_outdated(input_file):
+    list(get_ids_from_arxiv_or_pubmed(input_file))
+    with open(input_file, "a") as f:
+        f.write(json.dumps({"article_id": "5"}) + "\n")
+    assert list(get_ids_from_arxiv_or_pubmed(input_file)) == IDS + ["5"]